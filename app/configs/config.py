@@ -1,3 +1,5 @@
+
+
 class Settings():
     VERSION: str = "beta0.1"
     API_PREFIX: str = "/api/v1"
@@ -19,4 +21,221 @@ class Settings():
     # REDIRECT_URI = "https://smart-on-fhir-python-app.onrender.com/fhir-app/"
 
 
-credentialSettings = Settings()
\ No newline at end of file
+credentialSettings = Settings()
+
+
+class Settings():
+    # Shared httpx.AsyncClient used for every call to the FHIR / token server
+    MAX_CONNECTIONS = 20
+    MAX_KEEPALIVE_CONNECTIONS = 10
+    KEEPALIVE_EXPIRY = 30.0  # seconds an idle connection is kept in the pool
+
+    # HTTP/2 multiplexing needs the optional `h2` package (pip install httpx[http2])
+    HTTP2 = False
+
+    TIMEOUT = 10.0  # seconds, read/write/pool
+    CONNECT_TIMEOUT = 5.0  # seconds
+
+
+httpClientSettings = Settings()
+
+
+class Settings():
+    # How get_records fetches Observations:
+    #   "multi-code": one search with a comma-separated `code=` list, demultiplexed by LOINC code
+    #   "per-code": one search per LOINC code (fallback for servers that reject OR-searches)
+    OBSERVATION_FETCH_MODE = "multi-code"
+    MULTI_CODE_PAGE_SIZE = 200  # _count sent with the multi-code search
+    MULTI_CODE_MAX_PAGES = 2  # `next` pages followed before re-fetching missing codes one by one
+
+    # Observation searches ask the server for newest-first results so `entry[0]` is the latest value;
+    # set SEARCH_SORT to None for servers that reject `_sort`
+    SEARCH_SORT = "-date"
+    SEARCH_PAGE_SIZE = 50  # default _count of ObservationSearch (history queries)
+    LATEST_PAGE_SIZE = 1  # _count of "latest value" lookups
+
+    # Parse ObservationSearch pages incrementally from the byte stream (bounded memory per page);
+    # streamed pages bypass the conditional-GET response cache
+    STREAM_BUNDLES = True
+
+    # Ask for only the elements listed in reference.PROJECTION_PROFILES (`_elements`, then `_summary`)
+    PROJECTION_ENABLED = True
+
+    # Identical GETs already in flight (same URL and access token) share one upstream request
+    COALESCE_REQUESTS = True
+
+    # Patient/$everything ingestion (used when the query planner picks the "everything" strategy)
+    EVERYTHING_TYPES = "Patient,Observation"  # _type sent with $everything
+    EVERYTHING_PAGE_SIZE = 100  # _count sent with $everything
+    EVERYTHING_MAX_PAGES = 50
+
+
+fhirSettings = Settings()
+
+
+class Settings():
+    # Pick the get_records strategy from each server's CapabilityStatement; when False
+    # fhirSettings.OBSERVATION_FETCH_MODE is always used
+    ENABLED = True
+    CAPABILITY_TTL = 3600  # seconds a `[base]/metadata` response is trusted
+    CAPABILITY_RETRY_TTL = 60  # seconds before `[base]/metadata` is tried again after it failed (plain searches meanwhile)
+
+    # Candidate strategies; the one needing the fewest round trips wins, ties go to the earlier entry
+    STRATEGIES = ["batch", "include", "everything", "multi-code", "per-code"]
+
+    # Force a strategy for a given ISS, e.g. {"https://fhir.example.org/r4": "per-code"}
+    STRATEGY_OVERRIDES = {}
+
+
+plannerSettings = Settings()
+
+
+class Settings():
+    # In-process cache of extracted patient records, keyed by (FHIR base URL, patient id)
+    RECORD_CACHE_ENABLED = True
+    RECORD_TTL = 300  # seconds
+    RECORD_CACHE_MAX_ENTRIES = 1000
+    RECORD_CACHE_MAX_BYTES = 16 * 1024 * 1024  # approximate, measured as serialized JSON
+    # Whether DELETE /get_records/cache?all_patients=true may drop every patient's records and histories (an admin operation)
+    ALLOW_CLEAR_ALL_PATIENTS = False
+
+    # FHIR responses kept with their ETag / Last-Modified so stale ones are revalidated with a conditional GET
+    RESPONSE_CACHE_ENABLED = True
+    RESPONSE_CACHE_TTL = 24 * 3600  # seconds a response (and its validators) is kept at all
+    RESPONSE_MAX_FRESHNESS = 60  # cap on the Cache-Control max-age honored without revalidating
+    RESPONSE_CACHE_MAX_ENTRIES = 5000
+    RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # measured as response body bytes
+
+
+cacheSettings = Settings()
+
+
+class Settings():
+    # "orjson" decodes FHIR bytes and renders API responses with orjson (pip install orjson);
+    # falls back to "stdlib" (json + jsonable_encoder) when orjson is not installed
+    JSON_BACKEND = "orjson"
+
+
+jsonSettings = Settings()
+
+
+class Settings():
+    # SMART discovery (`/.well-known/smart-configuration`), loaded on first use / in the lifespan
+    TTL = 24 * 3600  # seconds before a cached configuration must be refetched before use
+    REFRESH_AFTER = 3600  # seconds after which it is served stale while refreshed in the background
+
+
+discoverySettings = Settings()
+
+
+class Settings():
+    # Idempotent (GET) FHIR requests are retried with full-jitter exponential backoff
+    RETRY_ENABLED = True
+    RETRY_MAX_ATTEMPTS = 3  # including the first one
+    RETRY_BACKOFF_BASE = 0.2  # seconds, doubled on every retry
+    RETRY_BACKOFF_MAX = 2.0
+    RETRY_STATUSES = [429, 502, 503, 504]  # 429 waits for its Retry-After in the concurrency limiter
+
+    # Per-host circuit breaker: fail fast while the EHR is down, probe it again after the reset timeout
+    BREAKER_ENABLED = True
+    BREAKER_FAILURE_THRESHOLD = 5  # consecutive failed attempts that open the circuit
+    BREAKER_RESET_TIMEOUT = 30.0  # seconds the circuit stays open before one probe is let through
+
+    # Hedged requests: a GET still outstanding after the host's HEDGE_PERCENTILE latency is sent again
+    HEDGE_ENABLED = False
+    HEDGE_PERCENTILE = 95
+    HEDGE_MIN_SAMPLES = 20  # latencies needed before hedging starts
+    HEDGE_MIN_DELAY = 0.05  # seconds, lower bound of the hedge threshold
+    LATENCY_WINDOW = 200  # latencies kept per host
+
+
+resilienceSettings = Settings()
+
+
+class Settings():
+    # Per-host AIMD concurrency limiter in front of every FHIR request attempt
+    ENABLED = True
+    INITIAL_LIMIT = 8
+    MIN_LIMIT = 1
+    MAX_LIMIT = 20  # no point going above httpClientSettings.MAX_CONNECTIONS
+    LATENCY_WINDOW = 100  # latencies kept per host; their minimum is the unloaded baseline
+    LATENCY_TOLERANCE = 2.0  # a response slower than baseline * tolerance counts as congestion
+    LATENCY_BACKOFF = 0.9  # multiplicative decrease on congestion
+    THROTTLE_BACKOFF = 0.5  # multiplicative decrease on 429 / 503 / timeouts
+    RETRY_AFTER_MAX = 30.0  # cap, in seconds, on how long a Retry-After header pauses a host
+
+
+concurrencySettings = Settings()
+
+
+class Settings():
+    # End-to-end time budget, in seconds, shared by every upstream FHIR call a request makes;
+    # observations still missing when it runs out are shown as UNAVAILABLE instead of failing the page
+    RENDER_DATA = 2.0
+    RENDER_DATA_STREAM = 8.0  # streamed rows are filled in as they arrive, so a later deadline is affordable
+    API = 8.0  # get_records / get_calculations / calculate_ascvd_risk called directly
+
+    UNAVAILABLE = "Pending / unavailable"
+
+
+deadlineSettings = Settings()
+
+
+class Settings():
+    # render_data flushes the page shell at once and fills every row in as its data resolves
+    # (`/render_data?stream=false` renders the whole page in one go)
+    STREAM = True
+    PLACEHOLDER = "Loading…"
+
+
+renderSettings = Settings()
+
+
+class Settings():
+    # Bulk Data `$export` feeding population runs of the calculators (see run_population.py)
+    BASE_URL = credentialSettings.BASE_URL
+    TYPES = "Patient,Observation"
+    TYPE_FILTER = False  # restrict exported Observations to OBSERVATION_CODES with `_typeFilter` (not every server supports it)
+
+    # Kick-off state, downloaded NDJSON files and results; running again with the same directory resumes
+    WORK_DIR = "bulk_export"
+
+    POLL_INTERVAL = 5.0  # seconds between status polls when the server sends no Retry-After
+    POLL_TIMEOUT = 6 * 3600  # seconds before giving up on an export that never completes
+    DOWNLOAD_CONCURRENCY = 4
+
+
+bulkSettings = Settings()
+
+
+class Settings():
+    # Vectorized (NumPy) IBW / ABW, CrCl, OST and METS-IR for population runs; NumPy is optional,
+    # without it every patient goes through the scalar get_calculations functions
+    ENABLED = True
+    BATCH_SIZE = 10000  # patients calculated per vectorized pass in run_population
+
+
+cohortSettings = Settings()
+
+
+class Settings():
+    # Per-calculator run counts and timings of the calculation graph, reported by /metrics;
+    # off by default as it costs about as much as a calculator itself
+    TIMING = False
+
+
+calculationSettings = Settings()
+
+
+class Settings():
+    # Observation history (every value of a code, not only the latest), kept per patient as time series
+    # for trend charts and `as_of` records (see app/middleware/timeseries.py)
+    TTL = 3600  # seconds
+    MAX_ENTRIES = 10000  # (patient, observation) series sets
+    MAX_BYTES = 64 * 1024 * 1024  # measured as the timestamp / value arrays
+    PAGE_SIZE = 200  # _count of each history search
+    MAX_PAGES = 10  # per observation; older values are left out
+    MAX_BUCKETS = 1000  # largest `buckets` a downsampled history may ask for
+
+
+historySettings = Settings()
@@ -81,4 +81,35 @@ population_data = {
         "mean_coefficient_value": 19.54,
         "baseline_survival": 0.8954
     }
-}
\ No newline at end of file
+}
+
+
+### 4. Observations fetched for every patient in get_records
+# 每個觀察項目的類別與 LOINC 代碼
+OBSERVATION_CODES = {
+    "height": {"category": "vital-signs", "code": "8302-2"},
+    "weight": {"category": "vital-signs", "code": "29463-7"},
+    "bmi": {"category": "vital-signs", "code": "39156-5"},
+    "bp": {"category": "vital-signs", "code": "55284-4"},
+    "hdl": {"category": "laboratory", "code": "2085-9"},
+    "ldl": {"category": "laboratory", "code": "18262-6"},
+    "tg": {"category": "laboratory", "code": "2571-8"},
+    "chol": {"category": "laboratory", "code": "2093-3"},
+    "scr": {"category": "laboratory", "code": "38483-4"},
+    "glucose": {"category": "laboratory", "code": "2339-0"},
+    "smoking": {"category": "survey", "code": "72166-2"},
+}
+
+
+### 5. Payload projection: the only elements the extractors read
+# 送出 `_elements` (伺服器不支援時改用 `_summary`)，只下載需要的欄位
+PROJECTION_PROFILES = {
+    "Patient": {
+        "elements": ["name", "birthDate", "gender", "extension"],  # race / ethnicity are US Core extensions
+        "summary": "data",
+    },
+    "Observation": {
+        "elements": ["code", "valueQuantity", "valueCodeableConcept", "component", "effectiveDateTime", "effectivePeriod", "effectiveInstant", "issued"],
+        "summary": "data",
+    },
+}
@@ -0,0 +1,198 @@
+import math
+import operator
+import typing
+
+from app.configs.reference import COEFFICIENTS, population_data
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+
+# Terms of the 2013 pooled cohort equations, in the order of the compiled coefficient rows.
+# Terms a group has no coefficient for weigh 0, as in _calculate_ln_values.
+TERMS = (
+    "Ln Age (y)",
+    "Ln Age, Squared",
+    "Ln Total Cholesterol (mg/dL)",
+    "Ln Age x Ln Total Cholesterol",
+    "Ln HDL-C (mg/dL)",
+    "Ln Age x Ln HDL-C",
+    "Ln Treated Systolic BP (mmHg)",
+    "Ln Age x Ln Treated Systolic BP",
+    "Ln Untreated Systolic BP (mmHg)",
+    "Ln Age x Ln Untreated Systolic BP",
+    "Current Smoker (1=Yes, 0=No)",
+    "Ln Age x Current Smoker",
+    "Diabetes (1=Yes, 0=No)",
+)
+
+# (is African American, is female) -> population group, as in _determine_population_group
+POPULATION_GROUPS = {
+    (False, True): "White & Women",
+    (False, False): "White & Men",
+    (True, True): "African American & Women",
+    (True, False): "African American & Men",
+}
+
+
+class AscvdModel(typing.NamedTuple):
+    groups: typing.Tuple[str, ...]
+    coefficients: typing.Tuple[typing.Tuple[float, ...], ...]  # one row of TERMS per group
+    mean_coefficient_values: typing.Tuple[float, ...]
+    baseline_survivals: typing.Tuple[float, ...]
+
+
+def compile_model(coefficients=COEFFICIENTS, populations=population_data) -> AscvdModel:
+    """
+    Turns the string-keyed COEFFICIENTS / population_data tables into one numeric row per population group.
+    """
+    groups = tuple(group for group in POPULATION_GROUPS.values() if group in coefficients and group in populations)
+
+    return AscvdModel(
+        groups=groups,
+        coefficients=tuple(tuple(float(coefficients[group].get(term) or 0) for term in TERMS) for group in groups),
+        mean_coefficient_values=tuple(populations[group]["mean_coefficient_value"] for group in groups),
+        baseline_survivals=tuple(populations[group]["baseline_survival"] for group in groups),
+    )
+
+
+MODEL = compile_model()
+GROUP_INDEX = {key: MODEL.groups.index(group) for key, group in POPULATION_GROUPS.items() if group in MODEL.groups}
+
+if np is not None:
+    _COEFFICIENTS = np.array(MODEL.coefficients)
+    _MEAN_COEFFICIENT_VALUES = np.array(MODEL.mean_coefficient_values)
+    _BASELINE_SURVIVALS = np.array(MODEL.baseline_survivals)
+
+
+def population_group(race, gender) -> typing.Optional[int]:
+    """
+    Index of the patient's population group in MODEL, None when the gender is neither male nor female.
+    """
+    gender = gender.lower()
+    if gender not in ("male", "female"):
+        return None
+
+    return GROUP_INDEX.get(("black" in race.lower(), gender == "female"))
+
+
+def ascvd_terms(age, cholesterol, hdl, sbp, has_diabetes, is_smoking, is_treating_htn) -> typing.Tuple[float, ...]:
+    """
+    The values the TERMS coefficients multiply, for one patient.
+    """
+    ln_age = math.log(age)
+    ln_cholesterol = math.log(cholesterol)
+    ln_hdl = math.log(hdl)
+    ln_sbp = math.log(sbp)
+    smoker = 1.0 if is_smoking else 0.0
+    treated = 1.0 if is_treating_htn else 0.0
+
+    return (
+        ln_age,
+        ln_age ** 2,
+        ln_cholesterol,
+        ln_age * ln_cholesterol,
+        ln_hdl,
+        ln_age * ln_hdl,
+        treated * ln_sbp,
+        treated * ln_age * ln_sbp,
+        (1 - treated) * ln_sbp,
+        (1 - treated) * ln_age * ln_sbp,
+        smoker,
+        smoker * ln_age,
+        1.0 if has_diabetes else 0.0,
+    )
+
+
+def ascvd_risk(group, terms) -> typing.Optional[float]:
+    """
+    10-year risk of a first hard ASCVD event, as a percentage: one dot product of the patient's terms
+    (see ascvd_terms) with the compiled coefficients of their group. None when the group is unknown.
+
+    Matches the /calculate_ascvd_risk computation, including rounding the individual sum to 2 decimals.
+    """
+    if group is None:
+        return None
+
+    value_sum = round(sum(map(operator.mul, MODEL.coefficients[group], terms)), 2)
+
+    return (1 - MODEL.baseline_survivals[group] ** math.exp(value_sum - MODEL.mean_coefficient_values[group])) * 100
+
+
+def score_ascvd(race, gender, age, cholesterol, hdl, sbp, has_diabetes, is_smoking, is_treating_htn) -> typing.Optional[float]:
+    """
+    ascvd_risk of one patient; None when the population group cannot be determined.
+    Non-positive age, cholesterol, HDL or SBP raise ValueError, as in _calculate_ln_values.
+    """
+    group = population_group(race, gender)
+    if group is None:
+        return None
+
+    return ascvd_risk(group, ascvd_terms(age, cholesterol, hdl, sbp, has_diabetes, is_smoking, is_treating_htn))
+
+
+def encode_population_groups(races, genders) -> "np.ndarray":
+    """
+    population_group of every patient, -1 when it cannot be determined.
+    """
+    return np.fromiter(
+        (
+            -1 if group is None else group
+            for group in (
+                population_group(race, gender) if isinstance(race, str) and isinstance(gender, str) else None
+                for race, gender in zip(races, genders)
+            )
+        ),
+        dtype=np.int8,
+        count=len(races),
+    )
+
+
+def score_ascvd_batch(group, age, cholesterol, hdl, sbp, has_diabetes, is_smoking, is_treating_htn) -> "np.ndarray":
+    """
+    score_ascvd for N patients at once.
+
+    Args:
+        group (array): Population group indexes (see encode_population_groups).
+        age, cholesterol, hdl, sbp (array): As in score_ascvd.
+        has_diabetes, is_smoking, is_treating_htn (array): Booleans.
+
+    Returns:
+        np.ndarray: Risk percentages; NaN where the group is unknown or an input is not positive.
+    """
+    group = np.asarray(group, dtype=np.intp)
+    age, cholesterol, hdl, sbp = (np.asarray(column, dtype=np.float64) for column in (age, cholesterol, hdl, sbp))
+    diabetes, smoker, treated = (np.asarray(column, dtype=np.float64) for column in (has_diabetes, is_smoking, is_treating_htn))
+
+    with np.errstate(all="ignore"):
+        ln_age = np.log(np.where(age > 0, age, np.nan))
+        ln_cholesterol = np.log(np.where(cholesterol > 0, cholesterol, np.nan))
+        ln_hdl = np.log(np.where(hdl > 0, hdl, np.nan))
+        ln_sbp = np.log(np.where(sbp > 0, sbp, np.nan))
+
+        terms = np.column_stack((
+            ln_age,
+            ln_age ** 2,
+            ln_cholesterol,
+            ln_age * ln_cholesterol,
+            ln_hdl,
+            ln_age * ln_hdl,
+            treated * ln_sbp,
+            treated * ln_age * ln_sbp,
+            (1 - treated) * ln_sbp,
+            (1 - treated) * ln_age * ln_sbp,
+            smoker,
+            smoker * ln_age,
+            diabetes,
+        ))
+
+        known = group >= 0
+        rows = np.where(known, group, 0)
+
+        # One dot product per patient, with the coefficient row of their group
+        value_sum = np.round(np.einsum("ij,ij->i", terms, _COEFFICIENTS[rows]), 2)
+        risk = (1 - _BASELINE_SURVIVALS[rows] ** np.exp(value_sum - _MEAN_COEFFICIENT_VALUES[rows])) * 100
+
+    return np.where(known, risk, np.nan)
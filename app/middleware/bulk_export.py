@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import typing
+import urllib.parse
+
+import httpx
+
+from app.configs.config import bulkSettings
+from app.configs.reference import OBSERVATION_CODES
+from app.middleware.concurrency_limiter import parse_retry_after
+from app.middleware.exception import exception_message
+from app.middleware.http_client import get_http_client
+from app.middleware.json_backend import loads
+from app.middleware.metrics import metrics
+
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+
+class BulkExportError(Exception):
+    """
+    Raised when the server refuses, fails or never finishes a `$export`.
+    """
+
+
+class BulkExportClient():
+    """
+    FHIR Bulk Data `$export` client: kick-off, status polling and concurrent NDJSON downloads.
+
+    Progress is saved to `state.json` in `work_dir` after every step, so running it again after an
+    interruption resumes where it stopped: an export already kicked off is polled again instead of
+    being restarted, and partly downloaded files continue with a `Range` request.
+
+    Usage:
+        client = BulkExportClient(base_url, work_dir, token=token)
+        files = await client.run()  # {"Patient": [path, ...], "Observation": [path, ...]}
+        async for resource in iter_ndjson(files["Observation"][0]):
+            ...
+    """
+
+    def __init__(self, base_url=None, work_dir=None, token=None, types=None, http_client: typing.Optional[httpx.AsyncClient] = None):
+        self.base_url = (base_url or bulkSettings.BASE_URL).rstrip("/")
+        self.work_dir = work_dir or bulkSettings.WORK_DIR
+        self.token = token
+        self.types = types or bulkSettings.TYPES
+        self.http_client = http_client
+
+        self.state_path = os.path.join(self.work_dir, "state.json")
+        self.state = self._load_state()
+
+    def _client(self) -> httpx.AsyncClient:
+        return self.http_client or get_http_client()
+
+    def _headers(self, authorized=True, **extra) -> dict:
+        headers = {"Accept": "application/fhir+json", **extra}
+        if authorized and self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        return headers
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+        # A work dir left behind by an export of another server or of other types starts over
+        if state.get("base_url") != self.base_url or state.get("types") != self.types:
+            return {}
+
+        return state
+
+    def _save_state(self):
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        # Write then rename, so an interruption never leaves a half-written state file
+        temporary = f"{self.state_path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.state, file, indent=2)
+        os.replace(temporary, self.state_path)
+
+    async def run(self) -> typing.Dict[str, typing.List[str]]:
+        """
+        Runs (or resumes) the export and returns the downloaded NDJSON files grouped by resource type.
+        """
+        if not self.state.get("manifest"):
+            if not self.state.get("status_url"):
+                await self.kick_off()
+            manifest = await self.poll()
+            if manifest is None:
+                # The server forgot the export we were resuming (expired or cleaned up): start a new one
+                await self.kick_off()
+                manifest = await self.poll()
+                if manifest is None:
+                    raise BulkExportError("The status of the export disappeared while polling it")
+
+            self.state["manifest"] = manifest
+            self._save_state()
+
+        return await self.download()
+
+    async def kick_off(self):
+        params = {"_type": self.types}
+        if bulkSettings.TYPE_FILTER:
+            codes = ",".join(observation["code"] for observation in OBSERVATION_CODES.values())
+            params["_typeFilter"] = f"Observation?code={codes}"
+
+        url = f"{self.base_url}/$export?{urllib.parse.urlencode(params)}"
+        response = await self._client().get(url, headers=self._headers(Prefer="respond-async"))
+
+        if response.status_code != 202 or "Content-Location" not in response.headers:
+            raise BulkExportError(f"$export kick-off failed with status {response.status_code}: {response.text[:500]}")
+
+        self.state = {
+            "base_url": self.base_url,
+            "types": self.types,
+            "status_url": response.headers["Content-Location"],
+            "kicked_off_at": time.time(),
+            "files": {},
+        }
+        self._save_state()
+
+        metrics.inc("bulk_export.kick_offs")
+        uvicorn_logger.info(f"$export kicked off, status at {self.state['status_url']}")
+
+    async def poll(self) -> typing.Optional[dict]:
+        """
+        Polls the status endpoint until the export completes and returns its manifest (None if the export is gone).
+        """
+        started = time.monotonic()
+
+        while True:
+            response = await self._client().get(self.state["status_url"], headers=self._headers())
+            metrics.inc("bulk_export.polls")
+
+            if response.status_code == 200:
+                manifest = response.json()
+                for error in manifest.get("error", []):
+                    system_logger.warning(f"$export reported an error file: {error.get('url')}")
+                return manifest
+
+            if response.status_code in (404, 410):
+                system_logger.warning(f"$export status {self.state['status_url']} returned {response.status_code}")
+                return None
+
+            if response.status_code not in (202, 429):
+                raise BulkExportError(f"$export failed with status {response.status_code}: {response.text[:500]}")
+
+            if time.monotonic() - started > bulkSettings.POLL_TIMEOUT:
+                raise BulkExportError(f"$export did not complete within {bulkSettings.POLL_TIMEOUT}s")
+
+            progress = response.headers.get("X-Progress")
+            if progress:
+                uvicorn_logger.info(f"$export in progress: {progress}")
+
+            await asyncio.sleep(parse_retry_after(response.headers.get("Retry-After")) or bulkSettings.POLL_INTERVAL)
+
+    async def download(self) -> typing.Dict[str, typing.List[str]]:
+        manifest = self.state["manifest"]
+        outputs = manifest.get("output", [])
+        authorized = manifest.get("requiresAccessToken", True)
+
+        files = self.state.setdefault("files", {})
+        for index, output in enumerate(outputs):
+            files.setdefault(output["url"], {
+                "type": output["type"],
+                "path": os.path.join(self.work_dir, f"{index:04d}.{output['type']}.ndjson"),
+                "complete": False,
+            })
+        self._save_state()
+
+        semaphore = asyncio.Semaphore(bulkSettings.DOWNLOAD_CONCURRENCY)
+
+        async def download_one(url, file):
+            async with semaphore:
+                await self._download_file(url, file, authorized)
+                file["complete"] = True
+                self._save_state()
+
+        await asyncio.gather(*[download_one(url, file) for url, file in files.items() if not file["complete"]])
+
+        grouped = {}
+        for output in outputs:
+            grouped.setdefault(output["type"], []).append(files[output["url"]]["path"])
+
+        return grouped
+
+    async def _download_file(self, url, file, authorized):
+        path = file["path"]
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+
+        headers = self._headers(authorized, Accept="application/fhir+ndjson")
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        try:
+            async with self._client().stream("GET", url, headers=headers) as response:
+                if response.status_code == 416:
+                    return  # the part we already have is the whole file
+                if response.status_code not in (200, 206):
+                    raise BulkExportError(f"Downloading {url} failed with status {response.status_code}")
+
+                # A server that ignores Range sends the whole file again
+                mode = "ab" if response.status_code == 206 else "wb"
+                if offset and mode == "ab":
+                    metrics.inc("bulk_export.resumed_downloads")
+
+                with open(path, mode) as output:
+                    async for chunk in response.aiter_bytes():
+                        output.write(chunk)
+                        metrics.inc("bulk_export.bytes_downloaded", len(chunk))
+
+        except httpx.RequestError as e:
+            raise BulkExportError(f"Downloading {url} failed: {exception_message(e)}")
+
+        metrics.inc("bulk_export.files_downloaded")
+        uvicorn_logger.info(f"Downloaded {file['type']} NDJSON to {path}")
+
+
+async def iter_ndjson(path) -> typing.AsyncIterator[dict]:
+    """
+    Yields the resources of an NDJSON file one line at a time, without loading the file into memory.
+    """
+    with open(path, "rb") as file:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield loads(line)
+            except ValueError as e:
+                system_logger.warning(f"Skipping line {number} of {path}: {exception_message(e)}")
+
+            if number % 1000 == 0:
+                await asyncio.sleep(0)  # let other tasks run while large files are read
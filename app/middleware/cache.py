@@ -0,0 +1,84 @@
+import time
+import typing
+from collections import OrderedDict
+
+from app.middleware.json_backend import dumps
+from app.middleware.metrics import metrics
+
+
+class LRUCache():
+    """
+    In-process TTL + LRU cache with an approximate memory cap.
+
+    Entries expire `ttl` seconds after they are stored. When the cache holds more than
+    `max_entries` values or more than `max_bytes` (serialized JSON size unless the caller
+    passes `size`), the least recently used values are evicted first. Hits, misses,
+    expirations, evictions and invalidations are counted under `<name>.*` in the metrics.
+    """
+
+    def __init__(self, name, ttl, max_entries, max_bytes):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+
+        metrics.register_collector(name, self.usage)
+
+    def get(self, key) -> typing.Any:
+        item = self._entries.get(key)
+
+        if item is None:
+            metrics.inc(f"{self.name}.misses")
+            return None
+
+        expires_at, _, value = item
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            metrics.inc(f"{self.name}.expired")
+            metrics.inc(f"{self.name}.misses")
+            return None
+
+        self._entries.move_to_end(key)
+        metrics.inc(f"{self.name}.hits")
+
+        return value
+
+    def set(self, key, value, size=None):
+        if size is None:
+            size = len(dumps(value))
+
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            metrics.inc(f"{self.name}.evictions")
+
+    def invalidate(self, match: typing.Optional[typing.Callable[[typing.Any], bool]] = None) -> int:
+        """
+        Drops every key for which `match(key)` is True (everything when `match` is None). Returns the number dropped.
+        """
+        keys = [key for key in self._entries if match is None or match(key)]
+        for key in keys:
+            self._remove(key)
+
+        metrics.inc(f"{self.name}.invalidations", len(keys))
+
+        return len(keys)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def usage(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._bytes, "max_entries": self.max_entries, "max_bytes": self.max_bytes, "ttl": self.ttl}
@@ -0,0 +1,236 @@
+import time
+import typing
+import operator
+from collections import defaultdict
+
+from app.configs.config import calculationSettings
+from app.middleware.ascvd import population_group, ascvd_terms, ascvd_risk
+from app.middleware.metrics import metrics
+from app.models.observation import require_quantity
+from app.routers.v1.endpoints.get_calculations import (
+    CALCULATION_ERRORS, NOT_AVAILABLE,
+    _body_mass_index, _ideal_body_weight, _ibw_abw_rows, _creatinine_clearance, _crcl_rows, _ost_rows, _mets_ir, _mets_ir_rows,
+)
+
+
+class Calculator(typing.NamedTuple):
+    name: str
+    inputs: typing.Tuple[str, ...]  # record fields, values given to evaluate() or outputs of other calculators
+    outputs: typing.Tuple[str, ...]
+    func: typing.Callable  # called with the inputs in order; returns one value per output (a bare value for a single output)
+    unavailable: typing.Optional[tuple]  # outputs when an input is missing or the calculation fails; None leaves them out
+    arguments: typing.Callable  # known values -> inputs (precompiled, evaluate() runs once per patient)
+
+
+class CalculationGraph():
+    """
+    Registry of calculators, each declaring the values it reads and the values it produces.
+
+    evaluate() runs only the calculators its targets depend on, in dependency order and each once,
+    so intermediates shared by several calculators (BMI, IBW, the ASCVD terms) are computed a single time per patient.
+    A calculator whose inputs are not all known is skipped: its outputs become `unavailable`, or stay unknown
+    (and skip their own dependents) when it declares none. With calculationSettings.TIMING, run counts and time per calculator are kept for usage().
+    """
+
+    def __init__(self):
+        self._calculators = {}  # name -> Calculator
+        self._producers = {}  # output -> Calculator
+        self._plans = {}  # targets -> calculators in evaluation order
+        self._stats = defaultdict(lambda: [0, 0, 0.0])  # name -> [runs, skips, seconds]
+
+    def register(self, name, inputs, outputs, unavailable=None):
+        """
+        Decorator adding a calculator to the graph.
+        """
+        def decorator(func):
+            for output in outputs:
+                if output in self._producers:
+                    raise ValueError(f"'{output}' is already produced by calculator '{self._producers[output].name}'")
+
+            inputs_ = tuple(inputs)
+            calculator = Calculator(
+                name, inputs_, tuple(outputs), func,
+                None if unavailable is None else tuple(unavailable),
+                operator.itemgetter(*inputs_) if len(inputs_) > 1 else (lambda known: (known[inputs_[0]],)),
+            )
+            self._calculators[name] = calculator
+            for output in calculator.outputs:
+                self._producers[output] = calculator
+            self._plans.clear()
+
+            return func
+
+        return decorator
+
+    def plan(self, targets) -> typing.List[Calculator]:
+        """
+        The calculators needed for `targets`, each after the calculators it depends on.
+        """
+        targets = tuple(targets)
+        plan = self._plans.get(targets)
+        if plan is not None:
+            return plan
+
+        plan = []
+        planned = set()
+        visiting = set()
+
+        def visit(value):
+            calculator = self._producers.get(value)
+            if calculator is None or calculator.name in planned:
+                return  # an input given to evaluate(), or already planned
+
+            if calculator.name in visiting:
+                raise ValueError(f"Calculator '{calculator.name}' depends on its own output")
+            visiting.add(calculator.name)
+
+            for name in calculator.inputs:
+                visit(name)
+
+            visiting.discard(calculator.name)
+            planned.add(calculator.name)
+            plan.append(calculator)
+
+        for target in targets:
+            visit(target)
+
+        self._plans[targets] = plan
+        return plan
+
+    def inputs_of(self, target) -> typing.Tuple[str, ...]:
+        """
+        The values `target` is computed from that no calculator produces (record fields, evaluate() arguments).
+        """
+        inputs = []
+        for calculator in self.plan((target,)):
+            inputs.extend(name for name in calculator.inputs if name not in self._producers and name not in inputs)
+
+        return tuple(inputs)
+
+    def evaluate(self, values, targets, strict=False, timings: typing.Optional[dict] = None) -> dict:
+        """
+        Computes `targets` from `values` (e.g. a record).
+
+        Args:
+            values (dict): Known values by name.
+            targets (iterable): Outputs wanted.
+            strict (bool): Raise on the first missing input or calculation error instead of skipping the calculator.
+            timings (dict): Filled with the seconds every calculator that ran took (whatever calculationSettings.TIMING is).
+
+        Returns:
+            dict: `values` plus every output computed (or `unavailable`) on the way.
+        """
+        known = dict(values)
+        timed = timings is not None or calculationSettings.TIMING
+
+        for name, _, outputs, func, unavailable, arguments in self.plan(targets):
+            try:
+                args = arguments(known)
+            except KeyError as missing:
+                if strict:
+                    raise ValueError(f"{missing.args[0]} not available for {name}") from None
+                if timed:
+                    self._stats[name][1] += 1
+                result = unavailable
+
+            else:
+                if timed:
+                    started = time.perf_counter()
+
+                try:
+                    result = func(*args)
+                    if len(outputs) == 1:
+                        result = (result,)
+                except CALCULATION_ERRORS:
+                    if strict:
+                        raise
+                    result = unavailable
+
+                if timed:
+                    elapsed = time.perf_counter() - started
+                    stats = self._stats[name]
+                    stats[0] += 1
+                    stats[2] += elapsed
+                    if timings is not None:
+                        timings[name] = elapsed
+
+            if result is not None:
+                known.update(zip(outputs, result))
+
+        return known
+
+    def usage(self) -> dict:
+        return {
+            name: {
+                "runs": runs,
+                "skipped": skips,
+                "mean_us": round(seconds / runs * 1e6, 2) if runs else None,
+            }
+            for name, (runs, skips, seconds) in self._stats.items()
+        }
+
+
+calculation_graph = CalculationGraph()
+
+metrics.register_collector("calculation_graph", calculation_graph.usage)
+
+
+#### 中間值
+calculation_graph.register("bmi", ("Weight", "Height"), ("bmi",))(_body_mass_index)
+calculation_graph.register("ibw", ("Gender", "Height"), ("ibw",))(_ideal_body_weight)
+
+
+#### get_calculations 的各列
+calculation_graph.register(
+    "ibw_abw", ("ibw", "Weight"),
+    ("Ideal Body Weight (IBW)", "Adjusted Body Weight (ABW)"),
+    unavailable=(NOT_AVAILABLE, NOT_AVAILABLE),
+)(_ibw_abw_rows)
+
+
+@calculation_graph.register(
+    "crcl", ("Age", "Weight", "Gender", "Creatinine", "bmi", "ibw"),
+    ("Creatinine Clearance", "Creatinine Clearance (adjusted)"),
+    unavailable=(NOT_AVAILABLE, NOT_AVAILABLE + "  "),
+)
+def _crcl(age, weight, gender, creatinine, bmi, ibw):
+    actual_clcr, adjusted_clcr, _, method = _crcl_rows(*_creatinine_clearance(age, weight, gender, creatinine, bmi, ibw))
+    return actual_clcr, adjusted_clcr + "  " + method
+
+
+calculation_graph.register(
+    "ost", ("Weight", "Age", "Gender"),
+    ("OST Index", "Osteoporosis Risk"),
+    unavailable=(NOT_AVAILABLE, NOT_AVAILABLE),
+)(_ost_rows)
+
+
+@calculation_graph.register(
+    "mets_ir", ("Glucose (blood sugar)", "Triglycerides", "HDL", "bmi"),
+    ("METS-IR Value (Metabolic Score for Insulin Resistance)", "Risk of Developing T2D (METS-IR)"),
+    unavailable=(NOT_AVAILABLE, NOT_AVAILABLE),
+)
+def _mets_ir_value(glucose, tg, hdl, bmi):
+    return _mets_ir_rows(_mets_ir(glucose, tg, hdl, bmi))
+
+
+#### ASCVD (has_diabetes / is_smoking / is_treating_htn come from the user, not the record)
+calculation_graph.register("ascvd_group", ("Race", "Gender"), ("ascvd_group",))(population_group)
+
+
+@calculation_graph.register(
+    "ascvd_terms",
+    ("Age", "Cholesterol", "HDL", "Systolic BP", "has_diabetes", "is_smoking", "is_treating_htn"),
+    ("ascvd_terms",),
+)
+def _ascvd_terms(age, cholesterol, hdl, sbp, has_diabetes, is_smoking, is_treating_htn):
+    return ascvd_terms(
+        age,
+        require_quantity(cholesterol, "Cholesterol").value,
+        require_quantity(hdl, "HDL").value,
+        require_quantity(sbp, "Systolic BP").value,
+        has_diabetes, is_smoking, is_treating_htn,
+    )
+
+
+calculation_graph.register("ascvd_risk", ("ascvd_group", "ascvd_terms"), ("ascvd_risk",))(ascvd_risk)
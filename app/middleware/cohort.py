@@ -0,0 +1,336 @@
+import math
+import logging
+import typing
+
+from app.configs.config import cohortSettings
+from app.middleware.record_builder import compute_calculations, mark_unavailable
+from app.models.observation import Quantity, as_quantity
+from app.routers.v1.endpoints.get_calculations import NOT_AVAILABLE, get_ibw_abw, get_crcl, get_ost_index, get_mets_ir
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+
+MALE, FEMALE = 1, 2  # gender codes; anything else is 0 and fails the sex-specific formulas
+GENDERS = {MALE: "male", FEMALE: "female"}
+
+BMI_CATEGORIES = ("Underweight", "Normal weight", "Overweight / obese")
+CRCL_METHODS = ("actual weight", "ideal body weight", "adjusted body weight")  # weight used by the adjusted CrCl, per BMI category
+OST_RISKS = ("Low", "Intermediate", "High")
+METS_IR_RISKS = ("Low", "High")
+
+# Inputs outside this range overflow or underflow differently in NumPy and in Python floats
+# (e.g. `ht ** 2`); rows holding one are computed by the scalar functions instead
+_MAGNITUDE = (1e-100, 1e100)
+
+# Relative distance to a rounding or classification boundary below which NumPy's `log` / `x ** 2`
+# (which may differ from libm by one ulp) could flip the result; such rows are recomputed by the scalar functions
+_BOUNDARY_TOLERANCE = 1e-9
+
+
+def numpy_enabled() -> bool:
+    return cohortSettings.ENABLED and np is not None
+
+
+def encode_gender(genders) -> "np.ndarray":
+    """
+    Gender strings ("male", "Female", ...) as MALE / FEMALE codes, 0 for anything else.
+    """
+    codes = {"male": MALE, "female": FEMALE}
+    return np.fromiter(
+        (codes.get(gender.lower(), 0) if isinstance(gender, str) else 0 for gender in genders),
+        dtype=np.int8,
+        count=len(genders),
+    )
+
+
+def _number(text) -> float:
+    return float(text.split(" ")[0])
+
+
+def _round(values, digits, rows):
+    """
+    `round(value, digits)` of every row, identical to Python's correctly rounded `round`.
+    `np.round` scales by 10 ** digits first, which can land on the wrong side of a half; those rows are redone in Python.
+    """
+    rounded = np.round(values, digits)
+
+    scaled = np.abs(values * 10.0 ** digits)
+    ambiguous = rows & ((np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6) | (scaled > 2.0 ** 40))
+    for index in np.flatnonzero(ambiguous):
+        rounded[index] = round(float(values[index]), digits)
+
+    return rounded
+
+
+def _near(values, boundary):
+    return np.abs(values - boundary) <= _BOUNDARY_TOLERANCE * np.maximum(np.abs(boundary), 1.0)
+
+
+def compute_cohort(height, weight, age, gender, creatinine, glucose, tg, hdl) -> typing.Dict[str, "np.ndarray"]:
+    """
+    IBW / ABW, CrCl, OST and METS-IR of a whole cohort in one vectorized pass.
+
+    Every row gives exactly the numbers get_ibw_abw / get_crcl / get_ost_index / get_mets_ir report for
+    the same patient, quirks included (ABW is the actual weight, the adjusted CrCl uses the IBW rounded to 0.1).
+    Rows too close to a rounding or risk boundary for NumPy to be trusted are handed to the scalar functions.
+
+    Args:
+        height (array): Height in cm.
+        weight (array): Weight in kg.
+        age (array): Age in years.
+        gender (array): MALE / FEMALE codes (see encode_gender), or gender strings.
+        creatinine, glucose, tg, hdl (array): Serum creatinine, glucose, triglycerides and HDL in mg/dL.
+        Missing values are NaN.
+
+    Returns:
+        dict: One array per result, with a boolean `*_valid` mask per calculator; invalid rows hold NaN / -1
+        and correspond to the "Not available due to missing required data" of the scalar functions.
+    """
+    height, weight, age, creatinine, glucose, tg, hdl = (
+        np.asarray(column, dtype=np.float64) for column in (height, weight, age, creatinine, glucose, tg, hdl)
+    )
+    gender = np.asarray(gender)
+    if gender.dtype.kind not in "iu":
+        gender = encode_gender(gender)
+
+    with np.errstate(all="ignore"):
+        columns = {"height": height, "weight": weight, "age": age, "creatinine": creatinine, "glucose": glucose, "tg": tg, "hdl": hdl}
+        present = {name: ~np.isnan(column) for name, column in columns.items()}
+        extreme = {
+            name: present[name] & ((np.abs(column) > _MAGNITUDE[1]) | ((column != 0) & (np.abs(column) < _MAGNITUDE[0])))
+            for name, column in columns.items()
+        }
+        female = gender == FEMALE
+        sexed = (gender == MALE) | female
+
+        # IBW / ABW
+        ibw_valid = present["height"] & present["weight"] & sexed
+        ibw_scalar = ibw_valid & (extreme["height"] | extreme["weight"])
+        ibw_raw = np.where(female, 45.5, 50.0) + 2.3 * np.maximum(height / 2.54 - 60, 0)
+        ibw = _round(ibw_raw, 1, ibw_valid & ~ibw_scalar)
+
+        for index in np.flatnonzero(ibw_scalar):
+            ibw_text, _ = get_ibw_abw(GENDERS[gender[index]], Quantity(float(height[index]), "cm"), Quantity(float(weight[index]), "kg"))
+            if ibw_text == NOT_AVAILABLE:
+                ibw_valid[index] = False
+            else:
+                ibw[index] = _number(ibw_text)
+
+        # CrCl, with the BMI category choosing the weight of the adjusted value
+        bmi = weight / (height / 100) ** 2
+        factor = np.where(female, 0.85, 1.0)
+
+        crcl_valid = ibw_valid & present["age"] & present["creatinine"] & (height != 0) & (creatinine != 0)
+        crcl_scalar = crcl_valid & (
+            extreme["height"] | extreme["weight"] | extreme["age"] | extreme["creatinine"]
+            | _near(bmi, 18.5) | _near(bmi, 25.0)
+        )
+        crcl_rows = crcl_valid & ~crcl_scalar
+
+        category = np.where(bmi < 18.5, 0, np.where(bmi < 25, 1, 2)).astype(np.int8)
+        dosing_weight = np.where(category == 0, weight, np.where(category == 1, ibw, ibw + 0.4 * (weight - ibw)))
+
+        crcl = _round((140 - age) * weight * factor / (72 * creatinine), 2, crcl_rows)
+        crcl_adjusted = _round((140 - age) * dosing_weight * factor / (72 * creatinine), 2, crcl_rows)
+
+        for index in np.flatnonzero(crcl_scalar):
+            actual, adjusted, bmi_category, _ = get_crcl(
+                float(age[index]), Quantity(float(weight[index]), "kg"), GENDERS[gender[index]],
+                Quantity(float(height[index]), "cm"), Quantity(float(creatinine[index]), "mg/dL"),
+            )
+            if actual == NOT_AVAILABLE:
+                crcl_valid[index] = False
+            else:
+                crcl[index], crcl_adjusted[index] = _number(actual), _number(adjusted)
+                category[index] = BMI_CATEGORIES.index(bmi_category)
+
+        # OST
+        ost_valid = present["weight"] & present["age"] & sexed
+        ost_index = np.trunc((weight - age) * 0.2)
+        ost_risk = np.where(
+            ost_index > np.where(female, 1, 3), 0,
+            np.where(ost_index >= np.where(female, -3, -1), 1, 2),
+        ).astype(np.int8)
+
+        for index in np.flatnonzero(ost_valid & (extreme["weight"] | extreme["age"])):
+            points, risk = get_ost_index(Quantity(float(weight[index]), "kg"), float(age[index]), GENDERS[gender[index]])
+            if points == NOT_AVAILABLE:
+                ost_valid[index] = False
+            else:
+                ost_index[index] = _number(points)
+                ost_risk[index] = OST_RISKS.index(risk)
+
+        # METS-IR
+        mets_ir_valid = (
+            present["glucose"] & present["tg"] & present["weight"] & present["height"] & present["hdl"]
+            & (height != 0) & (2 * glucose + tg > 0) & (hdl > 0) & (hdl != 1)
+        )
+        mets_ir_raw = np.log(2 * glucose + tg) * bmi / np.log(hdl)
+        mets_ir = np.trunc(mets_ir_raw)
+        mets_ir_high = mets_ir_raw > 50.39
+
+        mets_ir_scalar = mets_ir_valid & (
+            extreme["glucose"] | extreme["tg"] | extreme["weight"] | extreme["height"] | extreme["hdl"]
+            | _near(mets_ir_raw, np.round(mets_ir_raw)) | _near(mets_ir_raw, 50.39)
+        )
+        for index in np.flatnonzero(mets_ir_scalar):
+            value, risk = get_mets_ir(
+                Quantity(float(glucose[index]), "mg/dL"), Quantity(float(tg[index]), "mg/dL"), Quantity(float(weight[index]), "kg"),
+                Quantity(float(height[index]), "cm"), Quantity(float(hdl[index]), "mg/dL"),
+            )
+            if value == NOT_AVAILABLE:
+                mets_ir_valid[index] = False
+            else:
+                mets_ir[index] = float(int(value))
+                mets_ir_high[index] = risk == "High"
+
+    nan = np.float64("nan")
+
+    return {
+        "ibw": np.where(ibw_valid, ibw, nan),
+        "abw": np.where(ibw_valid, weight, nan),
+        "ibw_valid": ibw_valid,
+        "crcl": np.where(crcl_valid, crcl, nan),
+        "crcl_adjusted": np.where(crcl_valid, crcl_adjusted, nan),
+        "bmi_category": np.where(crcl_valid, category, -1).astype(np.int8),  # index into BMI_CATEGORIES / CRCL_METHODS
+        "crcl_valid": crcl_valid,
+        "ost_index": np.where(ost_valid, ost_index, nan),
+        "ost_risk": np.where(ost_valid, ost_risk, -1).astype(np.int8),  # index into OST_RISKS
+        "ost_valid": ost_valid,
+        "mets_ir": np.where(mets_ir_valid, mets_ir, nan),
+        "mets_ir_high": mets_ir_valid & mets_ir_high,
+        "mets_ir_valid": mets_ir_valid,
+    }
+
+
+RECORD_COLUMNS = {
+    "height": "Height",
+    "weight": "Weight",
+    "creatinine": "Creatinine",
+    "glucose": "Glucose (blood sugar)",
+    "tg": "Triglycerides",
+    "hdl": "HDL",
+}
+
+
+def _parse_quantity(field, unit=None) -> typing.Tuple[float, bool]:
+    """
+    The value of a Quantity record field, NaN when it holds no number.
+    The flag is False for values the scalar functions would read differently from the columns (height not in cm, inf, ...).
+    """
+    quantity = as_quantity(field)
+    if quantity is None:
+        return math.nan, True
+
+    return quantity.value, math.isfinite(quantity.value) and (unit is None or quantity.unit == unit)
+
+
+def _parse_age(age) -> typing.Tuple[float, bool]:
+    if isinstance(age, (int, float)):
+        try:
+            value = float(age)
+        except OverflowError:
+            return math.nan, False
+        return value, math.isfinite(value)
+
+    if isinstance(age, str):
+        try:
+            float(age)
+        except ValueError:
+            return math.nan, True
+        return math.nan, False  # get_ost_index accepts a numeric string, get_crcl does not
+
+    return math.nan, True
+
+
+def records_to_columns(records_list) -> typing.Tuple[typing.Dict[str, "np.ndarray"], "np.ndarray"]:
+    """
+    Columns for compute_cohort from get_records dicts.
+
+    Returns:
+        tuple: The columns, and a mask of the records that must go through the scalar functions instead
+        because their fields are not in the units the columns assume (heights in cm).
+    """
+    count = len(records_list)
+    columns = {}
+    scalar = np.zeros(count, dtype=bool)
+
+    for name, field in RECORD_COLUMNS.items():
+        unit = "cm" if name == "height" else None
+        parsed = [_parse_quantity(records.get(field), unit) for records in records_list]
+        columns[name] = np.fromiter((value for value, _ in parsed), dtype=np.float64, count=count)
+        scalar |= np.fromiter((not canonical for _, canonical in parsed), dtype=bool, count=count)
+
+    parsed = [_parse_age(records.get("Age")) for records in records_list]
+    columns["age"] = np.fromiter((value for value, _ in parsed), dtype=np.float64, count=count)
+    scalar |= np.fromiter((not canonical for _, canonical in parsed), dtype=bool, count=count)
+
+    columns["gender"] = encode_gender([records.get("Gender") for records in records_list])
+
+    return columns, scalar
+
+
+def format_calculations(result, index, records) -> dict:
+    """
+    Row `index` of compute_cohort as the strings get_calculations shows, for the record it was computed from.
+    """
+    if result["ibw_valid"][index]:
+        weight = as_quantity(records["Weight"])
+        ibw = f"{float(result['ibw'][index])} {weight.unit}"
+        abw = str(weight)  # the scalar functions always report the actual weight
+    else:
+        ibw = abw = NOT_AVAILABLE
+
+    if result["crcl_valid"][index]:
+        actual_clcr = f"{float(result['crcl'][index])} mg/mL"
+        adjusted_clcr = f"{float(result['crcl_adjusted'][index])} mg/mL  {CRCL_METHODS[result['bmi_category'][index]]}"
+    else:
+        actual_clcr = NOT_AVAILABLE
+        adjusted_clcr = NOT_AVAILABLE + "  "
+
+    if result["ost_valid"][index]:
+        ost_risk = OST_RISKS[result["ost_risk"][index]]
+        ost_index = f"{int(result['ost_index'][index])} points"
+    else:
+        ost_risk = ost_index = NOT_AVAILABLE
+
+    if result["mets_ir_valid"][index]:
+        t2d_risk = METS_IR_RISKS[int(result["mets_ir_high"][index])]
+        mets_ir = str(int(result["mets_ir"][index]))
+    else:
+        t2d_risk = mets_ir = NOT_AVAILABLE
+
+    return {
+        "Ideal Body Weight (IBW)": ibw,
+        "Adjusted Body Weight (ABW)": abw,
+        "Creatinine Clearance": actual_clcr,
+        "Creatinine Clearance (adjusted)": adjusted_clcr,
+        "Osteoporosis Risk": ost_risk,
+        "OST Index": ost_index,
+        "Risk of Developing T2D (METS-IR)": t2d_risk,
+        "METS-IR Value (Metabolic Score for Insulin Resistance)": mets_ir,
+    }
+
+
+def calculate_records(records_list) -> typing.List[dict]:
+    """
+    compute_calculations for many records at once: the same dicts, computed by compute_cohort when
+    NumPy is available and by the scalar functions otherwise.
+    """
+    if not numpy_enabled() or not records_list:
+        return [compute_calculations(records) for records in records_list]
+
+    columns, scalar = records_to_columns(records_list)
+    result = compute_cohort(**columns)
+
+    return [
+        compute_calculations(records) if scalar[index] else mark_unavailable(records, format_calculations(result, index, records))
+        for index, records in enumerate(records_list)
+    ]
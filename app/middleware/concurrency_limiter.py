@@ -0,0 +1,180 @@
+import time
+import asyncio
+import logging
+import typing
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from app.configs.config import concurrencySettings
+from app.middleware.metrics import metrics
+
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def parse_retry_after(value, now=None) -> typing.Optional[float]:
+    """
+    Seconds to wait according to a Retry-After header, given either as delay-seconds or as an HTTP-date.
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+class AdaptiveLimiter():
+    """
+    AIMD concurrency limit for the requests sent to one FHIR host.
+
+    The limit grows by 1/limit for every fast response received while the limit was in use (about +1 per
+    round trip), and is multiplied by concurrencySettings.LATENCY_BACKOFF when responses get slower than
+    LATENCY_TOLERANCE times the unloaded baseline, or by THROTTLE_BACKOFF on 429 / 503 / timeouts. It is
+    decreased at most once per round trip: responses to requests sent before the last decrease are ignored.
+    A Retry-After header pauses the host until it expires. Requests over the limit queue in FIFO order.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.limit = float(concurrencySettings.INITIAL_LIMIT)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+
+        self._waiters = deque()
+        self._latencies = deque(maxlen=concurrencySettings.LATENCY_WINDOW)
+        self._last_decrease = 0.0
+        self._wake_handle = None
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def _can_start(self) -> bool:
+        return time.monotonic() >= self.blocked_until and self.in_flight < max(concurrencySettings.MIN_LIMIT, int(self.limit))
+
+    async def acquire(self):
+        if not concurrencySettings.ENABLED:
+            self.in_flight += 1
+            return
+
+        if not self._waiters and self._can_start():
+            self.in_flight += 1
+            return
+
+        metrics.inc("concurrency.queued")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._wake()
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as we were cancelled: hand it to the next waiter
+                self.in_flight -= 1
+                self._wake()
+            raise
+
+    def release(self, started, response: typing.Optional[httpx.Response] = None, error: typing.Optional[BaseException] = None):
+        """
+        Frees the slot of a request sent at `started` (time.monotonic()) and adapts the limit to its outcome.
+        """
+        self.in_flight -= 1
+
+        if concurrencySettings.ENABLED:
+            self._adapt(started, time.monotonic() - started, response, error)
+
+        self._wake()
+
+    def _adapt(self, started, latency, response, error):
+        if isinstance(error, httpx.TimeoutException):
+            self._decrease(started, concurrencySettings.THROTTLE_BACKOFF, "timeout")
+            return
+
+        if response is None:
+            return
+
+        if response.status_code in THROTTLE_STATUSES:
+            metrics.inc("concurrency.throttled")
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + min(retry_after, concurrencySettings.RETRY_AFTER_MAX))
+                metrics.inc("concurrency.retry_after_pauses")
+
+            self._decrease(started, concurrencySettings.THROTTLE_BACKOFF, f"HTTP {response.status_code}")
+            return
+
+        self._latencies.append(latency)
+        baseline = min(self._latencies)
+
+        if latency > baseline * concurrencySettings.LATENCY_TOLERANCE and len(self._latencies) >= 10:
+            self._decrease(started, concurrencySettings.LATENCY_BACKOFF, "latency")
+        elif self.in_flight + 1 >= int(self.limit):
+            # Only grow a limit that is actually in use
+            self.limit = min(float(concurrencySettings.MAX_LIMIT), self.limit + 1 / self.limit)
+
+    def _decrease(self, started, factor, reason):
+        if started < self._last_decrease:
+            return
+
+        self._last_decrease = time.monotonic()
+        self.limit = max(float(concurrencySettings.MIN_LIMIT), self.limit * factor)
+        metrics.inc("concurrency.decreases")
+        system_logger.warning(f"Concurrency limit for {self.host} lowered to {self.limit:.1f} ({reason})")
+
+    def _wake(self):
+        while self._waiters and self._can_start():
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+        # Waiters held back by a Retry-After are woken up when it expires
+        blocked_for = self.blocked_until - time.monotonic()
+        if self._waiters and blocked_for > 0 and self._wake_handle is None:
+            def wake():
+                self._wake_handle = None
+                self._wake()
+
+            self._wake_handle = asyncio.get_running_loop().call_later(blocked_for, wake)
+
+    def usage(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "blocked_for": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+            "baseline_latency_ms": round(min(self._latencies) * 1000, 1) if self._latencies else None,
+        }
+
+
+_limiters = {}  # host -> AdaptiveLimiter
+
+
+def get_limiter(host) -> AdaptiveLimiter:
+    if host not in _limiters:
+        _limiters[host] = AdaptiveLimiter(host)
+
+    return _limiters[host]
+
+
+def limiter_usage() -> dict:
+    return {host: limiter.usage() for host, limiter in list(_limiters.items())}
+
+
+metrics.register_collector("fhir_concurrency", limiter_usage)
@@ -0,0 +1,97 @@
+import re
+import time
+import typing
+
+import httpx
+
+from app.configs.config import cacheSettings
+from app.middleware.cache import LRUCache
+from app.middleware.metrics import metrics
+
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class CachedResponse(typing.NamedTuple):
+    body: typing.Any  # the decoded JSON, shared by every caller: treat it as read-only
+    size: int  # body bytes, i.e. what a 304 saves us from downloading
+    etag: typing.Optional[str]
+    last_modified: typing.Optional[str]
+    fresh_until: float  # time.monotonic() until which the body is served without asking the server
+
+
+# Keyed by (URL, token scope): a response is only ever served again to the session that was authorized to fetch it
+response_cache = LRUCache(
+    "response_cache",
+    ttl=cacheSettings.RESPONSE_CACHE_TTL,
+    max_entries=cacheSettings.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=cacheSettings.RESPONSE_CACHE_MAX_BYTES,
+)
+
+
+def _freshness(response: httpx.Response) -> float:
+    match = _MAX_AGE.search(response.headers.get("Cache-Control", ""))
+    if match is None:
+        return 0
+
+    return min(int(match.group(1)), cacheSettings.RESPONSE_MAX_FRESHNESS)
+
+
+def lookup(key) -> typing.Optional[CachedResponse]:
+    if not cacheSettings.RESPONSE_CACHE_ENABLED:
+        return None
+
+    return response_cache.get(key)
+
+
+def is_fresh(cached: CachedResponse) -> bool:
+    return time.monotonic() < cached.fresh_until
+
+
+def revalidation_headers(cached: CachedResponse) -> dict:
+    """
+    Conditional request headers (If-None-Match / If-Modified-Since) for a stale cached response.
+    """
+    headers = {}
+    if cached.etag:
+        headers["If-None-Match"] = cached.etag
+    if cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+
+    return headers
+
+
+def store(key, response: httpx.Response, body):
+    """
+    Keeps a 200 response if it carries a validator and the server allows it to be stored
+    (neither `no-store` nor `private`).
+    """
+    cache_control = response.headers.get("Cache-Control", "").lower()
+    if not cacheSettings.RESPONSE_CACHE_ENABLED or "no-store" in cache_control or "private" in cache_control:
+        return
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if not etag and not last_modified:
+        return
+
+    size = len(response.content)
+    response_cache.set(key, CachedResponse(body, size, etag, last_modified, time.monotonic() + _freshness(response)), size=size)
+    metrics.inc("response_cache.stored")
+
+
+def not_modified(key, cached: CachedResponse, response: httpx.Response) -> typing.Any:
+    """
+    Handles a 304: the cached body is reused as is, without downloading or decoding it again.
+    """
+    refreshed = cached._replace(
+        etag=response.headers.get("ETag", cached.etag),
+        last_modified=response.headers.get("Last-Modified", cached.last_modified),
+        fresh_until=time.monotonic() + _freshness(response),
+    )
+    response_cache.set(key, refreshed, size=cached.size)
+
+    metrics.inc("response_cache.not_modified")
+    metrics.inc("response_cache.bytes_saved", cached.size)
+
+    return cached.body
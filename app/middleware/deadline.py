@@ -0,0 +1,97 @@
+import time
+import asyncio
+import inspect
+import contextlib
+import contextvars
+import typing
+from contextvars import ContextVar
+
+import httpx
+
+from app.configs.config import httpClientSettings
+
+
+# time.monotonic() by which the current request has to be answered, None when it has no budget
+_deadline: ContextVar[typing.Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the time budget of the current request runs out before an upstream call completes.
+    """
+
+
+@contextlib.contextmanager
+def deadline_scope(seconds: typing.Optional[float]):
+    """
+    Gives the code inside a budget of `seconds` (None: no budget). Nested scopes keep the earliest
+    deadline, and tasks created inside inherit it like any other ContextVar.
+    """
+    if seconds is None:
+        yield
+        return
+
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def without_deadline() -> contextvars.Context:
+    """
+    A copy of the current context with no deadline, for work shared by requests with different budgets
+    (see SingleFlight): each of them applies its own with within_deadline.
+    """
+    context = contextvars.copy_context()
+    context.run(_deadline.set, None)
+
+    return context
+
+
+def remaining() -> typing.Optional[float]:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+
+    return deadline - time.monotonic()
+
+
+def check():
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+async def within_deadline(awaitable):
+    """
+    Awaits `awaitable`, cancelling it and raising DeadlineExceeded once the current deadline passes.
+    """
+    left = remaining()
+    if left is None:
+        return await awaitable
+
+    if left <= 0:
+        if inspect.iscoroutine(awaitable):
+            awaitable.close()
+        check()
+
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Request deadline exceeded after waiting {left:.2f}s")
+
+
+def request_timeout():
+    """
+    httpx timeout for a request sent now: the client's own timeouts, capped by what is left of the deadline.
+    """
+    left = remaining()
+    if left is None:
+        return httpx.USE_CLIENT_DEFAULT
+
+    left = max(left, 0.001)
+    return httpx.Timeout(min(httpClientSettings.TIMEOUT, left), connect=min(httpClientSettings.CONNECT_TIMEOUT, left))
@@ -1,3 +1,26 @@
+from app.middleware.http_client import get_http_client
+from app.middleware.json_backend import loads
+from app.models.observation import Quantity
+
+
+async def fetch_fhir_json(uri, headers, body=None):
+    """
+    Fetches a FHIR resource through the shared, pooled HTTP client.
+
+    Args:
+        uri (str): The full FHIR URL, already carrying the access token (see `client.add_token`).
+        headers (dict): The request headers returned by `client.add_token`.
+        body: Unused for GET requests, kept for the `client.add_token` call signature.
+
+    Returns:
+        dict: The decoded FHIR JSON resource.
+    """
+    response = await get_http_client().get(uri, headers=headers)
+    response.raise_for_status()
+
+    return loads(response.content)
+
+
 async def extract_observation_data(fhir_json, observation_type):
     """
     Extracts the value and unit from a FHIR Observation resource.
@@ -7,7 +30,7 @@ async def extract_observation_data(fhir_json, observation_type):
         observation_type (str): The type of observation to extract (e.g., "height", "weight", "bmi").
 
     Returns:
-        str: The extracted observation value and unit, or an error message if the data is not found or invalid.
+        Quantity | str: The extracted observation value and unit, or an error message if the data is not found or invalid.
     """
     # Bundle
     if fhir_json.get("resourceType") == "Bundle" and fhir_json.get("total", 0) > 0:
@@ -18,8 +41,7 @@ async def extract_observation_data(fhir_json, observation_type):
 
             if value is not None and unit is not None:
                 try:
-                    result = float(round(value, 1))
-                    return f"{result} {unit}"
+                    return observation_quantity(entry, value, unit)
                 except (TypeError, ValueError):
                     return f"{observation_type.capitalize()} data is not a valid number"
             
@@ -35,8 +57,7 @@ async def extract_observation_data(fhir_json, observation_type):
         
         if value is not None and unit is not None:
             try:
-                result = float(round(value, 1))
-                return f"{result} {unit}"
+                return observation_quantity(fhir_json, value, unit)
             except (TypeError, ValueError):
                 return f"{observation_type.capitalize()} data is not a valid number"
         
@@ -44,3 +65,90 @@ async def extract_observation_data(fhir_json, observation_type):
     
     except Exception:
         return f"An unknown error occurred while processing {observation_type} data"
+
+
+def observation_quantity(resource, value, unit, coded=None) -> Quantity:
+    """
+    The Quantity of an Observation value (rounded to 0.1), stamped with the Observation's time and the code of
+    `coded` (the Observation itself, or the component the value belongs to).
+    Raises TypeError / ValueError when `value` is not a number.
+    """
+    codings = (coded or resource).get("code", {}).get("coding", [])
+
+    return Quantity(
+        float(round(value, 1)),
+        unit,
+        observation_timestamp(resource) or None,
+        codings[0].get("code") if codings else None,
+    )
+
+
+def get_next_link(bundle):
+    """
+    Returns the `next` paging link of a FHIR Bundle, or None on the last page.
+    """
+    for link in bundle.get("link", []):
+        if link.get("relation") == "next":
+            return link.get("url")
+
+    return None
+
+
+def demultiplex_observations(entries, codes):
+    """
+    Sorts Observation entries returned by a multi-code search into one Bundle per LOINC code.
+
+    Args:
+        entries (list): Bundle entries from one or more pages of an `Observation?code=a,b,c` search.
+        codes (list): The LOINC codes that were requested.
+
+    Returns:
+        dict: {code: Bundle} with the entries of each code newest first, shaped like a
+        single-code search so the existing extractors (which read `entry[0]`) can consume it unchanged.
+    """
+    buckets = {code: [] for code in codes}
+
+    for entry in entries:
+        code = match_observation_code(entry.get("resource", {}), buckets)
+        if code is not None:
+            buckets[code].append(entry)
+
+    # The server may not honor `_sort`; a stable sort keeps its order for equal timestamps
+    for bucket in buckets.values():
+        bucket.sort(key=lambda entry: observation_timestamp(entry["resource"]), reverse=True)
+
+    return {code: searchset_bundle(bucket) for code, bucket in buckets.items()}
+
+
+def match_observation_code(resource, codes):
+    """
+    Returns the first coding code of an Observation that is one of `codes`, or None.
+    """
+    if resource.get("resourceType") != "Observation":
+        return None
+
+    for coding in resource.get("code", {}).get("coding", []):
+        if coding.get("code") in codes:
+            return coding["code"]
+
+    return None
+
+
+def observation_timestamp(resource):
+    """
+    Returns the clinically relevant time of an Observation as an ISO 8601 string ("" if it has none).
+    """
+    return (
+        resource.get("effectiveDateTime")
+        or resource.get("effectivePeriod", {}).get("start")
+        or resource.get("effectiveInstant")
+        or resource.get("issued")
+        or ""
+    )
+
+
+def searchset_bundle(entries):
+    """
+    Wraps entries in a searchset Bundle, the shape the observation extractors expect.
+    """
+    return {"resourceType": "Bundle", "type": "searchset", "total": len(entries), "entry": entries}
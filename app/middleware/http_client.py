@@ -0,0 +1,129 @@
+import logging
+import importlib.util
+import typing
+
+import httpx
+
+from app.configs.config import httpClientSettings
+from app.middleware.metrics import metrics
+
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+_client: typing.Optional[httpx.AsyncClient] = None
+_http2 = False
+
+
+def _http2_enabled() -> bool:
+    if not httpClientSettings.HTTP2:
+        return False
+
+    # httpx only speaks HTTP/2 when the optional `h2` package is installed
+    if importlib.util.find_spec("h2") is None:
+        system_logger.warning("HTTP2 is enabled but the 'h2' package is not installed, falling back to HTTP/1.1")
+        return False
+
+    return True
+
+
+async def _trace(event_name, info):
+    # httpcore trace events tell us whether a request opened a new connection or reused a pooled one
+    if event_name == "connection.connect_tcp.complete":
+        metrics.inc("http_client.connections_opened")
+    elif event_name == "connection.start_tls.complete":
+        metrics.inc("http_client.tls_handshakes")
+    elif event_name in ("http11.send_request_headers.started", "http2.send_request_headers.started"):
+        metrics.inc(f"http_client.requests_{event_name.split('.')[0]}")
+
+
+async def _on_request(request: httpx.Request):
+    request.extensions["trace"] = _trace
+    metrics.inc("http_client.requests_total")
+
+
+async def _on_response(response: httpx.Response):
+    metrics.inc(f"http_client.responses_{response.status_code // 100}xx")
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Builds the application-scoped httpx.AsyncClient used for all FHIR and token traffic.
+
+    Connections are pooled and kept alive between requests, so a page view reuses
+    the same TCP/TLS connections instead of paying a handshake per FHIR call.
+    """
+    limits = httpx.Limits(
+        max_connections=httpClientSettings.MAX_CONNECTIONS,
+        max_keepalive_connections=httpClientSettings.MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=httpClientSettings.KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(httpClientSettings.TIMEOUT, connect=httpClientSettings.CONNECT_TIMEOUT)
+
+    global _http2
+    _http2 = _http2_enabled()
+
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=timeout,
+        http2=_http2,
+        event_hooks={"request": [_on_request], "response": [_on_response]},
+    )
+
+
+def init_http_client() -> httpx.AsyncClient:
+    global _client
+
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+        uvicorn_logger.info("Shared FHIR HTTP client created")
+
+    return _client
+
+
+async def close_http_client():
+    global _client
+
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        uvicorn_logger.info("Shared FHIR HTTP client closed")
+
+    _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Returns the shared client. It is normally created in the FastAPI lifespan;
+    outside of it (scripts, the deprecated routers) it is created on first use.
+    """
+    if _client is None or _client.is_closed:
+        return init_http_client()
+
+    return _client
+
+
+def pool_usage() -> dict:
+    """
+    Reports the current state of the connection pool.
+    """
+    if _client is None or _client.is_closed:
+        return {"active": False}
+
+    usage = {
+        "active": True,
+        "http2": _http2,
+        "max_connections": httpClientSettings.MAX_CONNECTIONS,
+        "max_keepalive_connections": httpClientSettings.MAX_KEEPALIVE_CONNECTIONS,
+    }
+
+    pool = getattr(_client._transport, "_pool", None)
+    if pool is not None:
+        connections = pool.connections
+        usage["connections"] = len(connections)
+        usage["idle_connections"] = sum(1 for connection in connections if connection.is_idle())
+        usage["busy_connections"] = usage["connections"] - usage["idle_connections"]
+
+    return usage
+
+
+metrics.register_collector("http_client_pool", pool_usage)
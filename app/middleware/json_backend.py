@@ -0,0 +1,86 @@
+import json
+import asyncio
+import logging
+import functools
+import typing
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+from app.configs.config import jsonSettings
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+
+def fast_json_enabled() -> bool:
+    return jsonSettings.JSON_BACKEND == "orjson" and orjson is not None
+
+
+def loads(data: typing.Union[bytes, str]) -> typing.Any:
+    """
+    Decodes JSON with the configured backend. orjson reads the raw bytes directly, without
+    first decoding them to a str the way `httpx.Response.json()` does.
+    """
+    if fast_json_enabled():
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def dumps(obj) -> bytes:
+    if fast_json_enabled():
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Types orjson does not know about go through FastAPI's encoder first
+            return orjson.dumps(jsonable_encoder(obj), option=orjson.OPT_NON_STR_KEYS)
+
+    # Same output as starlette's JSONResponse
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with the configured JSON backend.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class FastJSONRoute(APIRoute):
+    """
+    Route whose dict / list results are rendered directly by FastJSONResponse, skipping the
+    `jsonable_encoder` pass FastAPI otherwise runs on every response. The decorated function
+    itself is left untouched, so internal callers (e.g. get_calculations -> get_records) still get dicts.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        if fast_json_enabled():
+            endpoint = _render_fast(endpoint)
+
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _render_fast(endpoint):
+    if not asyncio.iscoroutinefunction(endpoint):
+        return endpoint
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        result = await endpoint(*args, **kwargs)
+
+        if isinstance(result, (dict, list)):
+            return FastJSONResponse(result)
+
+        return result
+
+    return wrapper
@@ -0,0 +1,169 @@
+import re
+import time
+import codecs
+import typing
+
+from app.middleware.json_backend import loads
+
+
+# Characters that change the nesting depth or the string state of a JSON document
+_STRUCTURAL = re.compile(r'["\\{}\[\]]')
+_ENTRY_KEY = re.compile(r'"entry"\s*:\s*$')
+
+
+class BundleEntryParser():
+    """
+    Incremental parser that pulls `entry` objects out of a FHIR Bundle as its bytes arrive.
+
+    Only the entry currently being read is buffered; every other top-level field (resourceType,
+    total, link, ...) is kept in `skeleton`, which is available once the document is complete.
+    Entries are dropped before being decoded when `prefilter(raw_text)` is False and after
+    being decoded when `keep(entry)` is False, so memory stays bounded by the entries kept.
+
+    Usage:
+        parser = BundleEntryParser(keep=lambda entry: entry["resource"]["resourceType"] == "Observation")
+        async for chunk in response.aiter_bytes():
+            for entry in parser.feed(chunk):
+                ...
+        bundle = parser.close()  # the Bundle without its entries
+    """
+
+    def __init__(self, keep: typing.Optional[typing.Callable[[dict], bool]] = None, prefilter: typing.Optional[typing.Callable[[str], bool]] = None):
+        self.keep = keep
+        self.prefilter = prefilter
+
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+        self._skeleton = []  # top-level text, with the entry array left empty
+        self._in_entries = False
+        self._entry = []  # text of the entry currently being read
+
+        self.skeleton = None
+        self.bytes_read = 0
+        self.decode_seconds = 0.0
+        self.entries_seen = 0
+        self.entries_kept = 0
+        self.max_entry_chars = 0
+
+    def feed(self, chunk) -> typing.List[dict]:
+        started = time.perf_counter()
+        self.bytes_read += len(chunk)
+
+        text = self._decoder.decode(chunk) if isinstance(chunk, (bytes, bytearray)) else chunk
+        kept = []
+
+        start = 0  # first character of `text` not yet copied to the skeleton or the current entry
+        position = 0
+
+        if self._escaped and text:
+            # The previous chunk ended on a backslash inside a string
+            self._escaped = False
+            position = 1
+
+        for match in _STRUCTURAL.finditer(text, position):
+            index = match.start()
+            if index < position:
+                continue
+
+            char = match.group()
+
+            if self._in_string:
+                if char == "\\":
+                    if index + 1 < len(text):
+                        position = index + 2
+                    else:
+                        self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+
+            elif char in "{[":
+                if self._in_entries and self._depth == 2 and char == "{":
+                    # A new entry starts: everything before it belongs to the array punctuation
+                    start = index
+                elif not self._in_entries and self._depth == 1 and char == "[":
+                    self._skeleton.append(text[start:index])
+                    start = index
+                    if _ENTRY_KEY.search(self._skeleton_tail()):
+                        self._skeleton.append("[")
+                        self._in_entries = True
+                        start = index + 1
+                self._depth += 1
+
+            else:
+                self._depth -= 1
+
+                if self._in_entries and self._depth == 2 and char == "}":
+                    self._entry.append(text[start:index + 1])
+                    entry = self._finish_entry()
+                    if entry is not None:
+                        kept.append(entry)
+                    start = index + 1
+
+                elif self._in_entries and self._depth == 1 and char == "]":
+                    self._skeleton.append("]")
+                    self._in_entries = False
+                    start = index + 1
+
+        # Carry the unfinished tail over to the next chunk
+        if self._in_entries:
+            if self._depth > 2:
+                self._entry.append(text[start:])
+        else:
+            self._skeleton.append(text[start:])
+
+        self.decode_seconds += time.perf_counter() - started
+
+        return kept
+
+    def _skeleton_tail(self, size=64) -> str:
+        tail = []
+        length = 0
+        for piece in reversed(self._skeleton):
+            tail.append(piece)
+            length += len(piece)
+            if length >= size:
+                break
+
+        return "".join(reversed(tail))
+
+    def _finish_entry(self) -> typing.Optional[dict]:
+        raw = "".join(self._entry)
+        self._entry = []
+        self.entries_seen += 1
+        self.max_entry_chars = max(self.max_entry_chars, len(raw))
+
+        if self.prefilter is not None and not self.prefilter(raw):
+            return None
+
+        entry = loads(raw)
+        if self.keep is not None and not self.keep(entry):
+            return None
+
+        self.entries_kept += 1
+        return entry
+
+    def close(self) -> dict:
+        self._skeleton.append(self._decoder.decode(b"", final=True))
+        self.skeleton = loads("".join(self._skeleton))
+        self._skeleton = []
+
+        return self.skeleton
+
+
+async def iter_bundle_entries(byte_stream, parser: BundleEntryParser):
+    """
+    Yields the kept entries of a Bundle read from an async byte stream (e.g. `response.aiter_bytes()`).
+    The rest of the Bundle is available as `parser.skeleton` once the generator is exhausted.
+    """
+    async for chunk in byte_stream:
+        for entry in parser.feed(chunk):
+            yield entry
+
+    parser.close()
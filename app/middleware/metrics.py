@@ -0,0 +1,48 @@
+from collections import defaultdict
+
+
+class MetricsRegistry():
+    """
+    In-process metrics registry shared by the FHIR transport, caches and calculators.
+
+    Counters only go up, gauges hold the latest value, and collectors are callables
+    evaluated lazily whenever a snapshot is taken (e.g. connection pool usage).
+    """
+
+    def __init__(self):
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._collectors = {}
+
+    def inc(self, name, value=1):
+        self._counters[name] += value
+
+    def get(self, name, default=0):
+        return self._counters.get(name, self._gauges.get(name, default))
+
+    def set_gauge(self, name, value):
+        self._gauges[name] = value
+
+    def register_collector(self, name, collector):
+        self._collectors[name] = collector
+
+    def snapshot(self):
+        collected = {}
+        for name, collector in self._collectors.items():
+            try:
+                collected[name] = collector()
+            except Exception as e:
+                collected[name] = {"error": str(e)}
+
+        return {
+            "counters": dict(self._counters),
+            "gauges": dict(self._gauges),
+            **collected,
+        }
+
+    def reset(self):
+        self._counters.clear()
+        self._gauges.clear()
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,130 @@
+import os
+import time
+import logging
+import typing
+
+from app.configs.config import cohortSettings
+from app.configs.reference import OBSERVATION_CODES
+from app.middleware.bulk_export import iter_ndjson
+from app.middleware.cohort import calculate_records
+from app.middleware.exception import exception_message
+from app.middleware.function import match_observation_code, observation_timestamp, searchset_bundle
+from app.middleware.json_backend import dumps
+from app.middleware.metrics import metrics
+from app.middleware.record_builder import patient_fields, observation_fields
+from app.models.observation import display_record
+
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+
+def subject_id(observation) -> typing.Optional[str]:
+    """
+    The Patient id an Observation refers to ("Patient/123", an absolute URL or a versioned reference).
+    """
+    reference = observation.get("subject", {}).get("reference", "")
+    parts = reference.split("/")
+
+    if "_history" in parts:
+        parts = parts[:parts.index("_history")]
+    if len(parts) < 2 or parts[-2] != "Patient":
+        return None
+
+    return parts[-1]
+
+
+async def collect_latest_observations(paths) -> typing.Dict[str, typing.Dict[str, dict]]:
+    """
+    Streams Observation NDJSON files and keeps only the latest Observation of every OBSERVATION_CODES
+    entry per patient, so memory grows with the number of patients, not of Observations.
+
+    Returns:
+        {patient id: {observation name: Observation}}
+    """
+    codes = {observation["code"]: name for name, observation in OBSERVATION_CODES.items()}
+    latest = {}
+
+    for path in paths:
+        async for observation in iter_ndjson(path):
+            metrics.inc("population.observations_read")
+
+            code = match_observation_code(observation, codes)
+            patient_id = subject_id(observation)
+            if code is None or patient_id is None:
+                continue
+
+            observations = latest.setdefault(patient_id, {})
+            name = codes[code]
+            if name not in observations or observation_timestamp(observation) > observation_timestamp(observations[name]):
+                observations[name] = observation
+
+    return latest
+
+
+async def build_patient_records(patient, observations) -> dict:
+    """
+    Runs the record extractors of get_records for one exported patient.
+    """
+    records = await patient_fields(patient)
+    for name in OBSERVATION_CODES:
+        entries = [{"resource": observations[name]}] if name in observations else []
+        records.update(await observation_fields(name, searchset_bundle(entries)))
+
+    return records
+
+
+def write_results(output, batch):
+    """
+    Runs the calculators of get_calculations over a batch of (patient id, records) at once and writes their result lines.
+    """
+    for (patient_id, records), calculations in zip(batch, calculate_records([records for _, records in batch])):
+        output.write(dumps({"patient": patient_id, "records": display_record(records), "calculations": calculations}) + b"\n")
+
+
+async def run_population(files, output_path) -> dict:
+    """
+    Feeds exported NDJSON files (as returned by BulkExportClient.run) through the extractors and calculators,
+    writing one JSON line per patient to `output_path`.
+
+    Returns:
+        dict: Counts and duration of the run.
+    """
+    started = time.perf_counter()
+    latest = await collect_latest_observations(files.get("Observation", []))
+
+    patients = failed = 0
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    with open(output_path, "wb") as output:
+        batch = []
+
+        for path in files.get("Patient", []):
+            async for patient in iter_ndjson(path):
+                patients += 1
+                try:
+                    batch.append((patient.get("id"), await build_patient_records(patient, latest.get(patient.get("id"), {}))))
+                except Exception as e:
+                    system_logger.warning(f"Could not build the record of Patient/{patient.get('id')}: {exception_message(e)}")
+                    output.write(dumps({"patient": patient.get("id"), "error": exception_message(e)}) + b"\n")
+                    failed += 1
+
+                if len(batch) >= cohortSettings.BATCH_SIZE:
+                    write_results(output, batch)
+                    batch = []
+
+        write_results(output, batch)
+
+    metrics.inc("population.patients", patients)
+    metrics.inc("population.failures", failed)
+
+    summary = {
+        "patients": patients,
+        "failed": failed,
+        "patients_with_observations": len(latest),
+        "seconds": round(time.perf_counter() - started, 2),
+        "output": output_path,
+    }
+    uvicorn_logger.info(f"Population run finished: {summary}")
+
+    return summary
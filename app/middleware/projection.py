@@ -0,0 +1,95 @@
+import logging
+import typing
+from collections import defaultdict
+
+from app.configs.config import fhirSettings
+from app.configs.reference import PROJECTION_PROFILES
+from app.middleware.metrics import metrics
+
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+# Projection levels, tried in order until the server accepts one
+_LEVELS = ["elements", "summary", "none"]
+
+# iss -> index into _LEVELS of the first level the server has not rejected
+_levels = defaultdict(int)
+
+
+def projection_params(iss, resource_type) -> typing.List[str]:
+    """
+    Query parameters that restrict a read or search to the elements the extractors need,
+    e.g. ["_elements=code,valueQuantity,..."]; empty when projection is off or unsupported.
+    """
+    profile = PROJECTION_PROFILES.get(resource_type)
+    if not fhirSettings.PROJECTION_ENABLED or profile is None:
+        return []
+
+    level = _LEVELS[_levels[iss]]
+    if level == "elements" and profile.get("elements"):
+        return [f"_elements={','.join(profile['elements'])}"]
+    if level == "summary" and profile.get("summary"):
+        return [f"_summary={profile['summary']}"]
+
+    return []
+
+
+def is_projected(url) -> bool:
+    return "_elements=" in url or "_summary=" in url
+
+
+def _level_of(url) -> int:
+    if "_elements=" in url:
+        return _LEVELS.index("elements")
+    if "_summary=" in url:
+        return _LEVELS.index("summary")
+    return _LEVELS.index("none")
+
+
+def reject(iss, url) -> bool:
+    """
+    Moves an ISS past the projection level used by `url` after the server rejected it.
+    Returns False when there is nothing left to fall back to.
+
+    A 400 on a projected URL is not proof: call this only once the same request without the
+    projection succeeded, so an unrelated error never turns projection off for the whole ISS.
+    """
+    rejected = _level_of(url)
+    if rejected >= len(_LEVELS) - 1:
+        return False
+
+    if _levels[iss] > rejected:
+        # A concurrent request already fell back past this level
+        return True
+
+    _levels[iss] = rejected + 1
+    system_logger.warning(f"{iss} rejected the payload projection, falling back to '{_LEVELS[_levels[iss]]}'")
+    metrics.inc("fhir.projection.fallbacks")
+
+    return True
+
+
+def record_payload(url, size, decode_seconds):
+    """
+    Reports bytes received and JSON decode time, split by projected / full responses.
+    """
+    kind = "projected" if is_projected(url) else "full"
+    metrics.inc(f"fhir.payload.{kind}.responses")
+    metrics.inc(f"fhir.payload.{kind}.bytes", size)
+    metrics.inc(f"fhir.payload.{kind}.decode_seconds", decode_seconds)
+
+
+def usage() -> dict:
+    summary = {"levels": {iss: _LEVELS[level] for iss, level in _levels.items()}}
+
+    for kind in ("projected", "full"):
+        responses = metrics.get(f"fhir.payload.{kind}.responses")
+        if responses:
+            summary[f"{kind}_avg_bytes"] = round(metrics.get(f"fhir.payload.{kind}.bytes") / responses)
+            summary[f"{kind}_avg_decode_ms"] = round(1000 * metrics.get(f"fhir.payload.{kind}.decode_seconds") / responses, 3)
+
+    return summary
+
+
+metrics.register_collector("fhir_projection", usage)
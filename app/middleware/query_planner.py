@@ -0,0 +1,208 @@
+import time
+import asyncio
+import logging
+import typing
+from collections import defaultdict
+
+from app.configs.config import plannerSettings
+from app.middleware.exception import exception_message
+from app.middleware.http_client import get_http_client
+from app.middleware.metrics import metrics
+
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+
+class ServerCapabilities():
+    """
+    The parts of a FHIR CapabilityStatement that decide how get_records can fetch its data.
+    """
+
+    def __init__(self, batch=False, transaction=False, include=False, multi_code=True, everything=False, graphql=False, export=False):
+        self.batch = batch
+        self.transaction = transaction
+        self.include = include  # Observation search supports `_include=Observation:patient`
+        self.multi_code = multi_code  # Observation search supports `code`, so `code=a,b,c` can be tried
+        self.everything = everything  # Patient/$everything
+        self.graphql = graphql
+        self.export = export  # bulk data $export
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class QueryPlan(typing.NamedTuple):
+    strategy: str
+    round_trips: int
+
+
+def parse_capability_statement(capability_statement) -> ServerCapabilities:
+    """
+    Reads the server capabilities get_records cares about from a CapabilityStatement.
+
+    Args:
+        capability_statement (dict): The JSON returned by `[base]/metadata`.
+
+    Returns:
+        ServerCapabilities: What the server supports.
+    """
+    rests = [rest for rest in capability_statement.get("rest", []) if rest.get("mode", "server") == "server"]
+
+    interactions = {interaction.get("code") for rest in rests for interaction in rest.get("interaction", [])}
+    operations = {operation.get("name", "").lstrip("$") for rest in rests for operation in rest.get("operation", [])}
+    resources = {resource.get("type"): resource for rest in rests for resource in rest.get("resource", [])}
+
+    observation = resources.get("Observation", {})
+    observation_search_params = {param.get("name") for param in observation.get("searchParam", [])}
+    observation_includes = set(observation.get("searchInclude", []))
+
+    patient = resources.get("Patient", {})
+    patient_operations = {operation.get("name", "").lstrip("$") for operation in patient.get("operation", [])}
+
+    return ServerCapabilities(
+        batch="batch" in interactions,
+        transaction="transaction" in interactions,
+        include=bool(observation_includes & {"Observation:patient", "Observation:subject", "*"}),
+        # Servers that do not list their search params at all are given the benefit of the doubt
+        multi_code=not observation_search_params or "code" in observation_search_params,
+        everything=bool(patient_operations & {"everything", "patient-everything"}),
+        graphql="graphql" in operations,
+        export=bool((operations | patient_operations) & {"export", "patient-export"}),
+    )
+
+
+def estimate_round_trips(strategy, observation_count) -> int:
+    """
+    Number of upstream requests a strategy needs for one Patient plus `observation_count` Observations.
+    """
+    return {
+        "batch": 1,  # one batch Bundle carrying every read and search
+        "include": 1,  # one multi-code search that `_include`s the Patient
+        "everything": 1,  # one paged Patient/$everything request
+        "multi-code": 2,  # Patient read + one multi-code search
+        "per-code": 1 + observation_count,  # Patient read + one search per code
+    }[strategy]
+
+
+def _is_supported(strategy, capabilities: ServerCapabilities) -> bool:
+    if strategy == "batch":
+        return capabilities.batch
+    if strategy == "include":
+        return capabilities.include and capabilities.multi_code
+    if strategy == "everything":
+        return capabilities.everything
+    if strategy == "multi-code":
+        return capabilities.multi_code
+    return strategy == "per-code"
+
+
+class QueryPlanner():
+    """
+    Picks the cheapest way to fetch a patient record from each FHIR server.
+
+    The CapabilityStatement of every ISS is read once and cached for plannerSettings.CAPABILITY_TTL
+    seconds (plannerSettings.CAPABILITY_RETRY_TTL when it could not be read). Strategies that fail at
+    runtime are demoted for that ISS until the next successful refresh.
+    """
+
+    def __init__(self):
+        self._capabilities = {}  # iss -> (expires_at (time.monotonic()), ServerCapabilities)
+        self._locks = defaultdict(asyncio.Lock)
+        self._failed = defaultdict(set)  # iss -> strategies that failed since the last refresh
+        self._last_plans = {}  # iss -> QueryPlan
+
+    async def get_capabilities(self, iss) -> ServerCapabilities:
+        cached = self._capabilities.get(iss)
+        if cached and time.monotonic() < cached[0]:
+            return cached[1]
+
+        async with self._locks[iss]:
+            # Another request may have refreshed it while we were waiting for the lock
+            cached = self._capabilities.get(iss)
+            if cached and time.monotonic() < cached[0]:
+                return cached[1]
+
+            try:
+                capabilities = await self._fetch_capabilities(iss)
+            except Exception as e:
+                # Without a CapabilityStatement only plain searches are assumed to work, until it is retried
+                # soon: one transient failure must not pin the server to them for a whole CAPABILITY_TTL
+                system_logger.warning(f"Could not read the CapabilityStatement of {iss}: {exception_message(e)}")
+                metrics.inc("fhir.query_planner.metadata_failures")
+
+                capabilities = ServerCapabilities()
+                self._capabilities[iss] = (time.monotonic() + plannerSettings.CAPABILITY_RETRY_TTL, capabilities)
+                return capabilities
+
+            self._capabilities[iss] = (time.monotonic() + plannerSettings.CAPABILITY_TTL, capabilities)
+            self._failed.pop(iss, None)
+
+            return capabilities
+
+    async def _fetch_capabilities(self, iss) -> ServerCapabilities:
+        response = await get_http_client().get(f"{iss}/metadata", headers={"Accept": "application/fhir+json"})
+        response.raise_for_status()
+        metrics.inc("fhir.query_planner.metadata_fetches")
+
+        capabilities = parse_capability_statement(response.json())
+        uvicorn_logger.info(f"FHIR capabilities for {iss}: {capabilities.as_dict()}")
+
+        return capabilities
+
+    async def plan(self, iss, observation_count) -> QueryPlan:
+        capabilities = await self.get_capabilities(iss)
+
+        candidates = [
+            QueryPlan(strategy, estimate_round_trips(strategy, observation_count))
+            for strategy in plannerSettings.STRATEGIES
+            if _is_supported(strategy, capabilities) and strategy not in self._failed[iss]
+        ]
+
+        override = plannerSettings.STRATEGY_OVERRIDES.get(iss)
+
+        if override and override not in self._failed[iss]:
+            plan = QueryPlan(override, estimate_round_trips(override, observation_count))
+        elif candidates:
+            # Fewest round trips wins, ties go to the earlier entry of plannerSettings.STRATEGIES
+            plan = min(candidates, key=lambda candidate: candidate.round_trips)
+        else:
+            plan = QueryPlan("per-code", estimate_round_trips("per-code", observation_count))
+
+        self._last_plans[iss] = plan
+        uvicorn_logger.info(f"FHIR query plan for {iss}: {plan.strategy} ({plan.round_trips} round trips)")
+        metrics.inc(f"fhir.query_planner.plans.{plan.strategy}")
+
+        return plan
+
+    def report_result(self, iss, plan: QueryPlan, round_trips):
+        metrics.inc(f"fhir.query_planner.round_trips.{plan.strategy}", round_trips)
+        metrics.set_gauge(f"fhir.query_planner.last_round_trips.{iss}", round_trips)
+
+    def report_failure(self, iss, strategy):
+        system_logger.warning(f"FHIR query strategy '{strategy}' failed for {iss}, demoting it until the next capability refresh")
+        metrics.inc(f"fhir.query_planner.failures.{strategy}")
+        self._failed[iss].add(strategy)
+
+    def invalidate(self, iss=None):
+        if iss is None:
+            self._capabilities.clear()
+            self._failed.clear()
+        else:
+            self._capabilities.pop(iss, None)
+            self._failed.pop(iss, None)
+
+    def describe(self) -> dict:
+        return {
+            iss: {
+                "capabilities": self._capabilities[iss][1].as_dict() if iss in self._capabilities else None,
+                "plan": plan._asdict(),
+                "demoted": sorted(self._failed.get(iss, ())),
+            }
+            for iss, plan in self._last_plans.items()
+        }
+
+
+query_planner = QueryPlanner()
+
+metrics.register_collector("fhir_query_plans", query_planner.describe)
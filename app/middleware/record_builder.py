@@ -0,0 +1,191 @@
+import typing
+
+from app.configs.config import deadlineSettings
+from app.configs.reference import OBSERVATION_CODES
+from app.middleware.calculation_graph import calculation_graph
+from app.routers.v1.endpoints.get_patients import extract_patient_info
+from app.routers.v1.endpoints.get_observations import extract_height, extract_weight, extract_bmi, extract_bp, extract_hdl, extract_ldl, extract_tg, extract_chol, extract_scr, extract_glucose, extract_smoking_status
+
+
+# Fields of the record built by get_records, in the order they are shown
+PATIENT_FIELDS = ("Name", "Gender", "Race", "Ethnicity", "Date of Birth", "Age")
+
+
+async def _extract_bp_fields(fhir_json):
+    values = await extract_bp(fhir_json)
+    if isinstance(values, str):
+        return values, values  # one message ("Blood pressure components not found", ...) for both fields
+
+    sbp, dbp = values
+    return dbp, sbp  # assigned to ("Systolic BP", "Diastolic BP") the way get_records always has
+
+
+# Record fields filled from each OBSERVATION_CODES entry, and the extractor producing their values
+OBSERVATION_FIELDS = {
+    "height": (("Height",), extract_height),
+    "weight": (("Weight",), extract_weight),
+    "bmi": (("BMI",), extract_bmi),
+    "bp": (("Systolic BP", "Diastolic BP"), _extract_bp_fields),
+    "hdl": (("HDL",), extract_hdl),
+    "ldl": (("LDL",), extract_ldl),
+    "tg": (("Triglycerides",), extract_tg),
+    "chol": (("Cholesterol",), extract_chol),
+    "scr": (("Creatinine",), extract_scr),
+    "glucose": (("Glucose (blood sugar)",), extract_glucose),
+    "smoking": (("Tobacco Smoking Status",), extract_smoking_status),
+}
+
+RECORD_FIELDS = PATIENT_FIELDS + tuple(field for fields, _ in OBSERVATION_FIELDS.values() for field in fields)
+
+# Rows of get_calculations, in display order
+CALCULATION_ROWS = (
+    "Ideal Body Weight (IBW)",
+    "Adjusted Body Weight (ABW)",
+    "Creatinine Clearance",
+    "Creatinine Clearance (adjusted)",
+    "Osteoporosis Risk",
+    "OST Index",
+    "Risk of Developing T2D (METS-IR)",
+    "METS-IR Value (Metabolic Score for Insulin Resistance)",
+)
+
+# Record fields each row is computed from, as declared by its calculators
+CALCULATION_FIELDS = {name: calculation_graph.inputs_of(name) for name in CALCULATION_ROWS}
+
+CALCULATION_GROUPS = dict.fromkeys(CALCULATION_ROWS, "calculation")
+
+
+async def patient_fields(patient_json) -> dict:
+    """
+    The PATIENT_FIELDS of the record; all deadlineSettings.UNAVAILABLE when the Patient did not arrive (None).
+    """
+    if patient_json is None:
+        return dict.fromkeys(PATIENT_FIELDS, deadlineSettings.UNAVAILABLE)
+
+    first_name, last_name, dob, age, gender, race, ethnicity = await extract_patient_info(patient_json)
+
+    return {
+        "Name": f"{first_name} {last_name}",
+        "Gender": gender,
+        "Race": race,
+        "Ethnicity": ethnicity,
+        "Date of Birth": dob,
+        "Age": age,
+    }
+
+
+async def observation_fields(name, fhir_json) -> dict:
+    """
+    The record fields of one OBSERVATION_CODES entry; deadlineSettings.UNAVAILABLE when its Bundle did not arrive (None).
+    """
+    fields, extractor = OBSERVATION_FIELDS[name]
+    if fhir_json is None:
+        return dict.fromkeys(fields, deadlineSettings.UNAVAILABLE)
+
+    values = await extractor(fhir_json)
+    if len(fields) == 1:
+        values = (values,)
+
+    return dict(zip(fields, values, strict=True))
+
+
+class RecordField(typing.NamedTuple):
+    group: str  # "patient", an OBSERVATION_CODES category ("vital-signs", "laboratory", "survey") or "calculation"
+    name: str
+    value: typing.Any
+
+
+RECORD_FIELD_GROUPS = {
+    **dict.fromkeys(PATIENT_FIELDS, "patient"),
+    **{field: OBSERVATION_CODES[name]["category"] for name, (fields, _) in OBSERVATION_FIELDS.items() for field in fields},
+}
+
+
+def compute_calculations(records, rows=CALCULATION_ROWS) -> dict:
+    """
+    The rows of get_calculations (or only `rows`) computed from a (possibly partial) record.
+    """
+    # BMI and IBW are computed once and shared by the calculators that need them
+    values = calculation_graph.evaluate(records, rows)
+    calculations = {name: values[name] for name in rows}
+
+    return mark_unavailable(records, calculations)
+
+
+def mark_unavailable(records, calculations) -> dict:
+    """
+    Calculations fed by a value that missed the request deadline are pending, not "missing data".
+    """
+    if deadlineSettings.UNAVAILABLE not in records.values():
+        return calculations
+
+    for name in calculations:
+        if any(records.get(field) == deadlineSettings.UNAVAILABLE for field in CALCULATION_FIELDS[name]):
+            calculations[name] = deadlineSettings.UNAVAILABLE
+
+    return calculations
+
+
+class FieldSelection(typing.NamedTuple):
+    """
+    What a sparse fieldset (`fields=`) needs fetched: only these fields are extracted and returned.
+    """
+    record_fields: typing.Tuple[str, ...]  # in RECORD_FIELDS order
+    patient: bool  # whether the Patient resource is read
+    observations: typing.Tuple[str, ...]  # OBSERVATION_CODES entries searched
+
+
+# OBSERVATION_CODES entry filling each record field
+FIELD_OBSERVATIONS = {field: name for name, (fields, _) in OBSERVATION_FIELDS.items() for field in fields}
+
+# OBSERVATION_FIELDS entries whose values are codes rather than Quantity, and so have no numeric history
+CODED_OBSERVATIONS = ("smoking",)
+
+# Record fields with an observation history (see app/middleware/timeseries.py), and their groups
+HISTORY_FIELD_GROUPS = {field: RECORD_FIELD_GROUPS[field] for field, name in FIELD_OBSERVATIONS.items() if name not in CODED_OBSERVATIONS}
+
+# Record fields get_records can return `as_of` a past time: the patient's and the ones with a history
+AS_OF_FIELDS = PATIENT_FIELDS + tuple(HISTORY_FIELD_GROUPS)
+
+
+def parse_fields(fields, available, groups) -> typing.Tuple[str, ...]:
+    """
+    The names a `fields=` query parameter asks for, in `available` order.
+
+    Args:
+        fields (str): Comma separated field names or group names (see `groups`), case-insensitive.
+        available (tuple): Every field the endpoint returns.
+        groups (dict): Field -> group it belongs to, e.g. RECORD_FIELD_GROUPS ("patient", "laboratory", ...).
+
+    Raises:
+        ValueError: A name is neither a field nor a group.
+    """
+    wanted = set()
+    for name in (name.strip().lower() for name in fields.split(",")):
+        if not name:
+            continue
+        matched = {field for field in available if name in (field.lower(), groups[field])}
+        if not matched:
+            raise ValueError(f"Unknown field '{name}'; expected some of: {', '.join(available)} (or {', '.join(dict.fromkeys(groups.values()))})")
+        wanted |= matched
+
+    return tuple(field for field in available if field in wanted)
+
+
+def select_fields(record_fields) -> FieldSelection:
+    """
+    The FieldSelection of some RECORD_FIELDS: the Patient only when a PATIENT_FIELDS entry is wanted,
+    and the observations feeding the others.
+    """
+    return FieldSelection(
+        record_fields=tuple(field for field in RECORD_FIELDS if field in record_fields),
+        patient=any(field in PATIENT_FIELDS for field in record_fields),
+        observations=tuple(dict.fromkeys(FIELD_OBSERVATIONS[field] for field in RECORD_FIELDS if field in record_fields and field in FIELD_OBSERVATIONS)),
+    )
+
+
+def select_calculations(rows) -> FieldSelection:
+    """
+    The FieldSelection of the record fields `rows` of get_calculations are computed from (see CALCULATION_FIELDS).
+    """
+    return select_fields({field for name in rows for field in CALCULATION_FIELDS[name]})
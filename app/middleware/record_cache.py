@@ -0,0 +1,32 @@
+import typing
+
+from app.configs.config import cacheSettings
+from app.middleware.cache import LRUCache
+
+
+class RecordCache(LRUCache):
+    """
+    Cache of extracted patient records (the dict built by get_records), keyed by (FHIR base URL, patient id).
+    """
+
+    def get(self, base_url, patient_id) -> typing.Optional[dict]:
+        return super().get((base_url, patient_id))
+
+    def set(self, base_url, patient_id, value: dict):
+        super().set((base_url, patient_id), value)
+
+    def invalidate(self, base_url=None, patient_id=None) -> int:
+        """
+        Drops one patient's record, every record of a FHIR server, or everything. Returns the number dropped.
+        """
+        return super().invalidate(
+            lambda key: (base_url is None or key[0] == base_url) and (patient_id is None or key[1] == patient_id)
+        )
+
+
+record_cache = RecordCache(
+    "record_cache",
+    ttl=cacheSettings.RECORD_TTL,
+    max_entries=cacheSettings.RECORD_CACHE_MAX_ENTRIES,
+    max_bytes=cacheSettings.RECORD_CACHE_MAX_BYTES,
+)
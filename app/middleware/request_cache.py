@@ -0,0 +1,45 @@
+import asyncio
+import inspect
+import functools
+
+from app.middleware.metrics import metrics
+
+
+def memoize_per_request(func):
+    """
+    Runs an async `func(request, ...)` at most once per incoming request and arguments.
+
+    The first call stores its task on `request.state`; later (or concurrent) calls with the same
+    (hashable) arguments made while serving the same request await that task instead of running
+    `func` again. Arguments are bound to the signature with defaults applied first, so `f(request)`,
+    `f(request, None)` and `f(request, selection=None)` share one task.
+    Calls without a Starlette request (e.g. from scripts) are not memoized.
+    """
+    key = f"_memoized_{func.__name__}"
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(request, *args, **kwargs):
+        state = getattr(request, "state", None)
+        if state is None:
+            return await func(request, *args, **kwargs)
+
+        tasks = getattr(state, key, None)
+        if tasks is None:
+            tasks = {}
+            setattr(state, key, tasks)
+
+        bound = signature.bind(request, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = tuple(bound.arguments.items())[1:]
+        task = tasks.get(arguments)
+        if task is not None:
+            metrics.inc(f"request_cache.{func.__name__}.saved")
+            return await task
+
+        task = tasks[arguments] = asyncio.ensure_future(func(request, *args, **kwargs))
+        metrics.inc(f"request_cache.{func.__name__}.calls")
+
+        return await task
+
+    return wrapper
@@ -0,0 +1,329 @@
+import time
+import random
+import asyncio
+import logging
+import typing
+from collections import defaultdict, deque
+
+import httpx
+
+from app.configs.config import resilienceSettings
+from app.middleware.concurrency_limiter import get_limiter
+from app.middleware.deadline import DeadlineExceeded, within_deadline
+from app.middleware.metrics import metrics
+
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while the circuit breaker of its host is open.
+    """
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"Circuit breaker for {host} is open, retrying in {retry_in:.1f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker():
+    """
+    Per-host circuit breaker.
+
+    After resilienceSettings.BREAKER_FAILURE_THRESHOLD consecutive failed attempts the circuit opens
+    and requests fail fast for resilienceSettings.BREAKER_RESET_TIMEOUT seconds. Then a single probe
+    is let through (half-open): its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def check(self) -> bool:
+        """
+        Raises CircuitOpenError while the circuit is open. Returns True when the caller was let through
+        as the half-open probe, and must then settle it with record_success(), record_failure(),
+        record_throttled() or release_probe().
+        """
+        if not resilienceSettings.BREAKER_ENABLED or self.state == "closed":
+            return False
+
+        retry_in = self.opened_at + resilienceSettings.BREAKER_RESET_TIMEOUT - time.monotonic()
+
+        if self.state == "open" and retry_in <= 0:
+            self.state = "half-open"
+
+        if self.state == "half-open" and not self._probing:
+            self._probing = True
+            metrics.inc("resilience.breaker.probes")
+            return True
+
+        metrics.inc("resilience.breaker.short_circuited")
+        raise CircuitOpenError(self.host, max(retry_in, 0.0))
+
+    def record_success(self):
+        if self.state != "closed":
+            uvicorn_logger.info(f"Circuit breaker for {self.host} closed")
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_throttled(self):
+        # A 429 is no outage, but it does show the host is answering again
+        if self.state == "half-open":
+            self.record_success()
+
+    def release_probe(self):
+        # The probe ended (cancelled, or an error that says nothing about the host) before it could tell whether the host recovered
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+
+        if self.state == "half-open" or (self.state == "closed" and self.failures >= resilienceSettings.BREAKER_FAILURE_THRESHOLD):
+            if self.state == "closed":
+                system_logger.warning(f"Circuit breaker for {self.host} opened after {self.failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            metrics.inc("resilience.breaker.opened")
+
+
+class LatencyTracker():
+    """
+    Rolling window of latencies for one host, used for the hedge threshold and reported as percentiles.
+    """
+
+    def __init__(self):
+        self.samples = deque(maxlen=resilienceSettings.LATENCY_WINDOW)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, percent) -> typing.Optional[float]:
+        if not self.samples:
+            return None
+
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+_breakers = {}  # host -> CircuitBreaker
+_attempt_latency = defaultdict(LatencyTracker)  # host -> latency of single attempts
+_call_latency = defaultdict(LatencyTracker)  # host -> latency seen by callers, retries and hedges included
+
+
+def get_breaker(host) -> CircuitBreaker:
+    if host not in _breakers:
+        _breakers[host] = CircuitBreaker(host)
+
+    return _breakers[host]
+
+
+def backoff_delay(retry) -> float:
+    """
+    Full-jitter exponential backoff: uniform between 0 and base * 2^retry, capped at RETRY_BACKOFF_MAX.
+    """
+    return random.uniform(0, min(resilienceSettings.RETRY_BACKOFF_MAX, resilienceSettings.RETRY_BACKOFF_BASE * 2 ** retry))
+
+
+def hedge_delay(host) -> typing.Optional[float]:
+    if not resilienceSettings.HEDGE_ENABLED:
+        return None
+
+    latency = _attempt_latency[host]
+    if len(latency.samples) < resilienceSettings.HEDGE_MIN_SAMPLES:
+        return None
+
+    return max(resilienceSettings.HEDGE_MIN_DELAY, latency.percentile(resilienceSettings.HEDGE_PERCENTILE))
+
+
+def _discard(task):
+    # A response nobody is going to read still holds a pooled connection when it was streamed
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+
+class _SlotStream(httpx.AsyncByteStream):
+    """
+    Body of a streamed response that keeps its concurrency slot until it is closed (read to the end or aclose()d).
+    """
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+async def _timed(send, host) -> httpx.Response:
+    # Every attempt (hedges included) takes a slot of the host's adaptive concurrency limit
+    limiter = get_limiter(host)
+    await limiter.acquire()
+
+    started = time.monotonic()
+    response = error = None
+
+    def release():
+        limiter.release(started, response, error)
+        # Cancelled hedge losers are recorded too (as a lower bound), or the threshold would drift down
+        _attempt_latency[host].record(time.monotonic() - started)
+
+    try:
+        response = await send()
+    except BaseException as e:
+        error = e
+        release()
+        raise
+
+    if response.is_closed:
+        release()
+    else:
+        # A streamed body is still being downloaded: the slot is held, and the latency measured, until it is closed
+        response.stream = _SlotStream(response.stream, release)
+
+    return response
+
+
+async def _send_hedged(send, host) -> httpx.Response:
+    delay = hedge_delay(host)
+    if delay is None:
+        return await _timed(send, host)
+
+    primary = asyncio.ensure_future(_timed(send, host))
+    pending = {primary}
+
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            metrics.inc("resilience.hedges_sent")
+            pending.add(asyncio.ensure_future(_timed(send, host)))
+
+        error = None
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        metrics.inc("resilience.hedges_won")
+                    return task.result()
+                error = task.exception()
+
+            if not pending:
+                raise error
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+    finally:
+        for task in pending:
+            task.cancel()
+            task.add_done_callback(_discard)
+
+
+async def resilient_send(send: typing.Callable[[], typing.Awaitable[httpx.Response]], url, method="GET") -> httpx.Response:
+    """
+    Sends a request through the circuit breaker of its host, retrying and hedging it when it is idempotent.
+
+    Args:
+        send: Coroutine function sending the request once (e.g. `lambda: client.request(...)`);
+              it may be called several times, concurrently when hedging.
+        url: The request URL, whose host picks the circuit breaker and latency statistics.
+        method: HTTP method; only GET and HEAD are retried or hedged.
+
+    Returns:
+        httpx.Response: The first acceptable response, or the last one when retries are exhausted.
+
+    Raises:
+        CircuitOpenError: If the circuit of the host is open.
+        DeadlineExceeded: If the request deadline (see app/middleware/deadline.py) passes first.
+        httpx.RequestError: If the last attempt failed at the transport level.
+    """
+    host = httpx.URL(url).host
+    breaker = get_breaker(host)
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    attempts = resilienceSettings.RETRY_MAX_ATTEMPTS if resilienceSettings.RETRY_ENABLED and idempotent else 1
+
+    started = time.monotonic()
+
+    for attempt in range(attempts):
+        probe = breaker.check()
+        metrics.inc("resilience.attempts")
+
+        if attempt:
+            metrics.inc("resilience.retries")
+
+        try:
+            # No attempt (nor its wait for a concurrency slot) outlives the request deadline
+            response = await within_deadline(_send_hedged(send, host) if idempotent else _timed(send, host))
+        except httpx.RequestError as e:
+            breaker.record_failure()
+            if attempt + 1 == attempts:
+                metrics.inc("resilience.retries_exhausted" if attempt else "resilience.failures")
+                raise
+            system_logger.warning(f"Request to {host} failed ({type(e).__name__}), retrying")
+        except BaseException:
+            # Cancellation, the deadline, or an error of the request itself (e.g. httpx.InvalidURL):
+            # none of them tells whether the host recovered, but a probe must not keep the circuit half-open forever
+            if probe:
+                breaker.release_probe()
+            raise
+        else:
+            if response.status_code not in resilienceSettings.RETRY_STATUSES:
+                breaker.record_success()
+                _call_latency[host].record(time.monotonic() - started)
+                if attempt:
+                    metrics.inc("resilience.retries_recovered")
+                return response
+
+            # Throttling is not an outage: the limiter slows down instead of the breaker opening
+            if response.status_code == 429:
+                breaker.record_throttled()
+            else:
+                breaker.record_failure()
+            if attempt + 1 == attempts:
+                if attempt:
+                    metrics.inc("resilience.retries_exhausted")
+                return response
+            await response.aclose()
+            system_logger.warning(f"Request to {host} answered {response.status_code}, retrying")
+
+        await within_deadline(asyncio.sleep(backoff_delay(attempt)))
+
+
+def transport_usage() -> dict:
+    """
+    Breaker state and latency percentiles per host. Comparing the percentiles of single attempts with
+    the ones callers see shows how much tail latency retries and hedges add or remove.
+    """
+    def milliseconds(seconds):
+        return None if seconds is None else round(seconds * 1000, 1)
+
+    return {
+        host: {
+            "breaker": get_breaker(host).state,
+            "consecutive_failures": get_breaker(host).failures,
+            "attempt_latency_ms": {f"p{p}": milliseconds(_attempt_latency[host].percentile(p)) for p in (50, 95, 99)},
+            "call_latency_ms": {f"p{p}": milliseconds(_call_latency[host].percentile(p)) for p in (50, 95, 99)},
+            "hedge_delay_ms": milliseconds(hedge_delay(host)),
+        }
+        for host in list(_breakers)
+    }
+
+
+metrics.register_collector("fhir_transport", transport_usage)
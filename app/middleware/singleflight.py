@@ -0,0 +1,49 @@
+import asyncio
+import contextvars
+import typing
+
+from app.middleware.metrics import metrics
+
+
+class SingleFlight():
+    """
+    Collapses concurrent calls with the same key into one: the first caller runs the coroutine and
+    every caller arriving while it is still in flight awaits the same result (or exception).
+    Nothing is kept once it completes; caching is left to the callers.
+
+    The shared call runs in `context` (a copy of the first caller's by default), so per-request state such as
+    a deadline should be left out of it and applied by every caller to its own wait instead.
+
+    Usage:
+        fhir_requests = SingleFlight("fhir")
+        fhir_json = await within_deadline(fhir_requests.do((url, token_scope), lambda: fetch(url), context=without_deadline()))
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> task
+
+    async def do(self, key, func: typing.Callable[[], typing.Awaitable[typing.Any]], context: typing.Optional[contextvars.Context] = None):
+        task = self._calls.get(key)
+
+        if task is None:
+            task = asyncio.get_running_loop().create_task(func(), context=context)
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            metrics.inc(f"singleflight.{self.name}.calls")
+        else:
+            metrics.inc(f"singleflight.{self.name}.coalesced")
+
+        # Shielded so a caller that goes away does not cancel the call the others are waiting on
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+        # Retrieve the exception even when every caller went away, so asyncio does not log it as lost
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
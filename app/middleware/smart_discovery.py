@@ -0,0 +1,93 @@
+import time
+import asyncio
+import logging
+
+from app.configs.config import discoverySettings
+from app.middleware.exception import exception_message
+from app.middleware.http_client import get_http_client
+from app.middleware.metrics import metrics
+
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+REQUIRED_ENDPOINTS = ("authorization_endpoint", "token_endpoint")
+
+
+class SmartDiscovery():
+    """
+    Async, cached SMART discovery (`[iss]/.well-known/smart-configuration`).
+
+    A configuration younger than discoverySettings.REFRESH_AFTER is served as is; an older one
+    is served while a background task refreshes it; one older than discoverySettings.TTL (or none
+    at all) is fetched before use. Concurrent refreshes of the same ISS share one request.
+    The cache is per process: the OAuth endpoints are only ever taken from the ISS itself.
+    """
+
+    def __init__(self):
+        self._configs = {}  # iss -> (fetched_at (time.monotonic()), configuration)
+        self._refreshing = {}  # iss -> task
+
+    async def get(self, iss) -> dict:
+        cached = self._configs.get(iss)
+        age = time.monotonic() - cached[0] if cached else None
+
+        if cached is None or age >= discoverySettings.TTL:
+            return await self.refresh(iss)
+
+        if age >= discoverySettings.REFRESH_AFTER:
+            self.refresh_in_background(iss)
+
+        metrics.inc("smart_discovery.hits")
+
+        return cached[1]
+
+    async def refresh(self, iss) -> dict:
+        task = self._refreshing.get(iss)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(iss))
+            self._refreshing[iss] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(iss, None))
+
+        # Shielded so a cancelled caller does not cancel the refresh other callers are waiting on
+        return await asyncio.shield(task)
+
+    def refresh_in_background(self, iss):
+        if iss in self._refreshing:
+            return
+
+        task = asyncio.ensure_future(self.refresh(iss))
+        task.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(task):
+        if not task.cancelled() and task.exception() is not None:
+            system_logger.warning(f"Background SMART discovery refresh failed: {exception_message(task.exception())}")
+
+    async def _fetch(self, iss) -> dict:
+        try:
+            response = await get_http_client().get(f"{iss}/.well-known/smart-configuration", headers={"Accept": "application/json"})
+            response.raise_for_status()
+            configuration = response.json()
+        except Exception:
+            metrics.inc("smart_discovery.failures")
+            raise
+
+        if not isinstance(configuration, dict):
+            metrics.inc("smart_discovery.failures")
+            raise ValueError(f"SMART configuration of {iss} is not a JSON object")
+
+        missing = [name for name in REQUIRED_ENDPOINTS if name not in configuration]
+        if missing:
+            metrics.inc("smart_discovery.failures")
+            raise ValueError(f"SMART configuration of {iss} is missing {', '.join(missing)}")
+
+        self._configs[iss] = (time.monotonic(), configuration)
+
+        metrics.inc("smart_discovery.fetches")
+        uvicorn_logger.info(f"SMART configuration of {iss} refreshed")
+
+        return configuration
+
+
+smart_discovery = SmartDiscovery()
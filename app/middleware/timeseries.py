@@ -0,0 +1,171 @@
+import bisect
+import typing
+from array import array
+from datetime import datetime, timezone
+
+from app.configs.config import historySettings
+from app.middleware.cache import LRUCache
+from app.models.observation import Quantity
+
+
+def parse_time(text) -> float:
+    """
+    Seconds since the epoch of a FHIR date / dateTime / instant ("2020", "2020-05", "2020-05-01",
+    "2020-05-01T10:00:00+08:00", ...); times without an offset are taken as UTC.
+    Raises ValueError for anything else.
+    """
+    text = str(text).strip()
+    if len(text) == 4:
+        text += "-01-01"
+    elif len(text) == 7:
+        text += "-01"
+
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+
+    return moment.timestamp()
+
+
+def format_time(seconds) -> str:
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class Point(typing.NamedTuple):
+    time: float  # seconds since the epoch
+    value: float
+
+
+class Bucket(typing.NamedTuple):
+    start: float
+    end: float
+    count: int
+    min: float
+    max: float
+    mean: float
+
+
+class TimeSeries():
+    """
+    Every value of one record field, as two parallel arrays sorted by time (8 bytes per timestamp and per value).
+
+    as_of() and between() find their bounds by bisection (O(log n)); downsample() does one bisection per bucket.
+    Values sharing a timestamp keep the order they were given in, so as_of() returns the last of them.
+    """
+
+    __slots__ = ("unit", "times", "values")
+
+    def __init__(self, unit, points=()):
+        points = sorted(points, key=lambda point: point[0])
+
+        self.unit = unit
+        self.times = array("d", (time for time, _ in points))
+        self.values = array("d", (value for _, value in points))
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def nbytes(self) -> int:
+        return (len(self.times) + len(self.values)) * self.times.itemsize
+
+    def as_of(self, time) -> typing.Optional[Point]:
+        """
+        The latest value at or before `time`, None when there is none.
+        """
+        index = bisect.bisect_right(self.times, time) - 1
+        if index < 0:
+            return None
+
+        return Point(self.times[index], self.values[index])
+
+    def _bounds(self, start, end) -> typing.Tuple[int, int]:
+        low = 0 if start is None else bisect.bisect_left(self.times, start)
+        high = len(self.times) if end is None else bisect.bisect_right(self.times, end)
+        return low, max(low, high)
+
+    def between(self, start=None, end=None) -> typing.List[Point]:
+        """
+        The values with start <= time <= end (either bound may be None), oldest first.
+        """
+        low, high = self._bounds(start, end)
+        return [Point(time, value) for time, value in zip(self.times[low:high], self.values[low:high])]
+
+    def downsample(self, buckets, start=None, end=None) -> typing.List[Bucket]:
+        """
+        min / max / mean of the values in `buckets` equal time spans covering start..end
+        (the first and last values when not given); empty buckets are left out.
+        """
+        low, high = self._bounds(start, end)
+        if low == high:
+            return []
+
+        start = self.times[low] if start is None else start
+        end = self.times[high - 1] if end is None else end
+        width = (end - start) / buckets
+
+        summary = []
+        for number in range(buckets):
+            bucket_start = start + number * width
+            bucket_end = end if number == buckets - 1 else start + (number + 1) * width
+
+            # Each bucket holds [bucket_start, bucket_end), the last one includes `end`
+            bucket_high = high if number == buckets - 1 else bisect.bisect_left(self.times, bucket_end, low, high)
+            if bucket_high > low:
+                values = self.values[low:bucket_high]
+                summary.append(Bucket(bucket_start, bucket_end, len(values), min(values), max(values), sum(values) / len(values)))
+            low = bucket_high
+
+        return summary
+
+
+def build_series(quantities) -> typing.Dict[str, TimeSeries]:
+    """
+    One TimeSeries per record field from (field, Quantity) pairs, e.g. the fields extracted from every
+    Observation of a code. Quantities without a timestamp, or in another unit than the field's
+    first one (units are not converted), are left out.
+    """
+    points = {}
+    units = {}
+
+    for field, quantity in quantities:
+        if not isinstance(quantity, Quantity) or not quantity.timestamp:
+            continue
+        try:
+            time = parse_time(quantity.timestamp)
+        except ValueError:
+            continue
+        if units.setdefault(field, quantity.unit) != quantity.unit:
+            continue
+        points.setdefault(field, []).append((time, quantity.value))
+
+    return {field: TimeSeries(units[field], field_points) for field, field_points in points.items()}
+
+
+class HistoryStore(LRUCache):
+    """
+    Observation histories, keyed by (FHIR base URL, patient id, OBSERVATION_CODES entry); each value is
+    the {record field: TimeSeries} built from every Observation of that code.
+    """
+
+    def get(self, base_url, patient_id, name) -> typing.Optional[typing.Dict[str, TimeSeries]]:
+        return super().get((base_url, patient_id, name))
+
+    def set(self, base_url, patient_id, name, value: typing.Dict[str, TimeSeries]):
+        super().set((base_url, patient_id, name), value, size=sum(series.nbytes for series in value.values()) + 64)
+
+    def invalidate(self, base_url=None, patient_id=None) -> int:
+        """
+        Drops one patient's histories, every history of a FHIR server, or everything. Returns the number dropped.
+        """
+        return super().invalidate(
+            lambda key: (base_url is None or key[0] == base_url) and (patient_id is None or key[1] == patient_id)
+        )
+
+
+history_store = HistoryStore(
+    "history_store",
+    ttl=historySettings.TTL,
+    max_entries=historySettings.MAX_ENTRIES,
+    max_bytes=historySettings.MAX_BYTES,
+)
@@ -0,0 +1,56 @@
+import typing
+
+
+class Quantity(typing.NamedTuple):
+    """
+    A numeric observation value, parsed once by the extractors and read directly by the calculators.
+    It is formatted as "value unit" (e.g. "170.2 cm") only when a record leaves the app (see display_record).
+    """
+    value: float
+    unit: str
+    timestamp: typing.Optional[str] = None  # effective time of the Observation (see observation_timestamp)
+    code: typing.Optional[str] = None  # the Observation's (or component's) code
+
+    def __str__(self):
+        return f"{self.value} {self.unit}"
+
+
+def as_quantity(value) -> typing.Optional[Quantity]:
+    """
+    The Quantity of a record field: itself, parsed from a legacy "value unit" string, or None when the
+    field holds no number (an extractor message such as "Complete height data not found", None, ...).
+    """
+    if isinstance(value, Quantity):
+        return value
+
+    if isinstance(value, str):
+        parts = value.split(" ")
+        if len(parts) >= 2:
+            try:
+                return Quantity(float(parts[0]), parts[1])
+            except ValueError:
+                return None
+
+    return None
+
+
+def require_quantity(value, name="value") -> Quantity:
+    """
+    as_quantity, raising ValueError when the field holds no number.
+    """
+    quantity = as_quantity(value)
+    if quantity is None:
+        raise ValueError(f"{name} is not available: {value!r}")
+
+    return quantity
+
+
+def display_value(value) -> typing.Any:
+    return str(value) if isinstance(value, Quantity) else value
+
+
+def display_record(record: dict) -> dict:
+    """
+    The record with every Quantity formatted as "value unit", the way it is shown and returned as JSON.
+    """
+    return {name: display_value(value) for name, value in record.items()}
@@ -4,7 +4,8 @@ from starlette.responses import JSONResponse
 from app.routers.v1.endpoints import (
     get_patients,
     get_observations,
-    get_calculations
+    get_calculations,
+    get_metrics
 )
 
 
@@ -18,4 +19,5 @@ async def test():
 
 router_v1.include_router(get_patients.router, prefix="/get-patients", tags=["Get Patients"])
 router_v1.include_router(get_observations.router, prefix="/get-observations", tags=["Get Observations"])
-router_v1.include_router(get_calculations.router, prefix="/get-calculations", tags=["Get Calculations"])
\ No newline at end of file
+router_v1.include_router(get_calculations.router, prefix="/get-calculations", tags=["Get Calculations"])
+router_v1.include_router(get_metrics.router, prefix="/get-metrics", tags=["Get Metrics"])
\ No newline at end of file
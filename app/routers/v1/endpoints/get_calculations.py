@@ -2,6 +2,7 @@ import math
 from fastapi import APIRouter, Request, HTTPException
 from app.configs.reference import COEFFICIENTS, population_data
 from app.middleware.exception import exception_message
+from app.models.observation import require_quantity
 import logging
 
 
@@ -11,169 +12,194 @@ uvicorn_logger = logging.getLogger('uvicorn.error')
 system_logger = logging.getLogger('custom.error')
 
 
+# Calculators below take Quantity record fields (legacy "value unit" strings are parsed as well);
+# missing or invalid data raises one of these and is reported as NOT_AVAILABLE
+CALCULATION_ERRORS = (AttributeError, TypeError, ValueError, ArithmeticError)
+NOT_AVAILABLE = "Not available due to missing required data"
+
+
+def _ideal_body_weight(gender, height) -> float:
+    height = require_quantity(height, "height")
+
+    if height.unit == "cm":
+        # Convert height from cm to inches
+        ht = height.value / 2.54
+
+    elif height.unit == "in":
+        ht = height.value
+
+    else:
+        ht = height.value
+
+    # Calculate IBW based on gender
+    if gender.lower() == 'male':
+        return 50 + 2.3 * max(0, ht - 60)  # 5 feet = 60 inches
+
+    elif gender.lower() == 'female':
+        return 45.5 + 2.3 * max(0, ht - 60)
+
+    raise ValueError("Gender must be 'male' or 'female'.")
+
+
+def _body_mass_index(weight, height) -> float:
+    wt = require_quantity(weight, "weight").value
+    ht = require_quantity(height, "height").value
+
+    ht = ht / 100
+    return wt / (ht ** 2)
+
+
+def _ibw_abw_rows(ibw, weight):
+    weight = require_quantity(weight, "weight")
+
+    # ABW is reported as the actual weight whether or not it exceeds the IBW
+    abw = str(weight)
+    ibw = str(round(ibw, 1)) + " " + weight.unit
+
+    return ibw, abw
+
+
 def get_ibw_abw(gender, height, weight):
     try:
-        value = float(height.split(" ")[0])
-        ht_unit = str(height.split(" ")[1])
-
-        if ht_unit == "cm":
-            # Convert height from cm to inches
-            ht = value / 2.54
-
-        elif ht_unit == "in":
-            ht = value
-        
-        else:
-            ht = value
-
-        # Calculate IBW based on gender
-        if gender.lower() == 'male':
-            ibw = 50 + 2.3 * max(0, ht - 60)  # 5 feet = 60 inches
-            
-        elif gender.lower() == 'female':
-            ibw = 45.5 + 2.3 * max(0, ht - 60)
-            
-        else:
-            raise ValueError("Gender must be 'male' or 'female'.")
-        
-        # Calculate ABW based on weight
-        wt_value = float(weight.split(" ")[0])
-        wt_unit = str(weight.split(" ")[1])
-
-        if wt_value > ibw: 
-            abw = ibw + 0.4 * (wt_value - ibw)
-            abw = str(wt_value) + " " + wt_unit
-
-        else:
-            # If actual weight is not greater than IBW
-            abw = weight
-        
-        ibw = str(round(ibw,1)) + " " + wt_unit
-
-    except:
-        ibw = "Not available due to missing required data"
-        abw = "Not available due to missing required data"
+        ibw, abw = _ibw_abw_rows(_ideal_body_weight(gender, height), weight)
+
+    except CALCULATION_ERRORS:
+        ibw = NOT_AVAILABLE
+        abw = NOT_AVAILABLE
 
     return ibw, abw
 
 
+def _creatinine_clearance(age, weight, gender, creatinine, bmi, ibw):
+    """
+    CrCl with the actual weight and with the weight the BMI calls for, plus that BMI category and weight.
+    """
+    wt = require_quantity(weight, "weight").value
+    cr = require_quantity(creatinine, "creatinine").value
+
+    # Calculate CrCl using actual weight
+    actual_crcl = (140 - age) * wt * (0.85 if gender.lower() == 'female' else 1) / (72 * cr)
+
+    # Determine which weight to use for the adjusted CrCl calculation (the IBW as shown, rounded to 0.1)
+    ibw = round(ibw, 1)
+
+    if bmi < 18.5:  # Underweight
+        abw = wt
+        bmi_category = "Underweight"
+        method = "actual weight"
+
+    elif 18.5 <= bmi < 25:  # Normal weight
+        abw = ibw
+        bmi_category = "Normal weight"
+        method = "ideal body weight"
+
+    else:  # Overweight/Obese
+        abw = ibw + 0.4 * (wt - ibw)
+        bmi_category = "Overweight / obese"
+        method = "adjusted body weight"
+
+    # Calculate CrCl using adjusted weight
+    adjusted_crcl = (140 - age) * abw * (0.85 if gender.lower() == 'female' else 1) / (72 * cr)
+
+    return actual_crcl, adjusted_crcl, bmi_category, method
+
+
+def _crcl_rows(actual_crcl, adjusted_crcl, bmi_category, method):
+    # Format Output
+    unit = "mg/mL"
+    actual_crcl = str(round(actual_crcl,2)) + " " + unit
+    adjusted_crcl = str(round(adjusted_crcl, 2))  + " " + unit
+
+    return actual_crcl, adjusted_crcl, bmi_category, method
+
+
 def get_crcl(age, weight, gender, height, creatinine):
 
     try:
-        wt = float(weight.split(" ")[0])
-        ht = float(height.split(" ")[0])
-        cr = float(creatinine.split(" ")[0])
-
-
-        # Calculate BMI
-        ht = ht / 100
-        bmi = wt / (ht ** 2)
-
-        # Calculate CrCl using actual weight
-        actual_crcl = (140 - age) * wt * (0.85 if gender.lower() == 'female' else 1) / (72 * cr)
-
-        # Determine which weight to use for the adjusted CrCl calculation
-        ibw = float(get_ibw_abw(gender, height, weight)[0].split(" ")[0])
-        abw = float(get_ibw_abw(gender, height, weight)[1].split(" ")[0])
-
-        if bmi < 18.5:  # Underweight
-            abw = wt
-            bmi_category = "Underweight"
-            method = "actual weight"
-            
-        elif 18.5 <= bmi < 25:  # Normal weight
-            abw = ibw
-            bmi_category = "Normal weight"
-            method = "ideal body weight"
-            
-        else:  # Overweight/Obese
-            abw = ibw + 0.4 * (wt - ibw)
-            bmi_category = "Overweight / obese"
-            method = "adjusted body weight"
-
-        # Calculate CrCl using adjusted weight
-        adjusted_crcl = (140 - age) * abw * (0.85 if gender.lower() == 'female' else 1) / (72 * cr)
-        
-        # Format Output
-        unit = "mg/mL"
-        actual_crcl = str(round(actual_crcl,2)) + " " + unit
-        adjusted_crcl = str(round(adjusted_crcl, 2))  + " " + unit
-
-    except:
-        actual_crcl = "Not available due to missing required data"
-        adjusted_crcl = "Not available due to missing required data"
+        bmi = _body_mass_index(weight, height)
+        ibw = _ideal_body_weight(gender, height)
+        actual_crcl, adjusted_crcl, bmi_category, method = _crcl_rows(*_creatinine_clearance(age, weight, gender, creatinine, bmi, ibw))
+
+    except CALCULATION_ERRORS:
+        actual_crcl = NOT_AVAILABLE
+        adjusted_crcl = NOT_AVAILABLE
         bmi_category = ""
         method = ""
 
     return actual_crcl, adjusted_crcl, bmi_category, method
 
 
+def _ost_rows(weight, age, gender):
+    wt = require_quantity(weight, "weight").value
+    age = float(age)
+
+    # Calculate OST Index, truncated to integer
+    ost_index = int((wt - age) * 0.2)
+
+    # Determine risk based on gender-specific criteria
+    if gender.lower() == 'female':
+        risk = "Low" if ost_index > 1 else "Intermediate" if -3 <= ost_index <= 1 else "High"
+    elif gender.lower() == 'male':
+        risk = "Low" if ost_index > 3 else "Intermediate" if -1 <= ost_index <= 3 else "High"
+    else:
+        raise ValueError("Invalid gender. Please specify 'female' or 'male'.")
+
+    return str(ost_index) + " points", risk
+
+
 def get_ost_index(weight, age, gender):
     try:
-        wt = float(weight.split(" ")[0])
-        age = float(age)
-
-        # Calculate OST Index, truncated to integer
-        ost_index = int((wt - age) * 0.2)
-
-        # Determine risk based on gender-specific criteria
-        if gender.lower() == 'female':
-            risk = "Low" if ost_index > 1 else "Intermediate" if -3 <= ost_index <= 1 else "High"
-        elif gender.lower() == 'male':
-            risk = "Low" if ost_index > 3 else "Intermediate" if -1 <= ost_index <= 3 else "High"
-        else:
-            raise ValueError("Invalid gender. Please specify 'female' or 'male'.")
-        
-        ost_index = str(ost_index) + " points"
-    
-    except:
-        ost_index = "Not available due to missing required data"
-        risk = "Not available due to missing required data"
+        ost_index, risk = _ost_rows(weight, age, gender)
+
+    except CALCULATION_ERRORS:
+        ost_index = NOT_AVAILABLE
+        risk = NOT_AVAILABLE
 
     return ost_index, risk
 
 
+def _mets_ir(glucose, tg, hdl, bmi) -> float:
+    tg = require_quantity(tg, "triglycerides").value
+    hdl = require_quantity(hdl, "HDL").value
+    glucose = require_quantity(glucose, "glucose").value
+
+    numerator = math.log((2 * glucose) + tg) * bmi
+    denominator = math.log(hdl)
+
+    return numerator / denominator
+
+
+def _mets_ir_rows(mets_ir):
+    # Interpretation based on METS-IR value
+    if mets_ir <= 50.39:
+        risk_interpretation = "Low"
+    else:
+        risk_interpretation = "High"
+
+    return str(int(mets_ir)), risk_interpretation
+
+
 def get_mets_ir(glucose, tg, weight, height, hdl):
     """
     Calculate the METS-IR using the given formula, directly using weight and height to compute BMI,
     and provide an interpretation based on the METS-IR value.
 
     Parameters:
-    glucose (float): Fasting glucose in mg/dL
-    triglycerides (float): Triglyceride concentration in mg/dL
-    weight (float): Weight in kilograms
-    height (float): Height in centimeters
-    hdl_cholesterol (float): High-density lipoprotein cholesterol in mg/dL
+    glucose (Quantity): Fasting glucose in mg/dL
+    triglycerides (Quantity): Triglyceride concentration in mg/dL
+    weight (Quantity): Weight in kilograms
+    height (Quantity): Height in centimeters
+    hdl_cholesterol (Quantity): High-density lipoprotein cholesterol in mg/dL
 
     Returns:
     tuple: The METS-IR value and its interpretation regarding T2D risk
     """
     try:
-        wt = float(weight.split(" ")[0])
-        ht = float(height.split(" ")[0])
-        tg = float(tg.split(" ")[0])
-        hdl = float(hdl.split(" ")[0])
-        glucose = float(glucose.split(" ")[0])
-
-        # Calculate BMI
-        bmi = wt / ((ht / 100) ** 2)
-
-        numerator = math.log((2 * glucose) + tg) * bmi
-        denominator = math.log(hdl)
-
-        mets_ir = numerator / denominator
-
-        # Interpretation based on METS-IR value
-        if mets_ir <= 50.39:
-            risk_interpretation = "Low"
-        else:
-            risk_interpretation = "High"
-        
-        mets_ir = str(int(mets_ir))
-    
-    except:
-        mets_ir = "Not available due to missing required data"
-        risk_interpretation = "Not available due to missing required data"
+        mets_ir, risk_interpretation = _mets_ir_rows(_mets_ir(glucose, tg, hdl, _body_mass_index(weight, height)))
+
+    except CALCULATION_ERRORS:
+        mets_ir = NOT_AVAILABLE
+        risk_interpretation = NOT_AVAILABLE
 
     return mets_ir, risk_interpretation
 
@@ -0,0 +1,16 @@
+import logging
+from fastapi import APIRouter
+from app.middleware.metrics import metrics
+
+
+router = APIRouter()
+
+uvicorn_logger = logging.getLogger('uvicorn.error')
+system_logger = logging.getLogger('custom.error')
+
+
+#### 路由
+## [GET] : metrics
+@router.get("", name="Get Metrics", description="Get in-process metrics (FHIR connection pool, caches, upstream calls)")
+async def get_metrics_route():
+    return metrics.snapshot()
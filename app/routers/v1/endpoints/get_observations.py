@@ -2,7 +2,7 @@ import logging
 from icecream import ic
 from fastapi import APIRouter
 from app.middleware.exception import exception_message
-from app.middleware.function import extract_observation_data
+from app.middleware.function import extract_observation_data, observation_quantity
 
 
 router = APIRouter()
@@ -38,7 +38,7 @@ async def extract_bp(fhir_json):
 
                     if sys_value is not None and sys_unit is not None:
                         try:
-                            sys_bp = f"{float(round(sys_value, 1))} {sys_unit}"
+                            sys_bp = observation_quantity(entry, sys_value, sys_unit, sys_component)
                         except (TypeError, ValueError):
                             sys_bp = "Systolic blood pressure data is not a valid number"
                     else:
@@ -49,7 +49,7 @@ async def extract_bp(fhir_json):
 
                     if dias_value is not None and dias_unit is not None:
                         try:
-                            dias_bp = f"{float(round(dias_value, 1))} {dias_unit}"
+                            dias_bp = observation_quantity(entry, dias_value, dias_unit, dias_component)
                         except (TypeError, ValueError):
                             dias_bp = "Diastolic blood pressure data is not a valid number"
                     else:
@@ -76,7 +76,7 @@ async def extract_bp(fhir_json):
 
                     if sys_value is not None and sys_unit is not None:
                         try:
-                            sys_bp = f"{float(round(sys_value, 1))} {sys_unit}"
+                            sys_bp = observation_quantity(fhir_json, sys_value, sys_unit, sys_component)
                         except (TypeError, ValueError):
                             sys_bp = "Systolic blood pressure data is not a valid number"
                     else:
@@ -87,7 +87,7 @@ async def extract_bp(fhir_json):
 
                     if dias_value is not None and dias_unit is not None:
                         try:
-                            dias_bp = f"{float(round(dias_value, 1))} {dias_unit}"
+                            dias_bp = observation_quantity(fhir_json, dias_value, dias_unit, dias_component)
                         except (TypeError, ValueError):
                             dias_bp = "Diastolic blood pressure data is not a valid number"
                     else:
@@ -25,7 +25,7 @@ async def get_height(tokens):
     )
 
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
         
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
@@ -77,7 +77,7 @@ async def get_weight(tokens):
     )
 
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
 
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
@@ -129,7 +129,7 @@ async def get_bmi(tokens):
     )
 
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
 
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
@@ -180,7 +180,7 @@ async def get_bp(tokens):
     )
 
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
 
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
@@ -275,7 +275,7 @@ async def get_hdl(tokens):
     )
 
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
 
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
@@ -326,7 +326,7 @@ async def get_ldl(tokens):
     )
 
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
 
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
@@ -377,7 +377,7 @@ async def get_tg(tokens):
     )
 
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
 
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
@@ -428,7 +428,7 @@ async def get_chol(tokens):
     )
 
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
 
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
@@ -479,7 +479,7 @@ async def get_scr(tokens):
     )
 
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
 
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
@@ -522,7 +522,7 @@ async def get_scr(tokens):
         raise ValueError(f"Found the following error pulling Observation FHIR resource: {exception_message(e)}") from e
 
 
-def get_glucose(tokens):
+async def get_glucose(tokens):
 
     # Getting data in the way prescribed by OAuthLib package
     uri, headers, body = client.add_token(
@@ -531,7 +531,7 @@ def get_glucose(tokens):
     )
 
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
 
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
@@ -574,14 +574,14 @@ def get_glucose(tokens):
         raise ValueError(f"Found the following error pulling Observation FHIR resource: {exception_message(e)}") from e
 
 
-def get_smoking_status(tokens):
+async def get_smoking_status(tokens):
     # Getting data in the way prescribed by OAuthLib package
     uri, headers, body = client.add_token(
         f"{credentialSettings.BASE_URL}/Observation?patient={tokens['patient']}&category=survey&code=72166-2",
         headers={"Accept": "application/fhir+json"},
     )
     try:
-        obs_json = fetch_fhir_json(uri, headers, body)
+        obs_json = await fetch_fhir_json(uri, headers, body)
 
         # Bundle
         if obs_json.get("resourceType") == "Bundle" and obs_json.get("total", 0) > 0:
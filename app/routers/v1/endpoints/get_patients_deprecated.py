@@ -4,12 +4,11 @@ from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException
 from oauthlib.oauth2 import WebApplicationClient
 from icecream import ic
-import httpx
 
 from app.configs.config import credentialSettings
-from app.models.patient import PatientDataResponse
+from app.models.model import PatientDataResponse
 from app.middleware.exception import exception_message
-from app.middleware.function import fetch_fhir_json
+from app.middleware.http_client import get_http_client
 
 
 router = APIRouter()
@@ -25,14 +24,13 @@ async def get_patient_data(uri, headers, patient_token):
     try:
         ic("222222")
         # Getting data in the way prescribed by OAuthLib package
-        async with httpx.AsyncClient() as asynclient:
-            # response = await asynclient.get(uri, headers=headers, data=body, timeout=10)
-            response = await asynclient.get(uri, headers=headers, timeout=10)
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="Failed to load patient data.")
-            ic(response.status_code)
-
-            fhir_json = response.json()
+        asynclient = get_http_client()
+        response = await asynclient.get(uri, headers=headers)
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Failed to load patient data.")
+        ic(response.status_code)
+
+        fhir_json = response.json()
         ic(fhir_json)
 
         # Sometimes a resource is returned, but it doesn't have anything useful
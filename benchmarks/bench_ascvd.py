@@ -0,0 +1,92 @@
+"""
+Compares the ASCVD scoring paths:
+
+- the string-keyed tables (_calculate_ln_values + _get_mean_coefficient_value + _get_baseline_survival + _calculate_ascvd_risk)
+- score_ascvd on the compiled coefficient rows, one patient at a time
+- score_ascvd_batch on N patients at once (NumPy)
+
+and reports the largest difference between their risks.
+
+Usage:
+    python benchmarks/bench_ascvd.py [patients]
+"""
+import os
+import sys
+import time
+import random
+import contextlib
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.middleware import ascvd
+from app.routers.v1.endpoints.get_calculations import (
+    _calculate_ln_values, _get_mean_coefficient_value, _get_baseline_survival, _determine_population_group, _calculate_ascvd_risk,
+)
+
+
+def _table_risk(race, gender, age, cholesterol, hdl, sbp, has_diabetes, is_smoking, is_treating_htn):
+    # What /calculate_ascvd_risk computed before the coefficients were compiled
+    group = _determine_population_group(race, gender)
+    ln_values = _calculate_ln_values(race, gender, age, cholesterol, hdl, sbp, has_diabetes, is_smoking, is_treating_htn)
+    value_sum = round(sum(ln_values.values()), 2)
+
+    return _calculate_ascvd_risk(value_sum, _get_mean_coefficient_value(group), _get_baseline_survival(group))
+
+
+def _patients(count, seed=0):
+    rng = random.Random(seed)
+    return [
+        (
+            rng.choice(["White", "Black or African American", "Asian"]),
+            rng.choice(["male", "female"]),
+            rng.randint(40, 79),
+            round(rng.uniform(130, 320), 1),
+            round(rng.uniform(20, 100), 1),
+            round(rng.uniform(90, 200), 1),
+            rng.random() < 0.2,
+            rng.random() < 0.2,
+            rng.random() < 0.3,
+        )
+        for _ in range(count)
+    ]
+
+
+def _seconds(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def main(count):
+    patients = _patients(min(count, 200_000))
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        tables = [_table_risk(*patient) for patient in patients]
+        table_seconds = _seconds(lambda: [_table_risk(*patient) for patient in patients])
+
+    compiled = [ascvd.score_ascvd(*patient) for patient in patients]
+    compiled_seconds = _seconds(lambda: [ascvd.score_ascvd(*patient) for patient in patients])
+
+    print(f"string-keyed tables ({len(patients)} patients): {table_seconds / len(patients) * 1e6:6.2f} us/patient")
+    print(f"score_ascvd         ({len(patients)} patients): {compiled_seconds / len(patients) * 1e6:6.2f} us/patient   ({table_seconds / compiled_seconds:.1f}x)")
+    print(f"largest difference: {max(abs(a - b) for a, b in zip(tables, compiled)):.3g} percentage points")
+
+    if ascvd.np is None:
+        print("NumPy is not installed (pip install numpy); skipping score_ascvd_batch")
+        return
+
+    np = ascvd.np
+    races, genders, ages, cholesterols, hdls, sbps, diabetes, smokers, treated = (list(column) for column in zip(*patients))
+    groups = ascvd.encode_population_groups(races, genders)
+    batch = ascvd.score_ascvd_batch(groups, ages, cholesterols, hdls, sbps, diabetes, smokers, treated)
+    print(f"score_ascvd_batch largest difference: {np.max(np.abs(batch - np.array(tables))):.3g} percentage points")
+
+    repeat = max(1, count // len(patients))
+    columns = [np.tile(np.asarray(column), repeat) for column in (groups, ages, cholesterols, hdls, sbps, diabetes, smokers, treated)]
+    batch_seconds = _seconds(lambda: ascvd.score_ascvd_batch(*columns))
+    total = len(columns[0])
+    print(f"score_ascvd_batch   ({total} patients): {batch_seconds / total * 1e6:6.3f} us/patient   ({table_seconds / len(patients) / (batch_seconds / total):.0f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
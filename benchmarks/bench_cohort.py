@@ -0,0 +1,89 @@
+"""
+Compares the vectorized cohort engine with the scalar get_calculations functions:
+
+- compute_cohort on numeric columns (patients per second)
+- calculate_records vs compute_calculations on get_records dicts, checking that every result is identical
+
+Usage:
+    python benchmarks/bench_cohort.py [patients]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.middleware import cohort
+from app.middleware.record_builder import compute_calculations
+from app.models.observation import Quantity
+
+
+def _records(count, seed=0):
+    rng = random.Random(seed)
+
+    def quantity(low, high, unit):
+        # A few values are missing or unusable, the way extractors report them
+        if rng.random() < 0.02:
+            return rng.choice([None, "Complete data not found", Quantity(0.0, unit)])
+        return Quantity(float(round(rng.uniform(low, high), 1)), unit)
+
+    return [
+        {
+            "Gender": rng.choice(["male", "female"]),
+            "Age": rng.randint(18, 100),
+            "Height": quantity(140, 200, "cm"),
+            "Weight": quantity(35, 150, "kg"),
+            "Creatinine": quantity(0.3, 3.0, "mg/dL"),
+            "Glucose (blood sugar)": quantity(60, 300, "mg/dL"),
+            "Triglycerides": quantity(40, 400, "mg/dL"),
+            "HDL": quantity(20, 100, "mg/dL"),
+        }
+        for _ in range(count)
+    ]
+
+
+def _seconds(function, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+
+    return best
+
+
+def main(count):
+    if not cohort.numpy_enabled():
+        print("NumPy is not installed (pip install numpy); nothing to compare")
+        return
+
+    np = cohort.np
+    rng = np.random.default_rng(0)
+    columns = {
+        "height": rng.uniform(140, 200, count).round(1),
+        "weight": rng.uniform(35, 150, count).round(1),
+        "age": rng.integers(18, 100, count).astype(np.float64),
+        "gender": rng.integers(cohort.MALE, cohort.FEMALE + 1, count).astype(np.int8),
+        "creatinine": rng.uniform(0.3, 3.0, count).round(1),
+        "glucose": rng.uniform(60, 300, count).round(1),
+        "tg": rng.uniform(40, 400, count).round(1),
+        "hdl": rng.uniform(20, 100, count).round(1),
+    }
+    engine = _seconds(lambda: cohort.compute_cohort(**columns))
+    print(f"compute_cohort      ({count} patients): {engine * 1e3:8.1f} ms   {count / engine / 1e6:6.2f} M patients/s")
+
+    records = _records(min(count, 100_000))
+    scalar_results = [compute_calculations(row) for row in records]
+    batch_results = cohort.calculate_records(records)
+    mismatches = sum(1 for scalar, batch in zip(scalar_results, batch_results) if scalar != batch)
+
+    scalar = _seconds(lambda: [compute_calculations(row) for row in records], repeat=1)
+    batch = _seconds(lambda: cohort.calculate_records(records), repeat=1)
+    print(f"compute_calculations ({len(records)} records): {scalar * 1e3:8.1f} ms   {len(records) / scalar / 1e3:6.1f} k records/s")
+    print(f"calculate_records    ({len(records)} records): {batch * 1e3:8.1f} ms   {len(records) / batch / 1e3:6.1f} k records/s   ({scalar / batch:.1f}x)")
+    print(f"results differing from the scalar functions: {mismatches}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
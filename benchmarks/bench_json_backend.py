@@ -0,0 +1,85 @@
+"""
+Compares the stdlib and orjson JSON paths used per request:
+
+- decoding FHIR responses: `httpx.Response.json()` vs `json_backend.loads(response.content)`
+- rendering API responses: `jsonable_encoder` + `JSONResponse` vs `FastJSONResponse`
+
+Usage:
+    python benchmarks/bench_json_backend.py
+"""
+import os
+import sys
+import json
+import timeit
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.configs.config import jsonSettings
+from app.configs.reference import OBSERVATION_CODES
+from app.middleware import json_backend
+
+
+def _observation(code, index):
+    return {
+        "fullUrl": f"https://fhir.example.org/Observation/{code}-{index}",
+        "resource": {
+            "resourceType": "Observation",
+            "id": f"{code}-{index}",
+            "meta": {"versionId": "1", "lastUpdated": "2024-01-01T00:00:00Z"},
+            "status": "final",
+            "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category", "code": "vital-signs"}]}],
+            "code": {"coding": [{"system": "http://loinc.org", "code": code, "display": "Body height"}], "text": "Body height"},
+            "subject": {"reference": "Patient/p1"},
+            "effectiveDateTime": f"20{10 + index % 14:02d}-01-01T00:00:00Z",
+            "valueQuantity": {"value": 170.2 + index, "unit": "cm", "system": "http://unitsofmeasure.org", "code": "cm"},
+        },
+        "search": {"mode": "match"},
+    }
+
+
+def _multi_code_bundle(per_code=20):
+    entries = [_observation(spec["code"], index) for spec in OBSERVATION_CODES.values() for index in range(per_code)]
+    return {"resourceType": "Bundle", "type": "searchset", "total": len(entries), "entry": entries}
+
+
+RECORDS = {
+    "Name": "Jane Doe", "Gender": "female", "Race": "White", "Ethnicity": "Not Hispanic or Latino",
+    "Date of Birth": "1960-05-01", "Age": 64, "Height": "170.2 cm", "Weight": "80.5 kg", "BMI": "27.8 kg/m2",
+    "Systolic BP": "120.0 mm[Hg]", "Diastolic BP": "80.0 mm[Hg]", "HDL": "50.0 mg/dL", "LDL": "100.0 mg/dL",
+    "Triglycerides": "150.0 mg/dL", "Cholesterol": "200.0 mg/dL", "Creatinine": "1.1 mg/dL",
+    "Glucose (blood sugar)": "95.0 mg/dL", "Tobacco Smoking Status": "Never smoker",
+}
+
+
+def _per_call_us(statement, number):
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    if json_backend.orjson is None:
+        print("orjson is not installed (pip install orjson); nothing to compare")
+        return
+
+    body = json.dumps(_multi_code_bundle()).encode()
+    response = httpx.Response(200, content=body, headers={"Content-Type": "application/fhir+json"})
+
+    jsonSettings.JSON_BACKEND = "orjson"
+    decode_stdlib = _per_call_us(lambda: response.json(), 200)
+    decode_fast = _per_call_us(lambda: json_backend.loads(response.content), 200)
+    render_stdlib = _per_call_us(lambda: JSONResponse(jsonable_encoder(RECORDS)), 5000)
+    render_fast = _per_call_us(lambda: json_backend.FastJSONResponse(RECORDS), 5000)
+
+    # A /get_records request decodes the Patient plus one multi-code Bundle and renders one response
+    saved = (decode_stdlib - decode_fast) + (render_stdlib - render_fast)
+
+    print(f"FHIR Bundle decode ({len(body) / 1024:.0f} KiB): stdlib {decode_stdlib:8.1f} us   orjson {decode_fast:8.1f} us   ({decode_stdlib / decode_fast:.1f}x)")
+    print(f"API response render             : stdlib {render_stdlib:8.1f} us   orjson {render_fast:8.1f} us   ({render_stdlib / render_fast:.1f}x)")
+    print(f"CPU saved per /get_records request: {saved:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Measures the observation history store (app/middleware/timeseries.py) on one long series:
+
+- as_of lookups (bisection) against scanning the values for the latest one before the time
+- range queries and downsampling to chart buckets
+- memory per value
+
+Usage:
+    python benchmarks/bench_timeseries.py [values]
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.middleware.timeseries import TimeSeries
+
+
+def _seconds(function, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+
+    return best
+
+
+def _scan_as_of(points, when):
+    # What a list of (time, value) would need without the time index
+    latest = None
+    for point in points:
+        if point[0] <= when and (latest is None or point[0] >= latest[0]):
+            latest = point
+
+    return latest
+
+
+def main(count):
+    rng = random.Random(0)
+    points = [(rng.uniform(0, 10 * 365 * 86400), rng.uniform(40, 150)) for _ in range(count)]
+
+    build = _seconds(lambda: TimeSeries("kg", points), repeat=1)
+    series = TimeSeries("kg", points)
+    queries = [rng.uniform(0, 10 * 365 * 86400) for _ in range(10_000)]
+
+    indexed = _seconds(lambda: [series.as_of(when) for when in queries])
+    scans = queries[:20]
+    scanned = _seconds(lambda: [_scan_as_of(points, when) for when in scans], repeat=1)
+    mismatches = sum(1 for when in scans if tuple(series.as_of(when)) != _scan_as_of(points, when))
+
+    start, end = 2 * 365 * 86400, 3 * 365 * 86400
+    between = _seconds(lambda: series.between(start, end))
+    downsample = _seconds(lambda: series.downsample(200))
+
+    print(f"build               ({count} values): {build * 1e3:8.1f} ms   {series.nbytes / count:.0f} bytes/value")
+    print(f"as_of, bisection    ({len(queries)} lookups): {indexed / len(queries) * 1e6:8.2f} us/lookup")
+    print(f"as_of, linear scan  ({len(scans)} lookups): {scanned / len(scans) * 1e6:8.2f} us/lookup   ({scanned / len(scans) / (indexed / len(queries)):.0f}x slower)")
+    print(f"between, one year   ({len(series.between(start, end))} values): {between * 1e3:8.2f} ms")
+    print(f"downsample, 200 buckets: {downsample * 1e3:8.2f} ms")
+    print(f"lookups differing from the scan: {mismatches}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
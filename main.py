@@ -3,34 +3,70 @@ import sys
 import logging
 import typing
 import uuid
+import hashlib
 import uvicorn
 import json
-import requests
 import httpx
 import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
 
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from oauthlib.oauth2 import WebApplicationClient
 
-from app.configs.config import basicSettings, credentialSettings
+from app.configs.config import basicSettings, credentialSettings, fhirSettings, plannerSettings, cacheSettings, deadlineSettings, renderSettings, historySettings
+from app.configs.reference import OBSERVATION_CODES
 from app.models.model import UserRiskInput
+from app.models.observation import Quantity, display_value, display_record
 from app.routers.v1.base import router_v1
-from app.routers.v1.endpoints.get_patients import extract_patient_info
-from app.routers.v1.endpoints.get_observations import extract_height, extract_weight, extract_bmi, extract_bp, extract_hdl, extract_ldl, extract_tg, extract_chol, extract_scr, extract_glucose, extract_smoking_status
-from app.routers.v1.endpoints.get_calculations import get_ibw_abw, get_crcl, get_ost_index, get_mets_ir, _calculate_ln_values, _get_mean_coefficient_value, _get_baseline_survival, _determine_population_group, _calculate_ascvd_risk
 from app.middleware.exception import exception_message
+from app.middleware.http_client import init_http_client, close_http_client, get_http_client
+from app.middleware.smart_discovery import smart_discovery
+from app.middleware.resilience import resilient_send, CircuitOpenError
+from app.middleware.singleflight import SingleFlight
+from app.middleware.deadline import DeadlineExceeded, deadline_scope, within_deadline, without_deadline, request_timeout, check as check_deadline
+from app.middleware.function import get_next_link, demultiplex_observations, match_observation_code, observation_timestamp, searchset_bundle
+from app.middleware.json_stream import BundleEntryParser, iter_bundle_entries
+from app.middleware.metrics import metrics
+from app.middleware.query_planner import query_planner
+from app.middleware.request_cache import memoize_per_request
+from app.middleware.record_cache import record_cache
+from app.middleware.record_builder import (
+    PATIENT_FIELDS, RECORD_FIELDS, CALCULATION_ROWS, CALCULATION_FIELDS, CALCULATION_GROUPS, OBSERVATION_FIELDS, RECORD_FIELD_GROUPS, HISTORY_FIELD_GROUPS, AS_OF_FIELDS,
+    FIELD_OBSERVATIONS, CODED_OBSERVATIONS,
+    RecordField, FieldSelection, patient_fields, observation_fields, compute_calculations, parse_fields, select_fields, select_calculations,
+)
+from app.middleware.timeseries import TimeSeries, history_store, build_series, parse_time, format_time
+from app.middleware.calculation_graph import calculation_graph
+from app.middleware import conditional_cache
+from app.middleware.json_backend import FastJSONResponse, FastJSONRoute, loads as json_loads, dumps as json_dumps
+from app.middleware.projection import projection_params, is_projected, record_payload, reject as reject_projection
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client for all FHIR traffic, opened on startup and closed on shutdown
+    init_http_client()
+    # Warm the SMART configuration up without making startup wait on the authorization server
+    smart_discovery.refresh_in_background(credentialSettings.BASE_URL)
+    yield
+    await close_http_client()
 
 
 app = FastAPI(
     version=basicSettings.VERSION,
-    title="Smart on FHIR App"
+    title="Smart on FHIR App",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
+# dict results of the routes below are rendered by the configured JSON backend (see jsonSettings)
+app.router.route_class = FastJSONRoute
 
 client = WebApplicationClient(credentialSettings.CLIENT_ID)
 cookie = {}
@@ -38,6 +74,12 @@ cookie = {}
 uvicorn_logger = logging.getLogger('uvicorn.error')
 system_logger = logging.getLogger('custom.error')
 
+# Upstream FHIR requests made by the current fetch_patient_record call, reported to the query planner
+fhir_round_trips: ContextVar[typing.Optional[typing.List[int]]] = ContextVar("fhir_round_trips", default=None)
+
+# Identical in-flight FHIR GETs (double clicks, render_data and the ASCVD button at once) share one request
+fhir_requests = SingleFlight("fhir")
+
 app.include_router(router_v1, prefix=basicSettings.API_PREFIX)
 
 origins = ["http://localhost"]
@@ -85,10 +127,13 @@ async def index(launch: str = "", iss: str = ""):
 ### 2. Retrieve metadata or SMART configuration
 # https://hl7.org/fhir/smart-app-launch/app-launch.html#retrieve-well-knownsmart-configuration
 # https://fhir.epic.com/Documentation?docId=oauth2&section=Embedded-Oauth2-Launch_Conformance-Statement
-smart_config_url = f"{credentialSettings.BASE_URL}/.well-known/smart-configuration"
-response = requests.get(smart_config_url, headers={"Accept": "application/fhir+json"}).json()
-authorization_uri = response["authorization_endpoint"]
-token_uri = response["token_endpoint"]
+# Fetched asynchronously on first use (and warmed up in the lifespan), cached with a TTL and
+# refreshed in the background, see app/middleware/smart_discovery.py
+async def get_smart_configuration() -> dict:
+    try:
+        return await smart_discovery.get(credentialSettings.BASE_URL)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Could not retrieve the SMART configuration: {exception_message(e)}")
 
 
 ### 3. Obtain Authorization Code
@@ -96,9 +141,11 @@ token_uri = response["token_endpoint"]
 # https://fhir.epic.com/Documentation?docId=oauth2&section=Standalone-Oauth2-Launch_Request_Auth_Code
 @app.get("/authorize")
 async def authorization():
+    smart_configuration = await get_smart_configuration()
+
     cookie["state"] = uuid.uuid4().hex
     auth_url = client.prepare_request_uri(
-    uri=authorization_uri,
+    uri=smart_configuration["authorization_endpoint"],
     redirect_uri=credentialSettings.REDIRECT_URI,
     launch=cookie["launch_token"],  # Necessary for EHR launch
     scope=credentialSettings.SCOPES,
@@ -127,30 +174,87 @@ async def callback(request: Request):
         if state != cookie.get("state"):
             raise HTTPException(status_code=400, detail="Invalid state parameter.")
 
-        async with httpx.AsyncClient() as asynclient:
-            token_response = await asynclient.post(token_uri, data={
-                'grant_type': 'authorization_code',
-                'code': request.query_params.get("code"),
-                "authorization_response": request.url,
-                'redirect_uri': credentialSettings.REDIRECT_URI,
-                "include_client_id": True,  # This is another SMART-specific aspect, in case of a public client
-            })
-            token_response.raise_for_status()
+        smart_configuration = await get_smart_configuration()
+
+        asynclient = get_http_client()
+        token_response = await asynclient.post(smart_configuration["token_endpoint"], data={
+            'grant_type': 'authorization_code',
+            'code': request.query_params.get("code"),
+            "authorization_response": request.url,
+            'redirect_uri': credentialSettings.REDIRECT_URI,
+            "include_client_id": True,  # This is another SMART-specific aspect, in case of a public client
+        })
+        token_response.raise_for_status()
 
-            cookie["token"] = token_response.json()
+        cookie["token"] = token_response.json()
 
-            # Add token to the client object so that it can be used later
-            client.parse_request_body_response(json.dumps(token_response.json()))
+        # Add token to the client object so that it can be used later
+        client.parse_request_body_response(json.dumps(token_response.json()))
 
-            return RedirectResponse(url="/render_data")  # 重定向到數據渲染端點
+        return RedirectResponse(url="/render_data")  # 重定向到數據渲染端點
 
+    except HTTPException:
+        # 狀態錯誤 (400) 或取不到 SMART configuration (503) 照原狀態碼回應
+        raise
     except Exception as e:
         return {"error": f"An error occurred when obtaining an access token: {e}"}
 
 
 @app.get("/get_records", response_model=dict)
-async def get_records(request: Request):
+async def get_records(request: Request, fields: typing.Optional[str] = None, as_of: typing.Optional[str] = None):
+    """
+    `fields` (comma separated record fields or groups, e.g. `fields=patient` or `fields=HDL,LDL`)
+    returns only those, and fetches only the FHIR resources they come from.
+    `as_of` (a date or dateTime) returns the record as it stood then, see load_records_as_of.
+    """
+    if as_of is not None:
+        # Coded observations (smoking status) have no history, so they cannot be asked for as of a past time
+        as_of_fields = _history_fields(fields, AS_OF_FIELDS)
+        return display_record(await load_records_as_of(request, select_fields(as_of_fields), _time_param("as_of", as_of)))
+
+    selection = None if fields is None else select_fields(_requested_fields(fields, RECORD_FIELDS, RECORD_FIELD_GROUPS))
+
+    return display_record(await load_records(request, selection))
+
+
+def _requested_fields(fields, available, groups) -> typing.Tuple[str, ...]:
+    # Every field without a `fields=` parameter; a 400 for names that are neither fields nor groups
+    if fields is None:
+        return available
+
+    try:
+        return parse_fields(fields, available, groups)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _history_fields(fields, available) -> typing.Tuple[str, ...]:
+    # _requested_fields of fields with a history, with a clearer 400 for the coded ones (smoking status) that have none
+    for name in (fields or "").split(","):
+        coded = next((field for field in RECORD_FIELDS if field.lower() == name.strip().lower() and FIELD_OBSERVATIONS.get(field) in CODED_OBSERVATIONS), None)
+        if coded:
+            raise HTTPException(status_code=400, detail=f"{coded} is a coded observation and has no history")
+
+    return _requested_fields(fields, available, RECORD_FIELD_GROUPS)
+
+
+def _time_param(name, value) -> typing.Optional[float]:
+    # Seconds since the epoch of a date / dateTime query parameter; a 400 when it is not one
+    if value is None:
+        return None
 
+    try:
+        return parse_time(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a date or dateTime, e.g. 2020-05-01 or 2020-05-01T08:00:00Z")
+
+
+@memoize_per_request  # render_data -> get_calculations -> load_records reuses the first fetch
+async def load_records(request: Request, selection: typing.Optional[FieldSelection] = None):
+    """
+    The patient record behind get_records, with observation values kept as Quantity (see app.models.observation).
+    With a `selection` (sparse fieldset), only the resources it needs are fetched and only its fields returned.
+    """
     tokens = cookie.get("token")
 
     # 確保 token 是有效的
@@ -159,88 +263,285 @@ async def get_records(request: Request):
 
     patient_token = tokens['patient']
 
+    # Repeat views of the same chart within cacheSettings.RECORD_TTL cost no upstream calls
+    if cacheSettings.RECORD_CACHE_ENABLED:
+        cached_records = record_cache.get(credentialSettings.BASE_URL, patient_token)
+        if cached_records is not None:
+            return dict(cached_records) if selection is None else {field: cached_records[field] for field in selection.record_fields}
+
+    names = list(OBSERVATION_FIELDS) if selection is None else list(selection.observations)
+    patient = selection is None or selection.patient
+
     try:
-        patient_json = await get_fhir_json(patient_token, "Patient")
-        patient_result = await extract_patient_info(patient_json)
-
-        first_name = patient_result[0]
-        last_name = patient_result[1]
-        dob = patient_result[2]
-        age = patient_result[3]
-        gender = patient_result[4]
-        race = patient_result[5]
-        ethnicity = patient_result[6]
-
-        # Make concurrent requests to gather data
-        tasks = [
-            get_fhir_json(patient_token, "Observation", category="vital-signs", code="8302-2"),  # height 0
-            get_fhir_json(patient_token, "Observation", category="vital-signs", code="29463-7"),  # weight 1
-            get_fhir_json(patient_token, "Observation", category="vital-signs", code="39156-5"),  # BMI 2
-            get_fhir_json(patient_token, "Observation", category="vital-signs", code="55284-4"),  # BP 3
-            get_fhir_json(patient_token, "Observation", category="laboratory", code="2085-9"),  # HDL 4
-            get_fhir_json(patient_token, "Observation", category="laboratory", code="18262-6"),  # LDL 5
-            get_fhir_json(patient_token, "Observation", category="laboratory", code="2571-8"),  # triglyceride 6
-            get_fhir_json(patient_token, "Observation", category="laboratory", code="2093-3"),  # cholesterol 7
-            get_fhir_json(patient_token, "Observation", category="laboratory", code="38483-4"),  # serum creatinine 8
-            get_fhir_json(patient_token, "Observation", category="laboratory", code="2339-0"),  # blood glucose 9
-            get_fhir_json(patient_token, "Observation", category="survey", code="72166-2"),  # smoking satus 10
-        ]
-
-        # Wait for the tasks to complete
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-
-        # 检查是否有异常发生
-        for result in results:
-            if isinstance(result, Exception):
-                raise HTTPException(status_code=500, detail="Error fetching data")  # 可根据需要处理异常
-
-        height = await extract_height(results[0])
-        weight = await extract_weight(results[1])
-        bmi = await extract_bmi(results[2])
-        sbp, dbp = await extract_bp(results[3])
-        hdl = await extract_hdl (results[4])
-        ldl = await extract_ldl (results[5])
-        tg = await extract_tg (results[6])
-        chol = await extract_chol (results[7])
-        scr = await extract_scr (results[8])
-        glucose = await extract_glucose (results[9])
-        smoking = await extract_smoking_status (results[10])
+        # Patient plus one Bundle per observation (see OBSERVATION_CODES), fetched with the cheapest strategy the server supports;
+        # whatever misses the request deadline comes back as None and is shown as deadlineSettings.UNAVAILABLE
+        with deadline_scope(deadlineSettings.API):
+            patient_json, results = await fetch_patient_record(patient_token, names, patient)
+
+        records = await patient_fields(patient_json) if patient else {}
+        for name in names:
+            records.update(await observation_fields(name, results[name]))
 
     except Exception as e:
             return {"error": f"An error occurred when obtaining data for rendering: {exception_message(e)}"}
     
     try:
-        records = {
-            "Name": f"{first_name} {last_name}",
-            "Gender": gender,
-            "Race": race,
-            "Ethnicity": ethnicity,
-            "Date of Birth": dob,
-            "Age": age,
-            "Height": height,
-            "Weight": weight,
-            "BMI": bmi,
-            "Systolic BP": dbp,
-            "Diastolic BP": sbp,
-            "HDL": hdl,
-            "LDL": ldl,
-            "Triglycerides": tg, 
-            "Cholesterol": chol,
-            "Creatinine": scr,
-            "Glucose (blood sugar)": glucose,
-            "Tobacco Smoking Status": smoking,
-        }
-
-        return records  # Return the records as JSON response
+        # Partial records (and sparse fieldsets) are not cached, so the next view retries what was pending
+        if (patient and patient_json is None) or None in results.values():
+            metrics.inc("deadline.partial_records")
+            metrics.inc("deadline.unavailable_resources", (patient and patient_json is None) + sum(bundle is None for bundle in results.values()))
+        elif selection is None and cacheSettings.RECORD_CACHE_ENABLED:
+            record_cache.set(credentialSettings.BASE_URL, patient_token, dict(records))
+
+        if selection is not None:
+            metrics.inc("get_records.sparse_fieldsets")
+            metrics.inc("get_records.sparse_fieldsets.observations_skipped", len(OBSERVATION_FIELDS) - len(names))
+            return {field: records[field] for field in selection.record_fields}
+
+        return records
 
     except Exception as e:
         return {"error": f"An error occurred when obtaining records: {exception_message(e)}"}
 
 
+async def load_records_as_of(request: Request, selection: FieldSelection, as_of: float) -> dict:
+    """
+    The `selection` of the record as it stood at `as_of` (seconds since the epoch): each observation field is
+    its latest value at or before then, from load_history (so FHIR is not queried again while the histories
+    are kept), and Age is the age in that year. Only the fields of HISTORY_FIELD_GROUPS have a history (see AS_OF_FIELDS);
+    fields without a value by then read "No ... data found before ...".
+    """
+    tokens = cookie.get("token")
+    if not tokens:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+
+    records = {}
+    if selection.patient:
+        records = await load_records(request, select_fields(PATIENT_FIELDS))
+        if "error" in records:
+            return records
+
+        try:
+            records["Age"] = datetime.fromtimestamp(as_of, timezone.utc).year - int(records["Date of Birth"].split("-")[0])
+        except (AttributeError, ValueError):
+            pass  # no usable birth date: keep what extract_patient_info reported
+
+    try:
+        histories = await load_history(tokens['patient'], selection.observations)
+
+    except Exception as e:
+        return {"error": f"An error occurred when obtaining observation history: {exception_message(e)}"}
+
+    for name in selection.observations:
+        for field in OBSERVATION_FIELDS[name][0]:
+            series = histories.get(field)
+            point = series.as_of(as_of) if series is not None else None
+            if point is None:
+                records[field] = f"No {field} data found before {format_time(as_of)}"
+            else:
+                records[field] = Quantity(point.value, series.unit, format_time(point.time))
+
+    return {field: records[field] for field in selection.record_fields}
+
+
+async def iter_record_fields(patient_token, budget=None):
+    """
+    Yields the fields of get_records and then the rows of get_calculations, one RecordField at a time, as soon as each resolves.
+
+    The record is fetched with the strategy query_planner picks for get_records (see fetch_patient_record), so the stream
+    costs no more round trips than the page it replaces. With the per-code strategy the Patient and every observation are
+    independent responses and each is yielded as it lands, so a slow code only delays its own rows; with the others
+    (multi-code, batch, `_include`, `$everything`) the fields are yielded when the planned response arrives.
+    A calculation is yielded once every field it needs (CALCULATION_FIELDS) is known.
+    What is still missing after `budget` seconds, or fails, is yielded as deadlineSettings.UNAVAILABLE.
+    A cached record is replayed at once, and a complete one is stored in record_cache.
+    """
+    if cacheSettings.RECORD_CACHE_ENABLED:
+        cached_records = record_cache.get(credentialSettings.BASE_URL, patient_token)
+        if cached_records is not None:
+            for name, value in cached_records.items():
+                yield RecordField(RECORD_FIELD_GROUPS.get(name, "patient"), name, value)
+            for name, value in compute_calculations(cached_records).items():
+                yield RecordField("calculation", name, value)
+            return
+
+    # Tasks copy the current context, so every upstream call below shares this deadline
+    with deadline_scope(budget):
+        if await _planned_strategy() == "per-code":
+            tasks = {asyncio.ensure_future(get_fhir_json(patient_token, "Patient")): None}
+            for name in OBSERVATION_FIELDS:
+                tasks[asyncio.ensure_future(_fetch_per_code_bundles(patient_token, [name]))] = name
+        else:
+            tasks = {asyncio.ensure_future(fetch_patient_record(patient_token)): _WHOLE_RECORD}
+
+    records = {}
+    calculated = set()
+    complete = True
+    pending = set(tasks)
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                name = tasks[task]
+                if name is _WHOLE_RECORD:
+                    fields, received = await _whole_record_fields(task)
+                else:
+                    try:
+                        fhir_json = task.result() if name is None else task.result()[name]
+                        fields = await patient_fields(fhir_json) if name is None else await observation_fields(name, fhir_json)
+                    except Exception as e:
+                        system_logger.warning(f"Could not obtain {name or 'the patient'} for the record stream: {exception_message(e)}")
+                        fhir_json = None
+                        fields = await patient_fields(None) if name is None else await observation_fields(name, None)
+                    received = fhir_json is not None
+
+                complete = complete and received
+                records.update(fields)
+                for field, value in fields.items():
+                    yield RecordField(RECORD_FIELD_GROUPS[field], field, value)
+
+            ready = [name for name, needed in CALCULATION_FIELDS.items() if name not in calculated and all(field in records for field in needed)]
+            if ready:
+                calculations = compute_calculations(records)
+                for name in ready:
+                    calculated.add(name)
+                    yield RecordField("calculation", name, calculations[name])
+
+    finally:
+        # The client went away (or the consumer stopped early): nothing is waiting for the rest
+        for task in pending:
+            task.cancel()
+
+    if complete and cacheSettings.RECORD_CACHE_ENABLED:
+        record_cache.set(credentialSettings.BASE_URL, patient_token, {field: records[field] for field in RECORD_FIELDS})
+
+
+_WHOLE_RECORD = object()  # iter_record_fields task fetching the whole record with fetch_patient_record
+
+
+async def _planned_strategy() -> str:
+    # The strategy fetch_patient_record will start with (per-code when there is no time left to plan)
+    if not plannerSettings.ENABLED:
+        return fhirSettings.OBSERVATION_FETCH_MODE
+
+    try:
+        plan = await within_deadline(query_planner.plan(credentialSettings.BASE_URL, len(OBSERVATION_CODES)))
+    except DeadlineExceeded:
+        return "per-code"
+
+    return plan.strategy
+
+
+async def _whole_record_fields(task) -> typing.Tuple[dict, bool]:
+    # The record fields of a finished fetch_patient_record task, and whether every resource arrived
+    try:
+        patient_json, results = task.result()
+    except Exception as e:
+        system_logger.warning(f"Could not obtain the record for the record stream: {exception_message(e)}")
+        patient_json, results = None, dict.fromkeys(OBSERVATION_FIELDS)
+
+    received = patient_json is not None and None not in results.values()
+
+    # Like the per-code tasks, a resource that cannot be extracted only costs its own fields
+    try:
+        fields = await patient_fields(patient_json)
+    except Exception as e:
+        system_logger.warning(f"Could not obtain the patient for the record stream: {exception_message(e)}")
+        fields = await patient_fields(None)
+        received = False
+
+    for name in OBSERVATION_FIELDS:
+        try:
+            fields.update(await observation_fields(name, results[name]))
+        except Exception as e:
+            system_logger.warning(f"Could not obtain {name} for the record stream: {exception_message(e)}")
+            fields.update(await observation_fields(name, None))
+            received = False
+
+    return fields, received
+
+
+@app.get("/get_records/stream")
+async def stream_records(request: Request):
+    """
+    Server-Sent Events version of get_records + get_calculations for embedded frontends.
+
+    One event per field as soon as its FHIR fetch and extraction finish, named after its group
+    ("patient", "vital-signs", "laboratory", "survey" or "calculation"), with data
+    `{"field": ..., "value": ..., "elapsed_ms": ...}`; then a final "summary" event with the
+    time every field took, the total, and the fields that ended up deadlineSettings.UNAVAILABLE.
+    """
+    tokens = cookie.get("token")
+    if not tokens:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+
+    async def events():
+        started = time.perf_counter()
+        timings = {}
+        unavailable = []
+
+        async for field in iter_record_fields(tokens['patient'], deadlineSettings.API):
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            timings[field.name] = elapsed_ms
+            if field.value == deadlineSettings.UNAVAILABLE:
+                unavailable.append(field.name)
+
+            yield _sse_event(field.group, {"field": field.name, "value": display_value(field.value), "elapsed_ms": elapsed_ms})
+
+        total_ms = round((time.perf_counter() - started) * 1000, 1)
+        metrics.inc("get_records.stream.completed")
+        metrics.set_gauge("get_records.stream.last_total_ms", total_ms)
+
+        yield _sse_event("summary", {"total_ms": total_ms, "timings_ms": timings, "unavailable": unavailable})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _sse_event(event, data) -> bytes:
+    # json_dumps never emits a raw newline, so the payload always fits on one `data:` line
+    return b"event: " + event.encode() + b"\ndata: " + json_dumps(data) + b"\n\n"
+
+
+@app.delete("/get_records/cache")
+async def invalidate_records_cache(all_patients: bool = False):
+    """
+    Drops the cached record and observation histories of the current patient so the next view refetches them from FHIR.
+    `all_patients=true` drops every patient's, only when cacheSettings.ALLOW_CLEAR_ALL_PATIENTS is set.
+    """
+    tokens = cookie.get("token")
+    if not tokens:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+
+    if all_patients:
+        if not cacheSettings.ALLOW_CLEAR_ALL_PATIENTS:
+            raise HTTPException(status_code=403, detail="Clearing every patient's cache is disabled (cacheSettings.ALLOW_CLEAR_ALL_PATIENTS)")
+        dropped = record_cache.invalidate()
+        histories = history_store.invalidate()
+    else:
+        dropped = record_cache.invalidate(credentialSettings.BASE_URL, tokens['patient'])
+        histories = history_store.invalidate(credentialSettings.BASE_URL, tokens['patient'])
+
+    return {"invalidated": dropped, "histories": histories}
+
+
 @app.get("/get_calculations", response_model=dict)
-async def get_calculations(request: Request):
+async def get_calculations(request: Request, fields: typing.Optional[str] = None, as_of: typing.Optional[str] = None):
+    """
+    `fields` (comma separated rows, e.g. `fields=Creatinine Clearance`) computes only those rows,
+    and fetches only the record fields they are computed from.
+    `as_of` (a date or dateTime) computes them from the record as it stood then, see load_records_as_of.
+    """
+    rows = _requested_fields(fields, CALCULATION_ROWS, CALCULATION_GROUPS)
+    selection = None if fields is None else select_calculations(rows)
+    as_of_time = _time_param("as_of", as_of)
+
     try:
-        records_response = await get_records(request)
+        if as_of_time is not None:
+            records_response = await load_records_as_of(request, select_calculations(rows), as_of_time)
+        else:
+            records_response = await load_records(request, selection)
 
         if "error" in records_response:
             return templates.TemplateResponse("error.html", {"request": request, "error": records_response["error"]})
@@ -251,48 +552,532 @@ async def get_calculations(request: Request):
         return {"error": f"An error occurred when obtaining records: {exception_message(e)}"}
     
     try:
-        # Extract necessary fields from records
-        gender = records["Gender"]
-        height = records["Height"]  
-        weight = records["Weight"]
-        age = records["Age"]
-        scr = records.get("Creatinine")
-        glucose = records.get("Glucose (blood sugar)")
-        tg = records.get("Triglycerides")
-        hdl = records.get("HDL")
-
-        # Get calculation output
-        ibw = get_ibw_abw(gender, height, weight)[0]
-        abw = get_ibw_abw(gender, height, weight)[1]
-        actual_clcr = get_crcl(age, weight, gender, height, scr)[0]
-        adjusted_clcr = get_crcl(age, weight, gender, height, scr)[1] + "  " + get_crcl(age, weight, gender, height, scr)[3]
-        ost_risk = get_ost_index(weight, age, gender)[1]
-        ost_index = get_ost_index(weight, age, gender)[0]
-        t2d_risk = get_mets_ir(glucose, tg, weight, height, hdl)[1]
-        mets_ir = get_mets_ir(glucose, tg, weight, height, hdl)[0]
-
-        calculations = {
-            "Ideal Body Weight (IBW)": ibw,
-            "Adjusted Body Weight (ABW)": abw,
-            "Creatinine Clearance": actual_clcr,
-            "Creatinine Clearance (adjusted)": adjusted_clcr,
-            "Osteoporosis Risk": ost_risk,
-            "OST Index": ost_index,
-            "Risk of Developing T2D (METS-IR)": t2d_risk,
-            "METS-IR Value (Metabolic Score for Insulin Resistance)": mets_ir,
-        }
-
-        return calculations
+        return compute_calculations(records, rows)
     
     except Exception as e:
         return {"error": f"An error occurred when generating calculations: {exception_message(e)}"}
 
 
+async def fetch_patient_record(patient_token, names=None, patient=True):
+    """
+    取得 Patient 資源與每個觀察項目的 Bundle，策略由 query_planner 依服務器的 CapabilityStatement 決定。
+
+    失敗的策略會被降級 (直到下次更新 CapabilityStatement)，並改用次便宜的策略重試。
+
+    參數:
+    patient_token (str): 患者的認證令牌。
+    names (list, optional): 要取得的觀察項目 (OBSERVATION_CODES 的鍵)，預設為全部 (sparse fieldset 只取需要的)。
+    patient (bool, optional): 是否讀取 Patient 資源；為 False 時返回的 Patient 為 None。
+
+    請求的時間預算 (deadline_scope) 用完時不會拋出例外：來不及取得的 Patient 為 None，
+    來不及取得的觀察項目 Bundle 也為 None (頁面顯示為 deadlineSettings.UNAVAILABLE)。
+
+    返回:
+    tuple: (Patient JSON 或 None, {觀察項目名稱: Bundle 或 None})。
+    """
+    names = list(OBSERVATION_CODES) if names is None else list(names)
+
+    if not names:
+        # Only demographics: no Observation search at all
+        return (await _unless_expired(get_fhir_json(patient_token, "Patient")) if patient else None), {}
+
+    if not plannerSettings.ENABLED:
+        try:
+            return await _fetch_with_strategy(patient_token, names, fhirSettings.OBSERVATION_FETCH_MODE, patient=patient)
+        except DeadlineExceeded:
+            return None, dict.fromkeys(names)
+
+    iss = credentialSettings.BASE_URL
+
+    while True:
+        try:
+            plan = await within_deadline(query_planner.plan(iss, len(names)))
+        except DeadlineExceeded:
+            return None, dict.fromkeys(names)
+
+        counter = [0]
+        token = fhir_round_trips.set(counter)
+
+        try:
+            patient_json, results = await _fetch_with_strategy(patient_token, names, plan.strategy, fallback=False, patient=patient)
+        except DeadlineExceeded:
+            # Running out of time says nothing about the strategy, so it is not demoted
+            return None, dict.fromkeys(names)
+        except Exception as e:
+            # An error response, or one the strategy cannot read (e.g. batch entries without a resource)
+            if plan.strategy == "per-code":
+                raise
+            system_logger.warning(f"get_records strategy '{plan.strategy}' failed: {exception_message(e)}")
+            query_planner.report_failure(iss, plan.strategy)
+            continue
+        finally:
+            fhir_round_trips.reset(token)
+
+        query_planner.report_result(iss, plan, counter[0])
+        uvicorn_logger.info(f"get_records used '{plan.strategy}' with {counter[0]} round trips (planned {plan.round_trips})")
+
+        return patient_json, results
+
+
+async def _fetch_with_strategy(patient_token, names, strategy, fallback=True, patient=True):
+    if strategy == "batch":
+        return await _fetch_batch(patient_token, names, patient)
+
+    if strategy == "include":
+        return await _fetch_with_include(patient_token, names, patient)
+
+    if strategy == "everything":
+        return await _fetch_everything(patient_token, names, patient)
+
+    observations = _unless_expired(fetch_observation_bundles(patient_token, names=names, mode=strategy, fallback=fallback), dict.fromkeys(names))
+    if not patient:
+        return None, await observations
+
+    patient_json, results = await asyncio.gather(_unless_expired(get_fhir_json(patient_token, "Patient")), observations)
+
+    return patient_json, results
+
+
+async def _unless_expired(awaitable, default=None):
+    # What did not arrive before the request deadline is left out instead of failing the whole record
+    try:
+        return await awaitable
+    except DeadlineExceeded:
+        return default
+
+
+async def _fetch_batch(patient_token, names, patient=True, project=True):
+    # One batch Bundle carrying the Patient read (unless not needed) and every Observation search
+    latest = f"&_count={fhirSettings.LATEST_PAGE_SIZE}" + (f"&_sort={fhirSettings.SEARCH_SORT}" if fhirSettings.SEARCH_SORT else "")
+    latest += "".join(f"&{param}" for param in projection_params(credentialSettings.BASE_URL, "Observation") if project)
+    patient_projection = "&".join(projection_params(credentialSettings.BASE_URL, "Patient") if project else [])
+    patient_entries = [{"request": {"method": "GET", "url": f"Patient/{patient_token}" + (f"?{patient_projection}" if patient_projection else "")}}] if patient else []
+    batch_entries = patient_entries + [
+        {"request": {"method": "GET", "url": f"Observation?patient={patient_token}&category={OBSERVATION_CODES[name]['category']}&code={OBSERVATION_CODES[name]['code']}{latest}"}}
+        for name in names
+    ]
+    batch = {"resourceType": "Bundle", "type": "batch", "entry": batch_entries}
+
+    response = await fetch_fhir_url(credentialSettings.BASE_URL, method="POST", body=json.dumps(batch))
+
+    entries = response.get("entry", [])
+    if response.get("type") != "batch-response" or len(entries) != len(batch_entries):
+        raise HTTPException(status_code=502, detail="Unexpected batch response from FHIR server")
+
+    for entry in entries:
+        status = str(entry.get("response", {}).get("status", ""))
+        if status.startswith("400") and is_projected(latest + patient_projection):
+            # Only blame the projection when the same batch without it goes through
+            fetched = await _fetch_batch(patient_token, names, patient, project=False)
+            reject_projection(credentialSettings.BASE_URL, latest + patient_projection)
+            return fetched
+        if not status.startswith("200"):
+            raise HTTPException(status_code=502, detail=f"Batch entry failed with status {entry.get('response', {}).get('status')}")
+        if not isinstance(entry.get("resource"), dict):
+            raise HTTPException(status_code=502, detail="Batch entry succeeded without a resource")
+
+    patient_json = entries[0]["resource"] if patient else None
+
+    return patient_json, {name: entry["resource"] for name, entry in zip(names, entries[len(patient_entries):])}
+
+
+async def _fetch_with_include(patient_token, names, patient=True):
+    codes = [OBSERVATION_CODES[name]["code"] for name in names]
+    entries, truncated = await _search_observation_entries(patient_token, codes, include="Observation:patient" if patient else None)
+
+    bundles_by_code = demultiplex_observations(entries, codes)
+    results = {name: bundles_by_code[OBSERVATION_CODES[name]["code"]] for name in names}
+
+    missing = [name for name in names if truncated and results[name]["total"] == 0]
+    if missing:
+        results.update(await _fetch_per_code_bundles(patient_token, missing))
+
+    if not patient:
+        return None, results
+
+    patient_json = next((entry["resource"] for entry in entries if entry.get("resource", {}).get("resourceType") == "Patient"), None)
+    if patient_json is None:
+        # Nothing to `_include` from when the patient has none of the observations
+        patient_json = await _unless_expired(get_fhir_json(patient_token, "Patient"))
+
+    return patient_json, results
+
+
+async def _fetch_everything(patient_token, names, patient=True):
+    # Stream Patient/$everything page by page, keeping only the Patient and the latest Observation per code
+    codes = {OBSERVATION_CODES[name]["code"]: name for name in names}
+    latest = {}
+    patient_json = None
+
+    def prefilter(raw):
+        # Cheap text check so unrelated resources are never decoded
+        return '"Patient"' in raw or any(f'"{code}"' in raw for code in codes)
+
+    def keep(entry):
+        resource = entry.get("resource", {})
+        if resource.get("resourceType") == "Patient":
+            return resource.get("id") == patient_token
+        return match_observation_code(resource, codes) is not None
+
+    next_url = f"{credentialSettings.BASE_URL}/Patient/{patient_token}/$everything?_type={fhirSettings.EVERYTHING_TYPES}&_count={fhirSettings.EVERYTHING_PAGE_SIZE}"
+    pages = 0
+
+    while next_url and next_url.startswith(credentialSettings.BASE_URL) and pages < fhirSettings.EVERYTHING_MAX_PAGES:
+        parser = BundleEntryParser(keep=keep, prefilter=prefilter)
+
+        async for entry in stream_fhir_bundle(next_url, parser):
+            resource = entry["resource"]
+            if resource["resourceType"] == "Patient":
+                patient_json = resource
+                continue
+
+            name = codes[match_observation_code(resource, codes)]
+            if name not in latest or observation_timestamp(resource) > observation_timestamp(latest[name]["resource"]):
+                latest[name] = entry
+
+        next_url = get_next_link(parser.skeleton)
+        pages += 1
+        metrics.inc("fhir.everything.entries_seen", parser.entries_seen)
+        metrics.inc("fhir.everything.entries_kept", parser.entries_kept)
+
+    metrics.inc("fhir.everything.pages", pages)
+
+    results = {name: searchset_bundle([latest[name]] if name in latest else []) for name in names}
+
+    missing = [name for name in names if next_url and name not in latest]
+    if missing:
+        results.update(await _fetch_per_code_bundles(patient_token, missing))
+
+    if not patient:
+        return None, results
+
+    if patient_json is None:
+        patient_json = await _unless_expired(get_fhir_json(patient_token, "Patient"))
+
+    return patient_json, results
+
+
+async def fetch_observation_bundles(patient_token, names=None, mode=None, fallback=True) -> dict:
+    """
+    取得 OBSERVATION_CODES 中每個觀察項目的 Bundle。
+
+    "multi-code" 模式以單一 `code=a,b,c` 搜尋取得所有觀察，再依 LOINC 代碼分組；
+    若服務器拒絕 OR 搜尋，則退回 "per-code" 模式 (每個代碼一個請求)。
+
+    參數:
+    patient_token (str): 患者的認證令牌。
+    names (list, optional): 要取得的觀察項目名稱，預設為 OBSERVATION_CODES 全部。
+    mode (str, optional): "multi-code" 或 "per-code"，預設為 fhirSettings.OBSERVATION_FETCH_MODE。
+    fallback (bool, optional): multi-code 搜尋失敗時是否自動改用 per-code (否則拋出 HTTPException)。
+
+    返回:
+    dict: {觀察項目名稱: Bundle}，例如 {"height": {...}, "weight": {...}}。
+    """
+    mode = mode or fhirSettings.OBSERVATION_FETCH_MODE
+    names = names or list(OBSERVATION_CODES)
+
+    if mode == "multi-code":
+        try:
+            bundles_by_code, truncated = await _fetch_multi_code_bundles(patient_token, [OBSERVATION_CODES[name]["code"] for name in names])
+            metrics.inc("fhir.observations.multi_code_searches")
+
+            results = {name: bundles_by_code[OBSERVATION_CODES[name]["code"]] for name in names}
+
+            # Codes that did not show up before we stopped paging are fetched one by one
+            missing = [name for name in names if truncated and results[name]["total"] == 0]
+            if missing:
+                results.update(await _fetch_per_code_bundles(patient_token, missing))
+
+            return results
+
+        except HTTPException as e:
+            if not fallback:
+                raise
+            system_logger.warning(f"Multi-code Observation search failed, falling back to per-code searches: {exception_message(e)}")
+            metrics.inc("fhir.observations.multi_code_fallbacks")
+
+    return await _fetch_per_code_bundles(patient_token, names)
+
+
+async def _fetch_multi_code_bundles(patient_token, codes):
+    entries, truncated = await _search_observation_entries(patient_token, codes)
+
+    return demultiplex_observations(entries, codes), truncated
+
+
+async def _search_observation_entries(patient_token, codes, include=None):
+    search = ObservationSearch(
+        patient_token,
+        code=",".join(codes),
+        count=fhirSettings.MULTI_CODE_PAGE_SIZE,
+        include=include,
+        max_pages=fhirSettings.MULTI_CODE_MAX_PAGES,
+        # Skip anything that is neither a requested code nor the `_include`d Patient (e.g. OperationOutcome warnings)
+        prefilter=lambda raw: '"Patient"' in raw or any(f'"{code}"' in raw for code in codes),
+    )
+    entries = [entry async for entry in search]
+
+    metrics.inc("fhir.observations.multi_code_pages", search.pages)
+
+    return entries, search.truncated
+
+
+class ObservationSearch():
+    """
+    以 async generator 逐頁串流 Observation 搜尋結果 (跟隨 Bundle 的 `next` 連結)。
+
+    搜尋預設帶有 `_sort=-date` (最新的在前) 與 `_count`，呼叫端可以隨時 `break` 提前結束，
+    不會請求多餘的分頁；歷史查詢也不需要一次把所有結果載入記憶體。
+
+    參數:
+    patient_token (str): 患者的認證令牌。
+    category (str, optional): 觀察類別，例如 'vital-signs'。
+    code (str, optional): LOINC 代碼，多個代碼以逗號分隔。
+    count (int, optional): 每頁筆數 (_count)，預設為 fhirSettings.SEARCH_PAGE_SIZE。
+    sort (str, optional): 伺服器端排序 (_sort)，預設為 fhirSettings.SEARCH_SORT。
+    include (str, optional): 一併回傳的關聯資源 (_include)。
+    max_pages (int, optional): 最多讀取的頁數，預設不限。
+    keep (callable, optional): keep(entry) 為 False 的 entry 會被略過。
+    prefilter (callable, optional): 串流模式下 prefilter(raw_json_text) 為 False 的 entry 不會被解碼。
+
+    fhirSettings.STREAM_BUNDLES 開啟時，每一頁都以 BundleEntryParser 邊下載邊解析，
+    一次只保留一筆 entry，大型 Bundle 的記憶體用量維持固定。
+
+    用法示例:
+    async for entry in ObservationSearch(patient_token, code="8302-2"):
+        ...
+    latest = await ObservationSearch(patient_token, code="8302-2", count=1).first()
+    """
+
+    def __init__(self, patient_token, category=None, code=None, count=None, sort=None, include=None, max_pages=None, keep=None, prefilter=None):
+        self.patient_token = patient_token
+        self.category = category
+        self.code = code
+        self.count = count or fhirSettings.SEARCH_PAGE_SIZE
+        self.sort = sort or fhirSettings.SEARCH_SORT
+        self.include = include
+        self.max_pages = max_pages
+        self.keep = keep
+        self.prefilter = prefilter
+
+        self.pages = 0
+        self.total = None
+        self.next_url = None
+        self.exhausted = False
+
+    @property
+    def truncated(self) -> bool:
+        # True when we stopped before the last page (max_pages or an early break)
+        return not self.exhausted
+
+    async def __aiter__(self):
+        full_url = build_fhir_url(self.patient_token, "Observation", category=self.category, code=self.code, count=self.count, include=self.include, sort=self.sort)
+        url = with_projection(full_url, "Observation")
+        rejected_url = None  # projected first page that got a 400, pending the retry without projection
+
+        while True:
+            if fhirSettings.STREAM_BUNDLES:
+                parser = BundleEntryParser(keep=self.keep, prefilter=self.prefilter)
+                yielded = False
+
+                try:
+                    async for entry in stream_fhir_bundle(url, parser):
+                        yielded = True
+                        yield entry
+                except HTTPException as e:
+                    # The first page may be rejected because of the projection: retry it without,
+                    # and demote the projection only if that goes through
+                    if self.pages or yielded or e.status_code != 400 or not is_projected(url):
+                        raise
+                    rejected_url, url = url, full_url
+                    continue
+
+                if rejected_url is not None:
+                    reject_projection(credentialSettings.BASE_URL, rejected_url)
+                    rejected_url = None
+
+                bundle = parser.skeleton
+                metrics.set_gauge("fhir.stream.max_entry_chars", max(parser.max_entry_chars, metrics.get("fhir.stream.max_entry_chars")))
+
+            else:
+                if self.pages:
+                    bundle = await fetch_fhir_url(url)
+                else:
+                    bundle = await get_fhir_json(self.patient_token, "Observation", category=self.category, code=self.code, count=self.count, include=self.include, sort=self.sort)
+
+                for entry in bundle.get("entry", []):
+                    if self.keep is None or self.keep(entry):
+                        yield entry
+
+            if bundle.get("resourceType") != "Bundle":
+                # e.g. an OperationOutcome from a server that rejects the search
+                raise HTTPException(status_code=400, detail=f"Observation search returned {bundle.get('resourceType')}")
+
+            self.pages += 1
+            self.total = bundle.get("total", self.total)
+            self.next_url = url = get_next_link(bundle)
+
+            if not self.next_url:
+                self.exhausted = True
+                return
+            if not self.next_url.startswith(credentialSettings.BASE_URL):
+                return
+            if self.max_pages is not None and self.pages >= self.max_pages:
+                return
+
+    async def first(self) -> typing.Optional[dict]:
+        """
+        Returns the first entry (the latest one with the default sort), fetching a single page.
+        """
+        entries = self.__aiter__()
+        try:
+            async for entry in entries:
+                return entry
+        finally:
+            await entries.aclose()
+
+        return None
+
+
+async def _fetch_per_code_bundles(patient_token, names):
+    # Make concurrent requests to gather data
+    # Only the latest value of each code is needed: one small, newest-first page per code
+    tasks = [
+        get_fhir_json(
+            patient_token,
+            "Observation",
+            category=OBSERVATION_CODES[name]["category"],
+            code=OBSERVATION_CODES[name]["code"],
+            count=fhirSettings.LATEST_PAGE_SIZE,
+            sort=fhirSettings.SEARCH_SORT,
+        )
+        for name in names
+    ]
+
+    # Wait for the tasks to complete
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    metrics.inc("fhir.observations.per_code_searches", len(tasks))
+
+    # 检查是否有异常发生
+    for result in results:
+        if isinstance(result, Exception) and not isinstance(result, DeadlineExceeded):
+            raise HTTPException(status_code=500, detail="Error fetching data")  # 可根据需要处理异常
+
+    # Codes that missed the request deadline are left as None (shown as pending / unavailable)
+    return {name: None if isinstance(result, DeadlineExceeded) else result for name, result in zip(names, results)}
+
+
+async def load_history(patient_token, names) -> typing.Dict[str, TimeSeries]:
+    """
+    {record field: TimeSeries} of the OBSERVATION_FIELDS entries `names`, with every value of their codes.
+    Histories are kept in history_store; the missing ones are searched concurrently, one paged search per code.
+    """
+    histories = {}
+    missing = []
+
+    for name in names:
+        cached = history_store.get(credentialSettings.BASE_URL, patient_token, name)
+        if cached is None:
+            missing.append(name)
+        else:
+            histories.update(cached)
+
+    if missing:
+        fetched = await asyncio.gather(*(_fetch_history(patient_token, name) for name in missing))
+        for name, series in zip(missing, fetched):
+            history_store.set(credentialSettings.BASE_URL, patient_token, name, series)
+            histories.update(series)
+
+    return histories
+
+
+async def _fetch_history(patient_token, name) -> typing.Dict[str, TimeSeries]:
+    # Every Observation of the code goes through the same extractor as the latest one, so a value
+    # in the history reads exactly as get_records would have shown it
+    search = ObservationSearch(
+        patient_token,
+        category=OBSERVATION_CODES[name]["category"],
+        code=OBSERVATION_CODES[name]["code"],
+        count=historySettings.PAGE_SIZE,
+        max_pages=historySettings.MAX_PAGES,
+        keep=lambda entry: entry.get("resource", {}).get("resourceType") == "Observation",
+    )
+
+    quantities = []
+    async for entry in search:
+        fields = await observation_fields(name, searchset_bundle([entry]))
+        quantities.extend(fields.items())
+
+    metrics.inc("history.searches")
+    metrics.inc("history.observations", len(quantities))
+    if search.truncated:
+        metrics.inc("history.truncated_searches")
+
+    return build_series(quantities)
+
+
+@app.get("/get_observations/history", response_model=dict)
+async def get_observation_history(
+    request: Request,
+    fields: typing.Optional[str] = None,
+    start: typing.Optional[str] = None,
+    end: typing.Optional[str] = None,
+    buckets: typing.Optional[int] = None,
+):
+    """
+    Every value of the numeric observation fields (or of `fields=`) between `start` and `end`, oldest first,
+    for trend charts: `{field: {"unit": ..., "points": [{"time": ..., "value": ...}, ...]}}`.
+
+    With `buckets`, each field is downsampled to the min / max / mean of that many equal time spans instead
+    (`"buckets": [{"start", "end", "count", "min", "max", "mean"}, ...]`, empty spans left out).
+    Repeated views are served from history_store without querying FHIR.
+    """
+    tokens = cookie.get("token")
+    if not tokens:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+
+    history_fields = _history_fields(fields, tuple(HISTORY_FIELD_GROUPS))
+    start_time = _time_param("start", start)
+    end_time = _time_param("end", end)
+    if buckets is not None and not 1 <= buckets <= historySettings.MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"buckets must be between 1 and {historySettings.MAX_BUCKETS}")
+
+    try:
+        histories = await load_history(tokens['patient'], select_fields(history_fields).observations)
+
+    except Exception as e:
+        return {"error": f"An error occurred when obtaining observation history: {exception_message(e)}"}
+
+    result = {}
+    for field in history_fields:
+        series = histories.get(field) or TimeSeries(None)
+
+        if buckets is None:
+            result[field] = {
+                "unit": series.unit,
+                "points": [{"time": format_time(point.time), "value": point.value} for point in series.between(start_time, end_time)],
+            }
+        else:
+            result[field] = {
+                "unit": series.unit,
+                "buckets": [
+                    {**bucket._asdict(), "start": format_time(bucket.start), "end": format_time(bucket.end)}
+                    for bucket in series.downsample(buckets, start_time, end_time)
+                ],
+            }
+
+    return result
+
+
 ### 5. 完成授權流程、渲染資料
 @app.get("/render_data", response_class=HTMLResponse)
-async def render_data(request: Request):
-    # Fetch the records using the get_records function
-    records_response = await get_records(request)
+async def render_data(request: Request, stream: typing.Optional[bool] = None):
+    if renderSettings.STREAM if stream is None else stream:
+        return render_data_stream(request)
+
+    # Fetch the records using the load_records function, within the page's time budget
+    with deadline_scope(deadlineSettings.RENDER_DATA):
+        records_response = await load_records(request)
 
     if "error" in records_response:
         return templates.TemplateResponse("error.html", {"request": request, "error": records_response["error"]})
@@ -306,14 +1091,58 @@ async def render_data(request: Request):
         return templates.TemplateResponse("error.html", {"request": request, "error": calculations_response["error"]})
 
     calculations = calculations_response
-    output = templates.TemplateResponse(name="render_data.html", context={"request": request, "data": records, "calc_data": calculations})
+    output = templates.TemplateResponse(name="render_data.html", context={"request": request, "data": display_record(records), "calc_data": calculations})
 
     return output
 
 
+STREAM_MARKER = "<!-- render_data: rows are streamed from here -->"
+
+
+def render_data_stream(request: Request):
+    """
+    Progressive render_data: the page shell, with a placeholder in every row, is flushed immediately;
+    each row is then filled in by a small `fill()` script chunk as soon as its data resolves (iter_record_fields).
+    """
+    tokens = cookie.get("token")
+    if not tokens:
+        return templates.TemplateResponse("error.html", {"request": request, "error": "User not authenticated"})
+
+    page = templates.TemplateResponse(name="render_data.html", context={
+        "request": request,
+        "data": dict.fromkeys(RECORD_FIELDS, renderSettings.PLACEHOLDER),
+        "calc_data": dict.fromkeys(CALCULATION_FIELDS, renderSettings.PLACEHOLDER),
+        "streaming": True,
+        "stream_marker": STREAM_MARKER,
+    }).body.decode()
+    shell, tail = page.split(STREAM_MARKER)
+
+    async def chunks():
+        started = time.perf_counter()
+        yield shell
+
+        first = True
+        async for field in iter_record_fields(tokens['patient'], deadlineSettings.RENDER_DATA_STREAM):
+            yield f"<script>fill({_script_json(field.name)}, {_script_json(display_value(field.value))})</script>\n"
+            if first:
+                metrics.set_gauge("render_data.stream.first_row_ms", round((time.perf_counter() - started) * 1000, 1))
+                first = False
+
+        metrics.set_gauge("render_data.stream.complete_ms", round((time.perf_counter() - started) * 1000, 1))
+        yield tail
+
+    # X-Accel-Buffering stops reverse proxies (nginx) from holding the chunks back
+    return StreamingResponse(chunks(), media_type="text/html", headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+
+def _script_json(value) -> str:
+    # JSON that is safe inside an inline <script> (no "</script>" or HTML comment can be formed)
+    return json.dumps(value).replace("<", "\\u003c").replace(">", "\\u003e").replace("&", "\\u0026")
+
+
 ## [GET]: Get fhir json
 @app.get("/fhir-json", tags=["Get FHIR Json"])
-async def get_fhir_json(patient_token, resource_type, category=None, code=None) -> dict:
+async def get_fhir_json(patient_token, resource_type, category=None, code=None, count=None, include=None, sort=None) -> dict:
     """
      獲取 FHIR JSON 資源。
 
@@ -323,7 +1152,10 @@ async def get_fhir_json(patient_token, resource_type, category=None, code=None)
     patient_token (str): 患者的認證令牌，例如 'bc6c8e2a-63de-4790-94af-fcab57874c21'。
     resource_type (str): FHIR 資源類型，目前只支援 'Patient' 或 'Observation'。
     category (str, optional): 觀察類別，例如 'vital-signs', 'laboratory' 或 'survey'。僅用於 Observation 資源。
-    code (str, optional): 觀察的具體代碼，例如 '8302-2' 表示身高。僅用於 Observation 資源。
+    code (str, optional): 觀察的具體代碼，例如 '8302-2' 表示身高；多個代碼以逗號分隔 (OR 搜尋)。僅用於 Observation 資源。
+    count (int, optional): 每頁回傳的筆數 (_count)。僅用於 Observation 資源。
+    include (str, optional): 一併回傳的關聯資源 (_include)，例如 'Observation:patient'。僅用於 Observation 資源。
+    sort (str, optional): 伺服器端排序 (_sort)，例如 '-date' 表示最新的在前。僅用於 Observation 資源。
 
     返回:
     dict: 包含請求的 FHIR 資源的 JSON 數據。
@@ -337,6 +1169,32 @@ async def get_fhir_json(patient_token, resource_type, category=None, code=None)
     fhir_json = await get_fhir_json(patient_token, "Patient")
     fhir_json = await get_fhir_json(patient_token, "Observation", "vital-signs", "8302-2")
     """
+    full_url = build_fhir_url(patient_token, resource_type, category=category, code=code, count=count, include=include, sort=sort)
+
+    # 只請求 extractor 需要的欄位 (PROJECTION_PROFILES)；伺服器拒絕時退回完整資源
+    projected_url = with_projection(full_url, resource_type)
+
+    try:
+        return await fetch_fhir_url(projected_url)
+    except HTTPException as e:
+        if e.status_code != 400 or not is_projected(projected_url):
+            raise
+
+    # A 400 may have nothing to do with the projection (an OR search, a `_sort` the server does not support, ...):
+    # the projection is only demoted (to `_summary`, then none) when the same request without it succeeds
+    fhir_json = await fetch_fhir_url(full_url)
+    reject_projection(credentialSettings.BASE_URL, projected_url)
+
+    return fhir_json
+
+
+def build_fhir_url(patient_token, resource_type, category=None, code=None, count=None, include=None, sort=None) -> str:
+    """
+    組出 get_fhir_json 的請求 URL (參數同 get_fhir_json，不含 payload projection)。
+
+    raises:
+    ValueError: 如果參數無效或使用不當。
+    """
     if not patient_token:
         raise ValueError("patient_token cannot be empty")
 
@@ -355,6 +1213,12 @@ async def get_fhir_json(patient_token, resource_type, category=None, code=None)
             params.append(f"category={category}")
         if code:
             params.append(f"code={code}")
+        if count:
+            params.append(f"_count={count}")
+        if include:
+            params.append(f"_include={include}")
+        if sort:
+            params.append(f"_sort={sort}")
 
         query_string = "&".join(params)  
         full_url = f"{base_url}?{query_string}"
@@ -362,11 +1226,87 @@ async def get_fhir_json(patient_token, resource_type, category=None, code=None)
     elif resource_type == 'Patient':
         full_url = f"{base_url}/{patient_token}"
 
+    return full_url
+
+
+def with_projection(full_url, resource_type) -> str:
+    projection = projection_params(credentialSettings.BASE_URL, resource_type)
+    if not projection:
+        return full_url
+
+    return f"{full_url}{'&' if '?' in full_url else '?'}{'&'.join(projection)}"
+
+
+async def fetch_fhir_url(full_url, method="GET", body=None) -> dict:
+    """
+    以認證令牌請求一個完整的 FHIR URL (例如 get_fhir_json 組好的查詢，或 Bundle 的 `next` 分頁連結)。
+
+    參數:
+    full_url (str): FHIR 服務器上的完整 URL，必須以 credentialSettings.BASE_URL 開頭。
+    method (str, optional): HTTP 方法，預設 'GET'；batch Bundle 使用 'POST'。
+    body (str, optional): 請求內容 (FHIR JSON 字串)，僅用於 POST。
+
+    返回:
+    dict: FHIR JSON 資料。
+
+    raises:
+    ValueError: 如果 URL 不屬於已註冊的 FHIR 服務器 (避免把令牌送到其他主機)。
+    HTTPException: 如果 API 請求失敗。
+    DeadlineExceeded: 如果請求的時間預算 (deadline_scope) 在回應前用完。
+    """
+    if not full_url.startswith(credentialSettings.BASE_URL):
+        raise ValueError(f"Refusing to send the access token to a URL outside {credentialSettings.BASE_URL}")
+
+    if method == "GET" and fhirSettings.COALESCE_REQUESTS:
+        # Keyed by the token too, so a call is never answered with data fetched under another user's scope.
+        # The shared fetch runs without any caller's deadline or round-trip counter: each caller waits
+        # within its own budget and is charged the round trips the fetch took
+        fhir_json, round_trips = await within_deadline(
+            fhir_requests.do((full_url, token_scope()), lambda: _shared_fetch(full_url), context=without_deadline())
+        )
+        counter = fhir_round_trips.get()
+        if counter is not None:
+            counter[0] += round_trips
+
+        return fhir_json
+
+    return await within_deadline(_fetch_fhir_url(full_url, method, body))
+
+
+async def _shared_fetch(full_url) -> typing.Tuple[dict, int]:
+    # Runs in its own context (see SingleFlight), so this counter is the fetch's own
+    counter = [0]
+    fhir_round_trips.set(counter)
+
+    return await _fetch_fhir_url(full_url), counter[0]
+
+
+def token_scope() -> str:
+    # Who a response was fetched for: a digest of the access token (never the token itself)
+    return hashlib.sha256((client.access_token or "").encode()).hexdigest()
+
+
+async def _fetch_fhir_url(full_url, method="GET", body=None) -> dict:
+    headers = {"Accept": "application/fhir+json"}
+    if body is not None:
+        headers["Content-Type"] = "application/fhir+json"
+
+    # Stale responses we still hold (for this token) are revalidated with If-None-Match / If-Modified-Since
+    cache_key = (full_url, token_scope())
+    cached = conditional_cache.lookup(cache_key) if method == "GET" else None
+    if cached is not None:
+        if conditional_cache.is_fresh(cached):
+            metrics.inc("response_cache.fresh_hits")
+            return cached.body
+        headers.update(conditional_cache.revalidation_headers(cached))
+
     # 添加認證令牌
     try:
-        uri, headers, _ = client.add_token(
+        uri, headers, body = client.add_token(
             full_url,
-            headers={"Accept": "application/fhir+json"}
+            http_method=method,
+            body=body,
+            headers=headers
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding token: {exception_message(e)}")
@@ -374,20 +1314,38 @@ async def get_fhir_json(patient_token, resource_type, category=None, code=None)
     # 發送 HTTP 請求並獲取數據
     try:
         # Getting data in the way prescribed by OAuthLib package
-        async with httpx.AsyncClient() as asynclient:
-            # response = await asynclient.get(uri, headers=headers, data=body, timeout=10)
-            response = await asynclient.get(uri, headers=headers, timeout=10)
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="Failed to load patient data.")
+        # Shared, pooled client (see app/middleware/http_client.py); timeouts come from httpClientSettings
+        # GETs are retried / hedged and every host sits behind a circuit breaker (see resilienceSettings)
+        asynclient = get_http_client()
+        response = await resilient_send(lambda: asynclient.request(method, uri, headers=headers, content=body), uri, method)
 
-            fhir_json = response.json()
+        counter = fhir_round_trips.get()
+        if counter is not None:
+            counter[0] += 1
 
-    except httpx.RequestError as e:
-        system_logger.error(f"HTTP request failed: {exception_message(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to connect to FHIR server: {exception_message(e)}")
+        if response.status_code == 304 and cached is not None:
+            return conditional_cache.not_modified(cache_key, cached, response)
+
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail="Failed to load patient data.")
+
+        decode_started = time.perf_counter()
+        fhir_json = json_loads(response.content)  # raw bytes, decoded by the configured JSON backend
+        record_payload(full_url, len(response.content), time.perf_counter() - decode_started)
+
+        if method == "GET":
+            conditional_cache.store(cache_key, response, fhir_json)
+
+    except (HTTPException, DeadlineExceeded):
+        raise
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"FHIR server is unavailable: {exception_message(e)}")
     except httpx.TimeoutException:
         system_logger.error("Request to FHIR server timed out")
         raise HTTPException(status_code=504, detail="Request to FHIR server timed out")
+    except httpx.RequestError as e:
+        system_logger.error(f"HTTP request failed: {exception_message(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to connect to FHIR server: {exception_message(e)}")
     except json.JSONDecodeError as e:
         system_logger.error(f"Failed to decode JSON response: {exception_message(e)}")
         raise HTTPException(status_code=500, detail="Received invalid JSON from FHIR server")
@@ -398,6 +1356,67 @@ async def get_fhir_json(patient_token, resource_type, category=None, code=None)
     return fhir_json
 
 
+async def stream_fhir_bundle(full_url, parser):
+    """
+    以認證令牌請求一個回傳 Bundle 的 FHIR URL，並在資料串流進來時逐筆產生 entry (見 BundleEntryParser)。
+
+    參數:
+    full_url (str): FHIR 服務器上的完整 URL，必須以 credentialSettings.BASE_URL 開頭。
+    parser (BundleEntryParser): 決定保留哪些 entry；讀取完畢後 parser.skeleton 為不含 entry 的 Bundle。
+
+    raises:
+    ValueError: 如果 URL 不屬於已註冊的 FHIR 服務器。
+    HTTPException: 如果 API 請求失敗。
+    DeadlineExceeded: 如果請求的時間預算在讀取完畢前用完。
+    """
+    if not full_url.startswith(credentialSettings.BASE_URL):
+        raise ValueError(f"Refusing to send the access token to a URL outside {credentialSettings.BASE_URL}")
+
+    try:
+        uri, headers, _ = client.add_token(full_url, headers={"Accept": "application/fhir+json"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error adding token: {exception_message(e)}")
+
+    counter = fhir_round_trips.get()
+    if counter is not None:
+        counter[0] += 1
+
+    try:
+        # Only opening the stream is retried / hedged: entries already yielded cannot be taken back
+        asynclient = get_http_client()
+        # Reads of the body are capped by what is left of the request deadline as well
+        response = await resilient_send(lambda: asynclient.send(asynclient.build_request("GET", uri, headers=headers, timeout=request_timeout()), stream=True), uri)
+
+        try:
+            if response.status_code != 200:
+                raise HTTPException(status_code=response.status_code, detail="Failed to load patient data.")
+
+            async for entry in iter_bundle_entries(response.aiter_bytes(), parser):
+                check_deadline()
+                yield entry
+        finally:
+            await response.aclose()
+
+        record_payload(full_url, parser.bytes_read, parser.decode_seconds)
+        metrics.inc("fhir.stream.entries_seen", parser.entries_seen)
+        metrics.inc("fhir.stream.entries_skipped", parser.entries_seen - parser.entries_kept)
+
+    except HTTPException:
+        raise
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"FHIR server is unavailable: {exception_message(e)}")
+    except httpx.TimeoutException:
+        check_deadline()  # a read cut short by the deadline is reported as such
+        system_logger.error("Request to FHIR server timed out")
+        raise HTTPException(status_code=504, detail="Request to FHIR server timed out")
+    except httpx.RequestError as e:
+        system_logger.error(f"HTTP request failed: {exception_message(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to connect to FHIR server: {exception_message(e)}")
+    except json.JSONDecodeError as e:
+        system_logger.error(f"Failed to decode JSON response: {exception_message(e)}")
+        raise HTTPException(status_code=500, detail="Received invalid JSON from FHIR server")
+
+
 #### 路由
 ## [POST] : ascvd 2013 risk
 @app.post("/calculate_ascvd_risk", name="Get ASCVD 2013 Risk", description="Get ASCVD 2013 Risk in a dictionary: {'result': risk_result}")
@@ -409,48 +1428,51 @@ async def calculate_ascvd_risk(request: Request, user_input: UserRiskInput):
 
         # 確認這些變數的類型是否正確
         if not isinstance(has_diabetes, bool) or not isinstance(is_smoking, bool) or not isinstance(is_treating_htn, bool):
-            return jsonable_encoder({"error": "Invalid input data types for user risk factors."}), 400
+            return {"error": "Invalid input data types for user risk factors."}, 400
             
         try:
             # 取得用戶的健康記錄 (可從 get_records 函數中獲得)
-            records = await get_records(request)
+            records = await load_records(request)
+
+            pending = [name for name in ("Race", "Gender", "Age", "Cholesterol", "HDL", "Systolic BP") if records.get(name) == deadlineSettings.UNAVAILABLE]
+            if pending:
+                return {"error": f"{', '.join(pending)} {deadlineSettings.UNAVAILABLE.lower()}, please try again."}
 
             # 提取數據
             race = records.get("Race", "").strip()
             gender = records.get("Gender", "").strip()
-            age = records.get("Age", 0)
-            cholesterol = float(records.get("Cholesterol", "0").split(" ")[0])
-            hdl = float(records.get("HDL", "0").split(" ")[0])
-            sbp = float(records.get("Systolic BP", "0").split(" ")[0])
-
-            # 計算 ASCVD 風險百分比
-            group = _determine_population_group(race, gender)
-            ln_values = _calculate_ln_values(race, gender, age, cholesterol, hdl, sbp, has_diabetes, is_smoking, is_treating_htn)
-            value_sum = round(sum(ln_values.values()), 2)
-            mean_coefficient_value = _get_mean_coefficient_value(group)
-            baseline_survival = _get_baseline_survival(group)
-            
-            if mean_coefficient_value is None or baseline_survival is None:
+            values = {
+                **records,
+                "Race": race,
+                "Gender": gender,
+                "Age": records.get("Age", 0),
+                "has_diabetes": has_diabetes,
+                "is_smoking": is_smoking,
+                "is_treating_htn": is_treating_htn,
+            }
+
+            # 計算 ASCVD 風險百分比 (None: 無法判斷人群類別)
+            risk_percentage = calculation_graph.evaluate(values, ("ascvd_risk",), strict=True)["ascvd_risk"]
+
+            if risk_percentage is None:
                 return {"error": "Unable to determine population group or retrieve coefficients."}, 500
 
-            risk_percentage = _calculate_ascvd_risk(value_sum, mean_coefficient_value, baseline_survival)
-            
             # 生成風險回應文本
             if risk_percentage is not None:
                 risk_result = f"Risk of cardiovascular event (coronary or stroke death or non-fatal MI or stroke) in next 10 years: {risk_percentage:.1f}%"
             else:
                 risk_result = "Unable to determine the risk of cardiovascular event in next 10 years."
 
-            return jsonable_encoder({"result": risk_result})
+            return {"result": risk_result}
 
         except Exception as e:
             # 如果在處理 JSON 請求或計算中出現錯誤，將錯誤訊息回傳給前端
             system_logger.error(f"Error during risk calculation: {exception_message(e)}")
-            return jsonable_encoder({"error": f"Error during risk calculation: {exception_message(e)}"}), 500
+            return {"error": f"Error during risk calculation: {exception_message(e)}"}, 500
 
     except Exception as e:
         # 如果在獲取記錄或健康數據時出現錯誤，回傳錯誤訊息
-        return jsonable_encoder({"error": f"Server error: {exception_message(e)}"}), 500
+        return {"error": f"Server error: {exception_message(e)}"}, 500
     
 
 if __name__ == "__main__":
@@ -0,0 +1,49 @@
+"""
+Runs the get_records extractors and get_calculations calculators over a whole population,
+exported from the FHIR server with Bulk Data `$export` (Patient + Observation NDJSON).
+
+Usage:
+    python run_population.py [--base-url URL] [--work-dir DIR] [--token TOKEN] [--output FILE]
+
+The bearer token can also be given as BULK_EXPORT_TOKEN. Running again with the same --work-dir
+resumes an interrupted export or download instead of starting over. To try it locally:
+    python tools/bulk_export_server.py --port 8900 &
+    python run_population.py --base-url http://127.0.0.1:8900/fhir
+"""
+import os
+import json
+import asyncio
+import argparse
+import logging
+
+from icecream import ic
+
+from app.configs.config import bulkSettings
+from app.middleware.bulk_export import BulkExportClient
+from app.middleware.http_client import close_http_client
+from app.middleware.metrics import metrics
+from app.middleware.population import run_population
+
+
+async def main(args):
+    try:
+        client = BulkExportClient(args.base_url, args.work_dir, token=args.token)
+        files = await client.run()
+        summary = await run_population(files, args.output or os.path.join(args.work_dir, "results.ndjson"))
+    finally:
+        await close_http_client()
+
+    print(json.dumps({"summary": summary, "metrics": metrics.snapshot()["counters"]}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the calculators over a Bulk Data $export of a FHIR server.")
+    parser.add_argument("--base-url", default=bulkSettings.BASE_URL)
+    parser.add_argument("--work-dir", default=bulkSettings.WORK_DIR)
+    parser.add_argument("--token", default=os.environ.get("BULK_EXPORT_TOKEN"))
+    parser.add_argument("--output", default=None, help="results NDJSON (default: <work-dir>/results.ndjson)")
+
+    logging.basicConfig(level=logging.INFO)
+    ic.disable()  # extract_patient_info logs every Patient through icecream
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app is run from the repository root (`python main.py`); make its packages importable from the tests too
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
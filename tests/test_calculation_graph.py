@@ -0,0 +1,109 @@
+import pytest
+
+from app.configs.config import deadlineSettings
+from app.middleware.calculation_graph import CalculationGraph
+from app.middleware.record_builder import CALCULATION_ROWS, compute_calculations
+from app.routers.v1.endpoints.get_calculations import NOT_AVAILABLE
+
+
+@pytest.fixture
+def graph():
+    graph = CalculationGraph()
+    runs = graph.runs = []
+
+    @graph.register("double", ("x",), ("x2",))
+    def double(x):
+        runs.append("double")
+        return x * 2
+
+    @graph.register("sum", ("x2", "y"), ("total",), unavailable=("n/a",))
+    def total(x2, y):
+        runs.append("sum")
+        return x2 + y
+
+    @graph.register("ratio", ("x2", "y"), ("ratio", "inverse"), unavailable=("n/a", "n/a"))
+    def ratio(x2, y):
+        runs.append("ratio")
+        return x2 / y, y / x2
+
+    @graph.register("label", ("total",), ("label",))
+    def label(total):
+        runs.append("label")
+        return f"{total}!"
+
+    return graph
+
+
+def test_shared_intermediates_run_once(graph):
+    values = graph.evaluate({"x": 2, "y": 1}, ("total", "ratio", "label"))
+
+    assert (values["total"], values["ratio"], values["inverse"], values["label"]) == (5, 4.0, 0.25, "5!")
+    assert graph.runs == ["double", "sum", "ratio", "label"]
+
+
+def test_only_what_the_targets_need_runs(graph):
+    graph.evaluate({"x": 2, "y": 1}, ("x2",))
+
+    assert graph.runs == ["double"]
+
+
+def test_missing_inputs_skip_to_unavailable(graph):
+    values = graph.evaluate({"x": 2}, ("total", "ratio"))
+
+    assert values["total"] == "n/a"
+    assert (values["ratio"], values["inverse"]) == ("n/a", "n/a")
+    assert graph.runs == ["double"]
+
+
+def test_calculators_without_unavailable_leave_outputs_unknown_and_skip_dependents(graph):
+    values = graph.evaluate({"y": 1}, ("label",))
+
+    # double has no `unavailable`, so x2 stays unknown; sum gives "n/a", which label is then computed from
+    assert "x2" not in values
+    assert values["label"] == "n/a!"
+    assert graph.runs == ["label"]
+
+
+def test_calculation_errors_become_unavailable_unless_strict(graph):
+    assert graph.evaluate({"x": 2, "y": 0}, ("ratio",))["ratio"] == "n/a"
+
+    with pytest.raises(ZeroDivisionError):
+        graph.evaluate({"x": 2, "y": 0}, ("ratio",), strict=True)
+    with pytest.raises(ValueError, match="y not available for sum"):
+        graph.evaluate({"x": 2}, ("total",), strict=True)
+
+
+def test_timings_and_inputs(graph):
+    timings = {}
+    graph.evaluate({"x": 2, "y": 1}, ("total",), timings=timings)
+
+    assert set(timings) == {"double", "sum"}
+    assert graph.inputs_of("label") == ("x", "y")
+
+
+def test_outputs_have_one_producer_and_cycles_are_refused():
+    graph = CalculationGraph()
+    graph.register("a", ("b",), ("a",))(lambda b: b)
+    graph.register("b", ("a",), ("b",))(lambda a: a)
+
+    with pytest.raises(ValueError, match="already produced"):
+        graph.register("a2", ("x",), ("a",))(lambda x: x)
+    with pytest.raises(ValueError, match="depends on its own output"):
+        graph.plan(("a",))
+
+
+def test_record_calculations_without_creatinine():
+    record = {"Age": 60, "Gender": "female", "Weight": "No Weight data found", "Height": "No Height data found"}
+
+    calculations = compute_calculations(record)
+
+    assert list(calculations) == list(CALCULATION_ROWS)
+    assert set(calculations.values()) <= {NOT_AVAILABLE, NOT_AVAILABLE + "  "}
+
+
+def test_record_calculations_pending_on_unavailable_inputs():
+    record = {"Age": 60, "Gender": "female", "Weight": deadlineSettings.UNAVAILABLE}
+
+    calculations = compute_calculations(record, ("OST Index", "Creatinine Clearance"))
+
+    assert calculations == dict.fromkeys(("OST Index", "Creatinine Clearance"), deadlineSettings.UNAVAILABLE)
@@ -0,0 +1,32 @@
+import httpx
+import pytest
+
+from app.middleware import conditional_cache
+from app.middleware.conditional_cache import response_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    response_cache.invalidate()
+    yield
+    response_cache.invalidate()
+
+
+def _response(cache_control="max-age=60"):
+    return httpx.Response(200, headers={"ETag": '"v1"', "Cache-Control": cache_control}, content=b'{"resourceType": "Patient"}')
+
+
+def test_entries_are_scoped_to_the_token_that_fetched_them():
+    url = "https://fhir.example/Patient/p1"
+    conditional_cache.store((url, "token-a"), _response(), {"resourceType": "Patient"})
+
+    assert conditional_cache.lookup((url, "token-a")).body == {"resourceType": "Patient"}
+    assert conditional_cache.lookup((url, "token-b")) is None
+
+
+@pytest.mark.parametrize("cache_control", ["private, max-age=60", "no-store", "Private"])
+def test_private_and_no_store_responses_are_not_kept(cache_control):
+    key = ("https://fhir.example/Patient/p1", "token-a")
+    conditional_cache.store(key, _response(cache_control), {"resourceType": "Patient"})
+
+    assert conditional_cache.lookup(key) is None
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from app.middleware.json_stream import BundleEntryParser
+
+
+BUNDLE = {
+    "resourceType": "Bundle",
+    "type": "searchset",
+    "total": 3,
+    "link": [{"relation": "next", "url": "https://fhir.example/Observation?page=2&entry=[x]"}],
+    "entry": [
+        {"resource": {"resourceType": "Observation", "id": "a", "note": [{"text": 'braces { [ } ] and "quotes" \\ backslash\\'}]}},
+        {"resource": {"resourceType": "Observation", "id": "b", "valueString": "體重 83.5 公斤 — ✓", "entry": [{"nested": True}]}},
+        {"resource": {"resourceType": "OperationOutcome", "id": "c"}, "search": {"mode": "outcome"}},
+    ],
+    "meta": {"tag": [{"code": "\"entry\": ["}]},
+}
+RAW = json.dumps(BUNDLE, ensure_ascii=False, indent=1).encode()
+
+
+def parse(chunks, **kwargs):
+    parser = BundleEntryParser(**kwargs)
+    entries = [entry for chunk in chunks for entry in parser.feed(chunk)]
+    return entries, parser.close(), parser
+
+
+def skeleton_of(bundle):
+    return {**bundle, "entry": []}
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, len(RAW)])
+def test_any_chunk_size_gives_the_same_entries_and_skeleton(size):
+    entries, skeleton, _ = parse([RAW[i:i + size] for i in range(0, len(RAW), size)])
+
+    assert entries == BUNDLE["entry"]
+    assert skeleton == skeleton_of(BUNDLE)
+
+
+def test_every_split_point():
+    # Covers splits inside multi-byte characters, right after a backslash and between a key and its array
+    for split in range(1, len(RAW)):
+        entries, skeleton, _ = parse([RAW[:split], RAW[split:]])
+        assert entries == BUNDLE["entry"], split
+        assert skeleton == skeleton_of(BUNDLE), split
+
+
+def test_keep_and_prefilter_drop_entries_but_count_them():
+    entries, _, parser = parse(
+        [RAW[i:i + 16] for i in range(0, len(RAW), 16)],
+        prefilter=lambda raw: '"id": "b"' not in raw,
+        keep=lambda entry: entry["resource"]["resourceType"] == "Observation",
+    )
+
+    assert [entry["resource"]["id"] for entry in entries] == ["a"]
+    assert parser.entries_seen == 3
+    assert parser.entries_kept == 1
+    assert parser.bytes_read == len(RAW)
+
+
+def test_bundle_without_entries():
+    raw = json.dumps({"resourceType": "Bundle", "total": 0}).encode()
+
+    entries, skeleton, _ = parse([raw[:9], raw[9:]])
+
+    assert entries == []
+    assert skeleton == {"resourceType": "Bundle", "total": 0}
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from app.configs.config import plannerSettings
+from app.middleware.query_planner import QueryPlanner, ServerCapabilities
+
+
+ISS = "https://fhir.example/r4"
+
+
+@pytest.fixture
+def planner(monkeypatch):
+    planner = QueryPlanner()
+
+    async def fetch_capabilities(iss):
+        return ServerCapabilities(batch=True, include=True)
+
+    monkeypatch.setattr(planner, "_fetch_capabilities", fetch_capabilities)
+    return planner
+
+
+def test_fewest_round_trips_wins_and_failures_demote(planner):
+    assert asyncio.run(planner.plan(ISS, 10)).strategy == "batch"
+
+    planner.report_failure(ISS, "batch")
+    assert asyncio.run(planner.plan(ISS, 10)).strategy == "include"
+
+    planner.report_failure(ISS, "include")
+    planner.report_failure(ISS, "multi-code")
+    assert asyncio.run(planner.plan(ISS, 10)).strategy == "per-code"
+
+
+def test_failed_override_gives_way(planner, monkeypatch):
+    monkeypatch.setitem(plannerSettings.STRATEGY_OVERRIDES, ISS, "multi-code")
+    assert asyncio.run(planner.plan(ISS, 10)).strategy == "multi-code"
+
+    # Planning the failed override again would make get_records retry it forever
+    planner.report_failure(ISS, "multi-code")
+    assert asyncio.run(planner.plan(ISS, 10)).strategy == "batch"
+
+
+def test_invalidate_forgets_failures(planner):
+    planner.report_failure(ISS, "batch")
+    planner.invalidate(ISS)
+
+    assert asyncio.run(planner.plan(ISS, 10)).strategy == "batch"
+
+
+def test_metadata_failure_is_not_trusted_for_long(monkeypatch):
+    planner = QueryPlanner()
+    responses = [OSError("connection reset"), ServerCapabilities(batch=True)]
+
+    async def fetch_capabilities(iss):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(planner, "_fetch_capabilities", fetch_capabilities)
+
+    assert asyncio.run(planner.plan(ISS, 10)).strategy == "multi-code"
+    # Still within CAPABILITY_RETRY_TTL: the fallback is served without asking again
+    assert asyncio.run(planner.plan(ISS, 10)).strategy == "multi-code"
+
+    monkeypatch.setattr(plannerSettings, "CAPABILITY_RETRY_TTL", 0)
+    planner._capabilities[ISS] = (0, planner._capabilities[ISS][1])
+    assert asyncio.run(planner.plan(ISS, 10)).strategy == "batch"
+    assert responses == []
+
+
+def test_malformed_strategy_response_demotes_it(monkeypatch):
+    import httpx
+
+    import main
+    from app.configs.config import cacheSettings, credentialSettings
+    from app.middleware import http_client
+    from app.middleware.query_planner import query_planner
+
+    base = credentialSettings.BASE_URL
+    posts = []
+
+    def handler(request):
+        if request.url.path.endswith("/metadata"):
+            rest = {"mode": "server", "interaction": [{"code": "batch"}], "resource": [{"type": "Observation", "searchParam": [{"name": "code"}]}]}
+            return httpx.Response(200, json={"resourceType": "CapabilityStatement", "rest": [rest]})
+        if request.method == "POST":
+            # Every entry "succeeds" without its resource
+            posts.append(request.url)
+            entries = [{"response": {"status": "200 OK"}} for _ in main.json.loads(request.content)["entry"]]
+            return httpx.Response(200, json={"resourceType": "Bundle", "type": "batch-response", "entry": entries})
+        if request.url.path.endswith("/Patient/p1"):
+            return httpx.Response(200, json={"resourceType": "Patient", "id": "p1"})
+        return httpx.Response(200, json={"resourceType": "Bundle", "type": "searchset", "total": 0, "entry": []})
+
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(cacheSettings, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(main.client, "access_token", "t", raising=False)
+    query_planner.invalidate()
+
+    try:
+        for _ in range(2):
+            patient_json, results = asyncio.run(main.fetch_patient_record("p1", ["height", "weight"]))
+            assert patient_json["id"] == "p1"
+            assert set(results) == {"height", "weight"}
+
+        assert len(posts) == 1  # demoted after the first malformed batch response, not retried on every record
+        assert "batch" in query_planner.describe()[base]["demoted"]
+    finally:
+        query_planner.invalidate()
@@ -0,0 +1,39 @@
+import pytest
+
+from app.middleware.record_builder import (
+    CALCULATION_ROWS, PATIENT_FIELDS, RECORD_FIELDS, RECORD_FIELD_GROUPS, parse_fields, select_calculations, select_fields,
+)
+
+
+def test_parse_fields_keeps_the_endpoint_order_and_ignores_case():
+    first, second = RECORD_FIELDS[0], RECORD_FIELDS[1]
+
+    assert parse_fields(f" {second.upper()}, {first} ,,", RECORD_FIELDS, RECORD_FIELD_GROUPS) == (first, second)
+
+
+def test_parse_fields_expands_groups():
+    group = RECORD_FIELD_GROUPS[RECORD_FIELDS[0]]
+
+    assert parse_fields(group, RECORD_FIELDS, RECORD_FIELD_GROUPS) == tuple(
+        field for field in RECORD_FIELDS if RECORD_FIELD_GROUPS[field] == group
+    )
+
+
+def test_parse_fields_rejects_unknown_names():
+    with pytest.raises(ValueError, match="no-such-field"):
+        parse_fields("no-such-field", RECORD_FIELDS, RECORD_FIELD_GROUPS)
+
+
+def test_selection_reads_the_patient_only_when_needed():
+    observed = [field for field in RECORD_FIELDS if field not in PATIENT_FIELDS]
+
+    assert select_fields(PATIENT_FIELDS[:1]).patient
+    assert not select_fields(observed[:1]).patient
+    assert select_fields(observed[:1]).observations
+
+
+def test_calculation_selection_covers_its_inputs():
+    selection = select_calculations(CALCULATION_ROWS)
+
+    assert selection.patient
+    assert set(selection.record_fields) <= set(RECORD_FIELDS)
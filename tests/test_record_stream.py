@@ -0,0 +1,70 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app.configs.config import cacheSettings, credentialSettings, deadlineSettings
+from app.configs.reference import OBSERVATION_CODES
+from app.middleware import http_client
+from app.middleware.query_planner import query_planner
+
+
+BASE = credentialSettings.BASE_URL
+
+# A Patient without a name (extract_patient_info fails) and a blood pressure with a single component
+PATIENT = {"resourceType": "Patient", "id": "p1", "birthDate": "1960-05-01", "gender": "female"}
+BLOOD_PRESSURE = {"resourceType": "Observation", "id": "bp", "code": {"coding": [{"system": "http://loinc.org", "code": OBSERVATION_CODES["bp"]["code"]}]},
+                  "component": [{"valueQuantity": {"value": 120, "unit": "mm[Hg]"}}]}
+CAPABILITIES = {"resourceType": "CapabilityStatement", "rest": [{"mode": "server", "resource": [
+    {"type": "Observation", "searchParam": [{"name": "code"}, {"name": "patient"}]}, {"type": "Patient"},
+]}]}
+
+
+def handler(request):
+    if request.url.path.endswith("/metadata"):
+        return httpx.Response(200, json=CAPABILITIES)
+    if request.url.path.endswith("/Patient/p1"):
+        return httpx.Response(200, json=PATIENT)
+    if request.url.path.endswith("/Observation"):
+        entries = [{"resource": BLOOD_PRESSURE, "search": {"mode": "match"}}]
+        return httpx.Response(200, json={"resourceType": "Bundle", "type": "searchset", "total": 1, "entry": entries})
+    return httpx.Response(404, json={"resourceType": "OperationOutcome"})
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(cacheSettings, "RECORD_CACHE_ENABLED", False)
+    monkeypatch.setattr(cacheSettings, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setitem(main.cookie, "token", {"patient": "p1", "access_token": "t"})
+    monkeypatch.setattr(main.client, "access_token", "t", raising=False)
+    query_planner.invalidate()
+
+    yield TestClient(main.app)
+
+    query_planner.invalidate()
+
+
+def test_stream_survives_resources_that_cannot_be_extracted(client):
+    assert main.asyncio.run(query_planner.plan(BASE, len(OBSERVATION_CODES))).strategy == "multi-code"
+
+    response = client.get("/get_records/stream")
+    events = [block.split("\n") for block in response.text.strip().split("\n\n")]
+    values = {json.loads(data[6:])["field"]: json.loads(data[6:])["value"] for event, data in events if event != "event: summary"}
+
+    assert response.status_code == 200
+    assert events[-1][0] == "event: summary"
+    # The Patient costs only its own fields, the one-component blood pressure reads as a message
+    assert values["Name"] == deadlineSettings.UNAVAILABLE
+    assert values["Systolic BP"] == values["Diastolic BP"] == "Blood pressure components not found"
+    assert values["Creatinine"] == "No serum creatinine data found"
+
+
+def test_streamed_page_survives_resources_that_cannot_be_extracted(client):
+    response = client.get("/render_data?stream=true")
+
+    assert response.status_code == 200
+    assert "Blood pressure components not found" in response.text
+    assert response.text.rstrip().endswith("</html>")
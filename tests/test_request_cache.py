@@ -0,0 +1,53 @@
+import asyncio
+import types
+
+from app.middleware.request_cache import memoize_per_request
+
+
+def test_calls_differing_only_by_defaults_share_one_run():
+    calls = []
+
+    @memoize_per_request
+    async def load(request, selection=None, *, refresh=False):
+        calls.append((selection, refresh))
+        await asyncio.sleep(0)
+        return "records"
+
+    async def go():
+        request = types.SimpleNamespace(state=types.SimpleNamespace())
+        return await asyncio.gather(
+            load(request), load(request, None), load(request, selection=None), load(request, refresh=False),
+        )
+
+    assert asyncio.run(go()) == ["records"] * 4
+    assert calls == [(None, False)]
+
+
+def test_different_arguments_or_requests_run_again():
+    calls = []
+
+    @memoize_per_request
+    async def load(request, selection=None):
+        calls.append(selection)
+        return selection
+
+    async def go():
+        first = types.SimpleNamespace(state=types.SimpleNamespace())
+        second = types.SimpleNamespace(state=types.SimpleNamespace())
+        return [await load(first, "a"), await load(first, "b"), await load(first, "a"), await load(second, "a")]
+
+    assert asyncio.run(go()) == ["a", "b", "a", "a"]
+    assert calls == ["a", "b", "a"]
+
+
+def test_calls_without_a_request_state_are_not_memoized():
+    calls = []
+
+    @memoize_per_request
+    async def load(request):
+        calls.append(request)
+
+    asyncio.run(load(None))
+    asyncio.run(load(None))
+
+    assert calls == [None, None]
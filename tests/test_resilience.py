@@ -0,0 +1,121 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.configs.config import resilienceSettings
+from app.middleware.resilience import CircuitOpenError, get_breaker, resilient_send
+
+
+@pytest.fixture(autouse=True)
+def single_attempt(monkeypatch):
+    monkeypatch.setattr(resilienceSettings, "RETRY_ENABLED", False)
+    monkeypatch.setattr(resilienceSettings, "HEDGE_ENABLED", False)
+
+
+def half_open(host):
+    breaker = get_breaker(host)
+    breaker.state = "open"
+    breaker.opened_at = -resilienceSettings.BREAKER_RESET_TIMEOUT
+    return breaker
+
+
+def send_raising(error):
+    async def send():
+        raise error
+    return send
+
+
+def send_status(status):
+    async def send():
+        return httpx.Response(status)
+    return send
+
+
+@pytest.mark.parametrize("error", [RuntimeError("bug"), httpx.InvalidURL("bad url")])
+def test_probe_released_on_errors_that_say_nothing_about_the_host(error):
+    host = f"probe-{type(error).__name__.lower()}.example"
+    breaker = half_open(host)
+
+    with pytest.raises(type(error)):
+        asyncio.run(resilient_send(send_raising(error), f"https://{host}/Patient"))
+
+    assert breaker.state == "half-open"
+    # The next request gets to probe instead of being short-circuited forever
+    response = asyncio.run(resilient_send(send_status(200), f"https://{host}/Patient"))
+    assert response.status_code == 200
+    assert breaker.state == "closed"
+
+
+def test_throttled_probe_closes_the_circuit():
+    host = "probe-throttled.example"
+    breaker = half_open(host)
+
+    response = asyncio.run(resilient_send(send_status(429), f"https://{host}/Patient"))
+
+    assert response.status_code == 429
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens_the_circuit():
+    host = "probe-failed.example"
+    breaker = half_open(host)
+
+    asyncio.run(resilient_send(send_status(503), f"https://{host}/Patient"))
+
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(resilient_send(send_status(200), f"https://{host}/Patient"))
+
+
+def test_errors_outside_a_probe_leave_it_alone():
+    host = "probe-concurrent.example"
+    breaker = half_open(host)
+    assert breaker.check()
+
+    # Another request of the same host failing with a non-transport error must not free the running probe
+    breaker.state = "closed"
+    with pytest.raises(RuntimeError):
+        asyncio.run(resilient_send(send_raising(RuntimeError("bug")), f"https://{host}/Patient"))
+    breaker.state = "half-open"
+
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_streamed_response_holds_its_concurrency_slot_until_closed():
+    from app.middleware.concurrency_limiter import get_limiter
+
+    host = "streamed.example"
+    async def body():
+        for _ in range(10):
+            yield b"x" * 10
+
+    # An async iterator body, as a network response has (bytes content would be read up front)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body())))
+    limiter = get_limiter(host)
+
+    async def go():
+        request = client.build_request("GET", f"https://{host}/Observation")
+        response = await resilient_send(lambda: client.send(request, stream=True), str(request.url))
+        held = limiter.in_flight
+        body = await response.aread()
+        return held, body
+
+    held, body = asyncio.run(go())
+
+    assert held == 1
+    assert body == b"x" * 100
+    assert limiter.in_flight == 0
+
+
+def test_read_response_frees_its_concurrency_slot_at_once():
+    from app.middleware.concurrency_limiter import get_limiter
+
+    host = "buffered.example"
+    client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=b"x")))
+
+    response = asyncio.run(resilient_send(lambda: client.get(f"https://{host}/Observation"), f"https://{host}/Observation"))
+
+    assert response.content == b"x"
+    assert get_limiter(host).in_flight == 0
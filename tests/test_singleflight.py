@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from app.middleware.deadline import DeadlineExceeded, deadline_scope, remaining, within_deadline, without_deadline
+from app.middleware.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flights = SingleFlight("test")
+    runs = []
+
+    async def fetch():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "body"
+
+    async def go():
+        return await asyncio.gather(*(flights.do("key", fetch) for _ in range(5)))
+
+    assert asyncio.run(go()) == ["body"] * 5
+    assert len(runs) == 1
+    assert flights.in_flight() == 0
+
+
+def test_followers_keep_their_own_budget():
+    flights = SingleFlight("test")
+    budgets = []
+
+    async def fetch():
+        budgets.append(remaining())
+        await asyncio.sleep(0.05)
+        return "body"
+
+    async def call(seconds):
+        with deadline_scope(seconds):
+            return await within_deadline(flights.do("key", fetch, context=without_deadline()))
+
+    async def go():
+        return await asyncio.gather(call(0.01), call(1.0), return_exceptions=True)
+
+    leader, follower = asyncio.run(go())
+
+    # The leader's short budget runs out, but neither it nor its deadline reaches the shared call
+    assert isinstance(leader, DeadlineExceeded)
+    assert follower == "body"
+    assert budgets == [None]
+
+
+def test_exceptions_reach_every_caller():
+    flights = SingleFlight("test")
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream")
+
+    async def go():
+        return await asyncio.gather(flights.do("key", fetch), flights.do("key", fetch), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(go()))
@@ -0,0 +1,76 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.configs.config import discoverySettings
+from app.middleware import smart_discovery as discovery_module
+from app.middleware.smart_discovery import SmartDiscovery
+
+
+ISS = "https://fhir.example/r4"
+CONFIGURATION = {"authorization_endpoint": "https://fhir.example/authorize", "token_endpoint": "https://fhir.example/token"}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = type("Server", (), {"calls": 0, "body": CONFIGURATION})()
+
+    def handler(request):
+        server.calls += 1
+        return httpx.Response(200, json=server.body)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(discovery_module, "get_http_client", lambda: client)
+    return server
+
+
+def test_loaded_on_first_use_and_then_cached(server):
+    discovery = SmartDiscovery()
+    assert server.calls == 0
+
+    async def go():
+        return await asyncio.gather(discovery.get(ISS), discovery.get(ISS)), await discovery.get(ISS)
+
+    (first, second), third = asyncio.run(go())
+
+    assert first == second == third == CONFIGURATION
+    assert server.calls == 1  # the concurrent first uses share one request
+
+
+def test_stale_configuration_is_served_while_refreshed(server):
+    discovery = SmartDiscovery()
+    stale = {**CONFIGURATION, "token_endpoint": "https://fhir.example/old-token"}
+
+    async def go():
+        discovery._configs[ISS] = (discovery_module.time.monotonic() - discoverySettings.REFRESH_AFTER - 1, stale)
+        served = await discovery.get(ISS)
+        await asyncio.sleep(0.05)  # let the background refresh land
+        return served, await discovery.get(ISS)
+
+    served, refreshed = asyncio.run(go())
+
+    assert served == stale
+    assert refreshed == CONFIGURATION
+    assert server.calls == 1
+
+
+def test_expired_configuration_is_refetched_before_use(server):
+    discovery = SmartDiscovery()
+    discovery._configs[ISS] = (discovery_module.time.monotonic() - discoverySettings.TTL - 1, {})
+
+    assert asyncio.run(discovery.get(ISS)) == CONFIGURATION
+    assert server.calls == 1
+
+
+@pytest.mark.parametrize("body", [["not", "an", "object"], {"token_endpoint": "https://fhir.example/token"}])
+def test_malformed_configuration_is_rejected_and_not_cached(server, body):
+    discovery = SmartDiscovery()
+    server.body = body
+
+    with pytest.raises(ValueError):
+        asyncio.run(discovery.get(ISS))
+
+    server.body = CONFIGURATION
+    assert asyncio.run(discovery.get(ISS)) == CONFIGURATION
+    assert server.calls == 2
@@ -0,0 +1,68 @@
+import pytest
+
+from app.middleware.timeseries import Bucket, Point, TimeSeries, build_series, format_time, parse_time
+from app.models.observation import Quantity
+
+
+@pytest.fixture
+def series():
+    # Given out of order, with two values sharing t=20
+    return TimeSeries("kg", [(30, 3.0), (10, 1.0), (20, 2.0), (20, 2.5), (40, 4.0)])
+
+
+def test_as_of_bisects_on_time(series):
+    assert series.as_of(9.9) is None
+    assert series.as_of(10) == Point(10, 1.0)
+    assert series.as_of(19.9) == Point(10, 1.0)
+    assert series.as_of(20) == Point(20, 2.5)  # the last of the values sharing the time
+    assert series.as_of(1000) == Point(40, 4.0)
+
+
+def test_between_includes_both_bounds(series):
+    assert [point.value for point in series.between(20, 30)] == [2.0, 2.5, 3.0]
+    assert [point.value for point in series.between(end=10)] == [1.0]
+    assert [point.value for point in series.between(start=40)] == [4.0]
+    assert series.between(31, 39) == []
+    assert series.between(30, 20) == []
+
+
+def test_downsample_buckets_are_half_open_but_the_last():
+    series = TimeSeries("kg", [(0, 1.0), (5, 2.0), (10, 3.0), (15, 4.0), (20, 5.0)])
+
+    # [0, 10) [10, 20]: a value on a bucket edge goes to the later bucket, and the end is in the last one
+    assert series.downsample(2) == [Bucket(0, 10, 2, 1.0, 2.0, 1.5), Bucket(10, 20, 3, 3.0, 5.0, 4.0)]
+
+
+def test_downsample_leaves_out_empty_buckets_and_values_outside_the_range():
+    series = TimeSeries("kg", [(0, 1.0), (1, 2.0), (99, 5.0), (200, 9.0)])
+
+    buckets = series.downsample(4, 0, 100)
+
+    assert [(bucket.start, bucket.count) for bucket in buckets] == [(0, 2), (75, 1)]
+    assert buckets[-1].end == 100
+    assert TimeSeries("kg").downsample(3) == []
+
+
+def test_parse_time_accepts_partial_dates_and_offsets():
+    assert parse_time("2020") == parse_time("2020-01-01") == parse_time("2020-01-01T00:00:00Z")
+    assert parse_time("2020-05") == parse_time("2020-05-01")
+    assert parse_time("2020-05-01T08:00:00+08:00") == parse_time("2020-05-01T00:00:00Z")
+    assert format_time(parse_time("2020-05-01T00:00:00Z")) == "2020-05-01T00:00:00Z"
+
+    with pytest.raises(ValueError):
+        parse_time("yesterday")
+
+
+def test_build_series_keeps_one_unit_and_timed_quantities():
+    series = build_series([
+        ("Weight", Quantity(80.0, "kg", "2020-01-01")),
+        ("Weight", Quantity(176.0, "lb", "2020-02-01")),  # another unit: not converted, left out
+        ("Weight", Quantity(81.0, "kg", None)),
+        ("Weight", Quantity(82.0, "kg", "not a time")),
+        ("Weight", "No Weight data found"),
+        ("Height", Quantity(170.0, "cm", "2020-01-01")),
+    ])
+
+    assert series["Weight"].unit == "kg"
+    assert list(series["Weight"].values) == [80.0]
+    assert list(series["Height"].values) == [170.0]
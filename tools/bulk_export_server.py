@@ -0,0 +1,163 @@
+"""
+Local stand-in for a FHIR Bulk Data `$export` server, for trying run_population.py without an EHR.
+
+It serves a synthetic population (Patients plus the OBSERVATION_CODES Observations): the kick-off
+answers 202, the status endpoint stays "in progress" for a few polls, and the NDJSON files support
+`Range` requests. With --interrupt, the first download of every file is cut off halfway, to check
+that a second run resumes the downloads.
+
+Usage:
+    python tools/bulk_export_server.py [--port 8900] [--patients 1000] [--polls 2] [--interrupt]
+"""
+import os
+import sys
+import json
+import uuid
+import random
+import argparse
+import datetime
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.configs.reference import OBSERVATION_CODES
+
+
+VALUES = {
+    "height": (150, 195, "cm"),
+    "weight": (45, 120, "kg"),
+    "bmi": (17, 40, "kg/m2"),
+    "hdl": (30, 90, "mg/dL"),
+    "ldl": (60, 200, "mg/dL"),
+    "tg": (50, 300, "mg/dL"),
+    "chol": (120, 300, "mg/dL"),
+    "scr": (0.5, 2.0, "mg/dL"),
+    "glucose": (70, 200, "mg/dL"),
+}
+
+
+def _patient(index, rng):
+    return {
+        "resourceType": "Patient",
+        "id": f"p{index}",
+        "name": [{"given": [rng.choice(["Ann", "Bo", "Cy", "Di", "Ed"])], "family": f"Test{index}"}],
+        "gender": rng.choice(["male", "female"]),
+        "birthDate": f"{rng.randint(1940, 1990)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+        "extension": [
+            {"extension": [{}, {"valueString": rng.choice(["White", "Black or African American", "Asian"])}]},
+            {"extension": [{}, {"valueString": "Not Hispanic or Latino"}]},
+        ],
+    }
+
+
+def _observations(index, rng):
+    for name, observation in OBSERVATION_CODES.items():
+        for version in range(rng.randint(1, 3)):
+            resource = {
+                "resourceType": "Observation",
+                "id": f"p{index}-{name}-{version}",
+                "status": "final",
+                "code": {"coding": [{"system": "http://loinc.org", "code": observation["code"]}]},
+                "subject": {"reference": f"Patient/p{index}"},
+                "effectiveDateTime": (datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randint(0, 1500))).isoformat(),
+            }
+            if name == "bp":
+                resource["component"] = [
+                    {"code": {"coding": [{"code": "8480-6"}]}, "valueQuantity": {"value": rng.randint(100, 160), "unit": "mm[Hg]"}},
+                    {"code": {"coding": [{"code": "8462-4"}]}, "valueQuantity": {"value": rng.randint(60, 100), "unit": "mm[Hg]"}},
+                ]
+            elif name == "smoking":
+                resource["valueCodeableConcept"] = {"text": rng.choice(["Never smoker", "Former smoker"])}
+            else:
+                low, high, unit = VALUES[name]
+                resource["valueQuantity"] = {"value": round(rng.uniform(low, high), 1), "unit": unit}
+            yield resource
+
+
+def build_files(patients, seed=0):
+    rng = random.Random(seed)
+    files = {"Patient.ndjson": [], "Observation-1.ndjson": [], "Observation-2.ndjson": []}
+
+    for index in range(patients):
+        files["Patient.ndjson"].append(json.dumps(_patient(index, rng)))
+        for resource in _observations(index, rng):
+            files[f"Observation-{1 + index % 2}.ndjson"].append(json.dumps(resource))
+
+    return {name: ("\n".join(lines) + "\n").encode() for name, lines in files.items()}
+
+
+def create_app(patients=1000, polls=2, interrupt=False):
+    app = FastAPI(title="Bulk Data $export stand-in")
+    files = build_files(patients)
+    jobs = {}  # job id -> polls left before completion
+    interrupted = set()
+
+    @app.get("/fhir/$export")
+    async def kick_off(request: Request):
+        job = uuid.uuid4().hex
+        jobs[job] = polls
+        return Response(status_code=202, headers={"Content-Location": str(request.url_for("status", job=job))})
+
+    @app.get("/fhir/$export-status/{job}", name="status")
+    async def status(request: Request, job: str):
+        if job not in jobs:
+            return JSONResponse({"resourceType": "OperationOutcome"}, status_code=404)
+
+        if jobs[job] > 0:
+            jobs[job] -= 1
+            return Response(status_code=202, headers={"X-Progress": f"{polls - jobs[job]}/{polls + 1}", "Retry-After": "1"})
+
+        return JSONResponse({
+            "transactionTime": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "request": str(request.url),
+            "requiresAccessToken": False,
+            "output": [
+                {"type": name.split(".")[0].split("-")[0], "url": str(request.url_for("file", name=name))}
+                for name in files
+            ],
+            "error": [],
+        })
+
+    @app.delete("/fhir/$export-status/{job}")
+    async def delete(job: str):
+        jobs.pop(job, None)
+        return Response(status_code=202)
+
+    @app.get("/fhir/files/{name}", name="file")
+    async def file(request: Request, name: str):
+        content = files[name]
+        start = 0
+
+        range_header = request.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            start = int(range_header[len("bytes="):].split("-")[0])
+            if start >= len(content):
+                return Response(status_code=416, headers={"Content-Range": f"bytes */{len(content)}"})
+
+        if interrupt and name not in interrupted:
+            interrupted.add(name)
+
+            async def cut_off():
+                yield content[start:len(content) // 2]
+                raise ConnectionResetError("interrupted on purpose")
+
+            return StreamingResponse(cut_off(), media_type="application/fhir+ndjson")
+
+        headers = {"Content-Range": f"bytes {start}-{len(content) - 1}/{len(content)}"} if start else {}
+        return Response(content[start:], status_code=206 if start else 200, media_type="application/fhir+ndjson", headers=headers)
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in FHIR Bulk Data $export server")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--polls", type=int, default=2, help="status polls answered 'in progress' before completion")
+    parser.add_argument("--interrupt", action="store_true", help="cut off the first download of every file")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.patients, args.polls, args.interrupt), host="127.0.0.1", port=args.port)